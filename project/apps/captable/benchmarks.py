@@ -0,0 +1,250 @@
+from __future__ import division
+
+import datetime
+import multiprocessing
+import random
+import resource
+import time
+
+from django.db import connection, transaction
+from django.db.models import get_model
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from .constants import *
+
+from .factories import (
+    InvestorFactory,
+    ShareholderFactory,
+    AdditionFactory,
+    CertificateFactory,
+    CommonSecurity,
+    PreferredSecurity,
+    ConvertibleSecurity,
+    OptionSecurity,
+    WarrantSecurity,
+)
+
+from .managers import share_price, proforma
+from .rollups import rebuild
+from .cache import bump_version
+from .generators import clear_captable
+
+
+SIZES = [10, 1000, 10000, 100000]
+
+# The share of the certificates of each type of security, roughly that
+# of a venture backed company with a broad option plan.
+MIX = [
+    (SECURITY_TYPE_OPTION, .70),
+    (SECURITY_TYPE_COMMON, .10),
+    (SECURITY_TYPE_PREFERRED, .12),
+    (SECURITY_TYPE_CONVERTIBLE, .04),
+    (SECURITY_TYPE_WARRANT, .04),
+]
+
+VIEWS = [
+    ('summary', '/summary/'),
+    ('financing_summary', '/financing/10000000,40000000,20'),
+    ('liquidation_summary', '/liquidation/100000000'),
+    ('investor_list', '/investor/'),
+    ('certificate_list', '/certificate/'),
+]
+
+def synthetic_captable(certificates, seed=0):
+    """Build a cap table with the given number of certificates.
+
+    The rows are built by the factories, without saving, and written
+    with ``bulk_create``; certificates are split across all five types
+    of security according to ``MIX``, with at least one of each and the
+    remainder granted as options.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    investor = get_model('captable', 'Investor')
+    shareholder = get_model('captable', 'Shareholder')
+    addition = get_model('captable', 'Addition')
+    certificate = get_model('captable', 'Certificate')
+
+    with transaction.atomic():
+        investors = [
+            InvestorFactory.build(
+                name='Investor {0}'.format(n), slug='investor-{0}'.format(n))
+            for n in range(max(1, certificates // 10))]
+        investor.objects.bulk_create(investors)
+        investors = list(investor.objects.order_by('pk'))
+        shareholders = [
+            ShareholderFactory.build(
+                name='Shareholder {0}'.format(n), investor=i)
+            for n, i in enumerate(investors)]
+        shareholder.objects.bulk_create(shareholders)
+        shareholders = list(shareholder.objects.order_by('pk'))
+
+        securities = {
+            SECURITY_TYPE_COMMON: CommonSecurity(
+                name='Common Stock', price_per_share=.001, pre=7000),
+            SECURITY_TYPE_PREFERRED: PreferredSecurity(
+                name='Series A', price_per_share=.625, pre=5000000,
+                seniority=2),
+            SECURITY_TYPE_CONVERTIBLE: ConvertibleSecurity(
+                name='Convertible', conversion_ratio=1, pre=5000000,
+                price_per_share=.625, price_cap=5000000, seniority=2),
+            SECURITY_TYPE_OPTION: OptionSecurity(name='Option Plan'),
+            SECURITY_TYPE_WARRANT: WarrantSecurity(name='Warrants'),
+        }
+        addition.objects.bulk_create([
+            AdditionFactory.build(security=s, authorized=certificates * 100000)
+            for s in securities.values()])
+
+        counts = dict(
+            (t, max(1, int(round(certificates * share)))) for t, share in MIX)
+        counts[SECURITY_TYPE_OPTION] = max(1, certificates - sum(
+            n for t, n in counts.items() if t != SECURITY_TYPE_OPTION))
+
+        rows = []
+        for security_type, share in MIX:
+            security = securities[security_type]
+            for n in range(counts[security_type]):
+                name = '{0}-{1}'.format(security.slug, n)
+                terms = {
+                    'name': name,
+                    'slug': name,
+                    'security': security,
+                    'shareholder': rng.choice(shareholders),
+                    'date': today - datetime.timedelta(rng.randint(0, 1800)),
+                    'vesting_start': today - datetime.timedelta(
+                        rng.randint(0, 1800)),
+                    'shares': 0,
+                }
+                if security_type in [SECURITY_TYPE_COMMON, SECURITY_TYPE_PREFERRED]:
+                    terms['shares'] = rng.randint(1000, 1000000)
+                    terms['cash'] = terms['shares'] * security.price_per_share
+                    terms['is_prorata'] = rng.random() < .5
+                elif security_type == SECURITY_TYPE_CONVERTIBLE:
+                    terms['principal'] = rng.randint(10, 500) * 1000
+                else:
+                    terms['granted'] = rng.randint(100, 100000)
+                    terms['cancelled'] = rng.randint(0, terms['granted'] // 10)
+                    terms['vesting_term'] = 48
+                    terms['vesting_cliff'] = 12
+                rows.append(CertificateFactory.build(**terms))
+        certificate.objects.bulk_create(rows, batch_size=500)
+
+        # ``bulk_create`` sends no signals, so bring the rollups up to
+        # date, and the cap table version once it is committed.
+        for security in securities.values():
+            rebuild(security)
+    bump_version()
+
+
+def maxrss():
+    """Return the peak resident set size of the process, in kilobytes."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and OS X bytes.
+    if maxrss > 1 << 32:
+        maxrss = maxrss // 1024
+    return maxrss
+
+
+def _peak(run, pipe):
+    start = maxrss()
+    try:
+        run()
+        pipe.send(maxrss() - start)
+    except Exception:
+        pipe.send(None)
+    finally:
+        pipe.close()
+
+
+def peak_memory(run):
+    """Return how far a callable grows the peak memory, in kilobytes.
+
+    The peak resident set size only ever rises over the life of a
+    process, so the callable is run in a worker forked for it alone and
+    the growth of the worker's peak over its size at the fork is
+    returned; ``None`` if the callable failed.  The worker shares the
+    database connection while this process waits for it.
+    """
+    receive, send = multiprocessing.Pipe(False)
+    worker = multiprocessing.Process(target=_peak, args=(run, send))
+    worker.start()
+    send.close()
+    try:
+        return receive.recv()
+    except EOFError:
+        return None
+    finally:
+        worker.join()
+
+
+def measure(name, size, run, repeat=3):
+    """Time a callable, counting its queries and the peak memory."""
+    seconds = []
+    queries = None
+    for _ in range(repeat):
+        # Measure the calculation, not the result cache.
+        bump_version()
+        with CaptureQueriesContext(connection) as context:
+            start = time.time()
+            run()
+            seconds.append(time.time() - start)
+        queries = len(context.captured_queries)
+    bump_version()
+    return {
+        'target': name,
+        'certificates': size,
+        'seconds': min(seconds),
+        'runs': seconds,
+        'queries': queries,
+        'peak_memory_kb': peak_memory(run),
+    }
+
+
+def targets():
+    """Yield the name and a callable of everything to benchmark."""
+    client = Client()
+    certificate = get_model('captable', 'Certificate')
+    security = get_model('captable', 'Security')
+
+    def view(url):
+        def run():
+            response = client.get(url)
+            assert response.status_code == 200, url
+        return run
+
+    for name, url in VIEWS:
+        yield 'views.' + name, view(url)
+    yield 'managers.share_price', lambda: share_price(100000000)
+    yield 'managers.proforma', lambda: proforma(10000000, 40000000, .2)
+    for metric in ['outstanding', 'converted', 'diluted', 'liquidated']:
+        yield ('managers.CertificateQuerySet.' + metric,
+               lambda metric=metric: getattr(certificate.objects.all(), metric))
+    yield ('managers.SecurityQuerySet.diluted',
+           lambda: security.objects.diluted)
+
+
+def run_benchmarks(sizes=None, repeat=3, only=None, log=None):
+    """Benchmark every target against synthetic cap tables of each size.
+
+    Runs against whatever database is configured, replacing the cap
+    table in it; the ``benchmark`` command runs it in a test database.
+    Returns a list of results, one per target and size.
+    """
+    results = []
+    for size in sizes or SIZES:
+        clear_captable()
+        start = time.time()
+        synthetic_captable(size)
+        if log:
+            log("Generated {0} certificates in {1:.2f}s".format(
+                size, time.time() - start))
+        for name, run in targets():
+            if only and not any(o in name for o in only):
+                continue
+            result = measure(name, size, run, repeat)
+            results.append(result)
+            if log:
+                log("{target} at {certificates}: {seconds:.4f}s, "
+                    "{queries} queries".format(**result))
+    return results
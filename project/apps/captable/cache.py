@@ -0,0 +1,200 @@
+import datetime
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+
+
+_local = threading.local()
+
+
+# Numbers each set of values a scope caches, across threads.
+_generations = itertools.count()
+
+
+def open_scope():
+    """Start caching cap table totals on the current thread.
+
+    Scopes nest; values are kept until the outermost scope closes.
+    """
+    if not getattr(_local, 'depth', 0):
+        _local.values = {}
+        _local.generation = next(_generations)
+    _local.depth = getattr(_local, 'depth', 0) + 1
+
+
+def close_scope():
+    _local.depth = max(0, getattr(_local, 'depth', 0) - 1)
+    if not _local.depth:
+        _local.values = None
+        _local.generation = None
+
+
+def generation():
+    """Return the number of the values cached in the current scope.
+
+    The number changes whenever the values are discarded, so anything
+    remembered elsewhere for as long as they are can be tagged with it.
+    Outside of a scope it is None.
+    """
+    return getattr(_local, 'generation', None)
+
+
+@contextmanager
+def cache_scope():
+    """Cache cap table totals for the duration of a block.
+
+    The rata and prorata of every certificate, investor and security
+    share the same denominators -- the fully diluted, converted and
+    outstanding totals of the whole cap table -- each of which walks
+    every certificate.  Within a scope each is calculated only once.
+    """
+    open_scope()
+    try:
+        yield
+    finally:
+        close_scope()
+
+
+def cached(key, calculate):
+    """Return the value cached under ``key`` in the current scope.
+
+    The value is calculated, and cached, if need be.  Outside of a scope
+    nothing is cached and the value is always calculated.
+    """
+    values = getattr(_local, 'values', None)
+    if values is None:
+        return calculate()
+    if key not in values:
+        values[key] = calculate()
+    return values[key]
+
+
+def memoize(method):
+    """Cache the results of a model method in the current scope.
+
+    Results are keyed on the model, the primary key of the instance, the
+    method and its arguments, so every call for the same row with the
+    same arguments within a request -- from a view or a template, on the
+    same instance or another -- is calculated once.  Calls on unsaved
+    instances, or with arguments that can't be hashed, such as the
+    ``price`` dictionary of ``share_price``, aren't cached.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.pk is None:
+            return method(self, *args, **kwargs)
+        key = (self._meta.model_name, self.pk, method.__name__, args,
+               tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        return cached(key, lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+def clear(*args, **kwargs):
+    """Discard the values cached in the current scope.
+
+    Called whenever the cap table moves on to a new version.
+    """
+    values = getattr(_local, 'values', None)
+    if values is not None:
+        values.clear()
+        _local.generation = next(_generations)
+
+
+VERSION_KEY = 'captable:version'
+
+
+def version():
+    """Return the current version of the cap table.
+
+    The version starts at the current time, in milliseconds, so that
+    should the cache lose it the new version cannot collide with one
+    which results have already been stored under.
+    """
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def bump_version(*args, **kwargs):
+    """Move the cap table on to a new version.
+
+    Connected to the ``post_save`` and ``post_delete`` signals of every
+    model in the cap table.  Results stored under earlier versions are
+    never read again and are left for the cache to evict.  A change made
+    in a transaction isn't seen by other processes until it commits, and
+    until then they may store results of the rows before it under the
+    new version, so the version is moved on again by ``committed`` once
+    the transaction is over.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        version()
+    clear()
+    _local.pending = connection.in_atomic_block
+
+
+def committed():
+    """Move the cap table on to a new version once a transaction that
+    changed it is over.
+
+    Called at the end of every request, before results are read and by
+    the bulk writers after their transactions.
+    """
+    if getattr(_local, 'pending', False) and not connection.in_atomic_block:
+        bump_version()
+
+
+def shared():
+    """Whether results may be stored in the cache across requests.
+
+    Every process serving the cap table has to see the same version of
+    it, which a local memory cache doesn't share, so unless the
+    ``VERSIONED_CACHE`` setting says otherwise results are only stored
+    in a cache of another kind.
+    """
+    setting = getattr(settings, 'VERSIONED_CACHE', None)
+    if setting is not None:
+        return setting
+    return not isinstance(cache, LocMemCache)
+
+
+def versioned(key, calculate):
+    """Return a result stored in the cache for the current cap table.
+
+    The summary, financing and liquidation results only change with the
+    cap table itself, which changes rarely, and with the date, as shares
+    vest and notes accrue.  They are stored in the cache framework under
+    the version of the cap table they were calculated from and the date,
+    until midnight.  The value is calculated, and stored, if need be.
+    Without a ``shared`` cache results are kept for the current scope
+    only.
+    """
+    committed()
+    today = datetime.date.today()
+    key = '{0}:{1}'.format(key, today.isoformat())
+    if not shared():
+        return cached(('versioned', key), calculate)
+
+    current = version()
+    value = cache.get(key, version=current)
+    if value is None:
+        value = calculate()
+        midnight = datetime.datetime.combine(
+            today + datetime.timedelta(1), datetime.time())
+        timeout = (midnight - datetime.datetime.now()).total_seconds()
+        cache.set(key, value, max(1, int(timeout)), version=current)
+    return value
@@ -16,3 +16,18 @@ STATUS_CANCELLED = 2
 STATUS_TRANSFERRED = 3
 STATUS_EXERCISED = 4
 STATUS_CONVERTED = 6
+
+# Outcomes of each seniority in the liquidation waterfall.
+WATERFALL_SHORTFALL = 1
+WATERFALL_PREFERENCE = 2
+WATERFALL_PARTICIPATING = 3
+WATERFALL_CONVERTED = 4
+WATERFALL_EXHAUSTED = 5
+
+WATERFALL_OUTCOMES = {
+    WATERFALL_SHORTFALL: "Preference not covered",
+    WATERFALL_PREFERENCE: "Preference",
+    WATERFALL_PARTICIPATING: "Participating",
+    WATERFALL_CONVERTED: "Converted",
+    WATERFALL_EXHAUSTED: "Nothing remaining",
+}
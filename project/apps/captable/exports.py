@@ -0,0 +1,136 @@
+import csv
+
+from django.db.models import get_model
+from django.http import StreamingHttpResponse
+
+from .templatetags.captabletags import (
+    shares,
+    currency,
+    percentage,
+    price,
+    ratio,
+)
+
+
+# The columns of each export, as the header, the key of the row and the
+# ``captabletags`` filter the tables format the value with.
+SUMMARY_COLUMNS = [
+    ('Type', 'security_type_display', None),
+    ('Series', 'name', None),
+    ('Conversion Ratio', 'conversion_ratio', ratio),
+    ('Authorized', 'authorized', shares),
+    ('Outstanding', 'outstanding', shares),
+    ('Outstanding Rata', 'outstanding_rata', percentage),
+    ('Converted', 'converted', shares),
+    ('Converted Rata', 'converted_rata', percentage),
+    ('Diluted', 'diluted', shares),
+    ('Diluted Rata', 'diluted_rata', percentage),
+]
+
+FINANCING_COLUMNS = [
+    ('Investor', 'name', None),
+    ('Pre Shares', 'pre_shares', shares),
+    ('Pre Cash', 'pre_cash', currency),
+    ('Pre Rata', 'pre_rata', percentage),
+    ('New Shares', 'new_shares', shares),
+    ('New Cash', 'new_cash', currency),
+    ('Post Shares', 'post_shares', shares),
+    ('Post Cash', 'post_cash', currency),
+    ('Post Rata', 'post_rata', percentage),
+    ('Price', 'price', price),
+]
+
+LIQUIDATION_COLUMNS = [
+    ('Investor', 'name', None),
+    ('Preference', 'preference', currency),
+    ('Liquidated', 'liquidated', shares),
+    ('Proceeds', 'proceeds', currency),
+    ('Proceeds Rata', 'proceeds_rata', percentage),
+]
+
+LEDGER_COLUMNS = [
+    ('Certificate', 'name', None),
+    ('Date', 'date', None),
+    ('Shareholder', 'shareholder', None),
+    ('Investor', 'investor', None),
+    ('Security', 'security', None),
+    ('Outstanding', 'outstanding', shares),
+    ('Paid', 'paid', currency),
+    ('Vested', 'vested', shares),
+    ('Converted', 'converted', shares),
+    ('Diluted', 'diluted', shares),
+    ('Liquidated', 'liquidated', shares),
+    ('Preference', 'preference', currency),
+]
+
+
+class Echo(object):
+    """A file-like object that hands back whatever is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def stream_csv(filename, columns, rows):
+    """Return a response streaming rows as CSV as they are produced.
+
+    ``rows`` is any iterable of dictionaries, which is only consumed as
+    the response is sent, so a generator keeps memory flat however many
+    rows there are.
+    """
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow([header for header, key, format in columns])
+        for row in rows:
+            yield writer.writerow([
+                encode(format(row.get(key)) if format else row.get(key))
+                for header, key, format in columns])
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="{0}"'.format(
+        filename)
+    return response
+
+
+def ledger(chunk_size=1000):
+    """Yield every certificate, with its calculations, one at a time.
+
+    The certificates are read in chunks, in order of their primary keys,
+    so only one chunk is held in memory at a time.
+    """
+    certificate = get_model('captable', 'Certificate')
+    certificates = certificate.objects.select_related(
+        'security', 'shareholder__investor').order_by('pk')
+    last = None
+    while True:
+        chunk = certificates
+        if last is not None:
+            chunk = chunk.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        for c in chunk:
+            yield {
+                'name': c.name,
+                'date': c.date,
+                'shareholder': c.shareholder.name,
+                'investor': c.shareholder.investor.name,
+                'security': c.security.name,
+                'outstanding': c.outstanding,
+                'paid': c.paid,
+                'vested': c.vested,
+                'converted': c.converted,
+                'diluted': c.diluted,
+                'liquidated': c.liquidated,
+                'preference': c.preference,
+            }
+        last = chunk[-1].pk
@@ -0,0 +1,214 @@
+from __future__ import division
+
+import datetime
+import random
+
+from dateutil.relativedelta import relativedelta
+
+from django.db import connection, transaction
+from django.db.models import get_model
+from django.utils.text import slugify
+
+from .constants import *
+
+from .rollups import rebuild
+from .cache import bump_version
+
+
+TABLES = [
+    'Certificate', 'Addition', 'SecurityRollup', 'Shareholder', 'Security',
+    'Investor']
+
+
+def clear_captable():
+    """Delete every row of the cap table, without any signals."""
+    cursor = connection.cursor()
+    for name in TABLES:
+        cursor.execute('DELETE FROM {0}'.format(
+            connection.ops.quote_name(
+                get_model('captable', name)._meta.db_table)))
+    bump_version()
+
+
+def generate_captable(investors=100, options=1000, rounds=2, convertibles=10,
+                      warrants=5, founders=2, seed=None, batch_size=None):
+    """Generate a realistic cap table of any size.
+
+    The company is founded five years ago by ``founders`` holding common
+    stock, raises ``rounds`` preferred rounds at rising prices from
+    ``investors`` (with earlier investors following on in later rounds),
+    bridges with ``convertibles`` notes, issues ``warrants`` to lenders and
+    grants ``options`` to employees, about two grants each, from an option
+    plan that is topped up every round.
+
+    Rows are built in memory and written with ``bulk_create`` in batches of
+    ``batch_size`` (by default as many as the database allows in a single
+    insert), a few tables per transaction, so that no signals are sent
+    and nothing is saved a row at a time.  The security rollups and the cap
+    table version are brought up to date at the end.  Returns a dictionary
+    of the number of rows created of each model.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    founded = today - relativedelta(years=5)
+
+    investor = get_model('captable', 'Investor')
+    shareholder = get_model('captable', 'Shareholder')
+    security = get_model('captable', 'Security')
+    addition = get_model('captable', 'Addition')
+    certificate = get_model('captable', 'Certificate')
+
+    def day_between(start, stop):
+        return start + datetime.timedelta(rng.randint(0, (stop - start).days))
+
+    # Securities, and the shares authorized for each.
+    with transaction.atomic():
+        common = security.objects.create(
+            name="Common Stock", security_type=SECURITY_TYPE_COMMON,
+            price_per_share=.001, pre=7000, date=founded, seniority=1)
+        option_plan = security.objects.create(
+            name="Option Plan", security_type=SECURITY_TYPE_OPTION,
+            price_per_share=.1, date=founded, seniority=1)
+        series = []
+        price = .5
+        for r in range(rounds):
+            price *= rng.uniform(1.5, 3)
+            series.append(security.objects.create(
+                name="Series {0}".format(chr(ord('A') + r)),
+                security_type=SECURITY_TYPE_PREFERRED,
+                price_per_share=round(price, 5), conversion_ratio=1,
+                liquidation_preference=1, seniority=r + 2,
+                pre=round(price * 10000000),
+                is_participating=rng.random() < .3,
+                participation_cap=rng.choice([0, 2, 3]),
+                date=founded + relativedelta(
+                    months=int(12 + 48 * r / max(1, rounds)))))
+        last_price = series[-1].price_per_share if series else .5
+        bridge = warrant = None
+        if convertibles:
+            bridge = security.objects.create(
+                name="Convertible Notes", security_type=SECURITY_TYPE_CONVERTIBLE,
+                price_per_share=last_price, conversion_ratio=1,
+                liquidation_preference=1, price_cap=int(last_price * 20000000),
+                pre=last_price * 20000000, discount_rate=.2, interest_rate=.08,
+                seniority=rounds + 2, date=today - relativedelta(months=9))
+        if warrants:
+            warrant = security.objects.create(
+                name="Warrants", security_type=SECURITY_TYPE_WARRANT,
+                price_per_share=last_price, conversion_ratio=1,
+                liquidation_preference=1, seniority=rounds + 1,
+                date=today - relativedelta(months=18))
+
+    # Investors, with a shareholder entity each.
+    people = (
+        [("Founder {0}".format(n), 'founder') for n in range(founders)] +
+        [("Investor {0}".format(n), 'investor') for n in range(investors)] +
+        [("Employee {0}".format(n), 'employee')
+         for n in range(max(1, options // 2) if options else 0)] +
+        [("Lender {0}".format(n), 'lender') for n in range(warrants)])
+    with transaction.atomic():
+        investor.objects.bulk_create([
+            investor(name=name, slug=slugify(unicode(name)))
+            for name, _ in people], batch_size)
+        pks = dict(investor.objects.values_list('slug', 'pk'))
+        shareholder.objects.bulk_create([
+            shareholder(name=name, investor_id=pks[slugify(unicode(name))])
+            for name, _ in people], batch_size)
+    holders = {}
+    for pk, name in shareholder.objects.values_list('pk', 'name'):
+        holders[name] = pk
+    groups = {}
+    for name, role in people:
+        groups.setdefault(role, []).append(holders[name])
+
+    rows = []
+
+    def issue(prefix, sec, holder, **terms):
+        name = '{0}-{1}'.format(prefix, len(rows) + 1)
+        # The names are already slugs, save for their case.
+        rows.append(certificate(
+            name=name, slug=name.lower(), security=sec,
+            shareholder_id=holder, **terms))
+
+    for holder in groups.get('founder', []):
+        shares = rng.randint(1, 5) * 1000000
+        issue('CS', common, holder, shares=shares, cash=shares * .001,
+              date=founded, vesting_start=founded, vesting_term=48,
+              vesting_cliff=12, vesting_immediate=rng.choice([0, .25]),
+              vesting_trigger=TRIGGER_DOUBLE)
+
+    # Without outside investors the founders fund the company themselves.
+    investor_pool = groups.get('investor') or groups.get('founder') or [
+        holders[name] for name, _ in people[:1]]
+    for r, s in enumerate(series):
+        # Each investor leads into one round, and some follow on later.
+        # Every round needs at least one investor.
+        round_holders = investor_pool[r::len(series)] or investor_pool[:1]
+        round_holders += [
+            h for h in investor_pool[:len(investor_pool) * r // len(series)]
+            if rng.random() < .3]
+        for holder in round_holders:
+            cash = rng.randint(5, 200) * 10000
+            shares = int(cash / s.price_per_share)
+            issue('P{0}'.format(chr(ord('A') + r)), s, holder, shares=shares,
+                  cash=shares * s.price_per_share, date=s.date,
+                  is_prorata=rng.random() < .5)
+
+    for n in range(convertibles):
+        issue('CN', bridge, rng.choice(investor_pool),
+              principal=rng.randint(2, 50) * 10000,
+              date=day_between(bridge.date, today))
+
+    for holder in groups.get('lender', []):
+        issue('W', warrant, holder, granted=rng.randint(1, 20) * 10000,
+              cash=0, date=day_between(warrant.date, today))
+
+    employees = groups.get('employee', [])
+    for n in range(options):
+        grant = rng.randint(1, 100) * 500
+        start = day_between(founded, today)
+        stopped = rng.random() < .15
+        exercised = rng.randint(0, grant // 4) if rng.random() < .1 else 0
+        issue('O', option_plan, employees[n % len(employees)],
+              granted=grant, exercised=exercised,
+              cancelled=grant // 2 if stopped else 0,
+              date=start, vesting_start=start,
+              vesting_stop=day_between(start, today) if stopped else None,
+              vesting_term=48, vesting_cliff=12, is_approved=True)
+
+    with transaction.atomic():
+        certificate.objects.bulk_create(rows, batch_size)
+
+        # Authorize enough of each security to cover what was issued,
+        # and top up the option plan with every round.
+        issued = {}
+        for c in rows:
+            issued[c.security_id] = issued.get(c.security_id, 0) + (
+                c.shares or c.granted)
+        additions = []
+        for s in [common, option_plan, warrant] + series:
+            if s is None:
+                continue
+            total = int(issued.get(s.pk, 0) * 1.25) + 1000000
+            tranches = [s.date]
+            if s is option_plan:
+                tranches += [r.date for r in series]
+            for date in tranches:
+                additions.append(addition(
+                    security=s, date=date,
+                    authorized=total // len(tranches)))
+        addition.objects.bulk_create(additions, batch_size)
+
+    # ``bulk_create`` sends no signals, so bring the rollups and the cap
+    # table version up to date.
+    for s in security.objects.all():
+        rebuild(s)
+    bump_version()
+
+    return {
+        'securities': security.objects.count(),
+        'investors': len(people),
+        'shareholders': len(people),
+        'certificates': len(rows),
+        'additions': len(additions),
+    }
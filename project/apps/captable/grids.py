@@ -0,0 +1,96 @@
+from __future__ import division
+
+import itertools
+import multiprocessing
+import pickle
+
+from .snapshot import CapTableSnapshot
+
+
+FINANCING_COLUMNS = [
+    'new_money', 'pre_valuation', 'pool_rata', 'price', 'pre_shares',
+    'expansion', 'new_money_shares', 'new_investor_shares',
+    'new_prorata_shares', 'new_converted_shares', 'new_pool_shares']
+
+
+_snapshot = None
+
+
+def _initialize(serialized):
+    global _snapshot
+    _snapshot = pickle.loads(serialized)
+
+
+def financing_rows(snapshot, scenarios):
+    """Calculate the proforma of each ``(new_money, pre_valuation, pool_rata)``."""
+    rows = []
+    for new_money, pre_valuation, pool_rata in scenarios:
+        proforma = snapshot.proforma(new_money, pre_valuation, pool_rata)
+        proforma.update(
+            new_money=new_money, pre_valuation=pre_valuation,
+            pool_rata=pool_rata)
+        rows.append([proforma[c] for c in FINANCING_COLUMNS])
+    return rows
+
+
+def liquidation_rows(snapshot, scenarios):
+    """Calculate the proceeds of each investor at each ``(purchase_price,)``."""
+    rows = []
+    for purchase_price, in scenarios:
+        price = snapshot.share_price(purchase_price)
+        rows.append([purchase_price] + [
+            snapshot.proceeds(purchase_price, i, price)
+            for i in snapshot.investors])
+    return rows
+
+
+EVALUATORS = {
+    'financing': financing_rows,
+    'liquidation': liquidation_rows,
+}
+
+
+def _evaluate(unit):
+    kind, scenarios = unit
+    return EVALUATORS[kind](_snapshot, scenarios)
+
+
+def evaluate_grid(kind, axes, snapshot=None, processes=1, chunk_size=100):
+    """Evaluate every combination of scenario inputs.
+
+    Sensitivity tables take the cartesian product of ``axes``, the lists
+    of values of each input: ``new_money``, ``pre_valuation`` and
+    ``pool_rata`` for a ``financing`` grid, or only the ``purchase_price``
+    of a ``liquidation`` grid.  Every scenario is independent of the
+    others, so with more than one of ``processes`` the grid is cut into
+    units of ``chunk_size`` scenarios and spread across a pool of worker
+    processes.  The snapshot of the cap table is serialized once and
+    loaded by each worker as it starts, rather than sent with every unit.
+
+    Returns the columns of the table and its rows, one per scenario in
+    the order of the product: the proforma totals of a financing, or the
+    proceeds of each investor in a liquidation.
+    """
+    if snapshot is None:
+        snapshot = CapTableSnapshot()
+    if kind == 'financing':
+        columns = FINANCING_COLUMNS
+    else:
+        columns = ['purchase_price'] + [i.name for i in snapshot.investors]
+
+    scenarios = list(itertools.product(*axes))
+    units = [
+        (kind, scenarios[n:n + chunk_size])
+        for n in range(0, len(scenarios), chunk_size)]
+    if processes > 1 and len(units) > 1:
+        pool = multiprocessing.Pool(
+            processes, _initialize,
+            (pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL),))
+        try:
+            chunks = pool.map(_evaluate, units)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = [EVALUATORS[k](snapshot, s) for k, s in units]
+    return columns, list(itertools.chain.from_iterable(chunks))
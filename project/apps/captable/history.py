@@ -0,0 +1,129 @@
+from __future__ import division
+
+import datetime
+from collections import namedtuple
+
+from .constants import *
+
+from .cache import versioned
+from .snapshot import CapTableSnapshot
+
+
+# A change to the fully diluted cap table: the shares held by an
+# investor, of which ``options`` were granted from an option plan, and
+# the options authorized for the plans.
+Event = namedtuple('Event', [
+    'date', 'kind', 'investor', 'shares', 'options', 'authorized'])
+
+# Events on the same day are replayed in this order.
+KINDS = [
+    'authorized', 'issued', 'exercised', 'returned', 'cancelled',
+    'converted', 'accrued']
+
+
+def events(snapshot):
+    """Return the events of a cap table snapshot, in order of date.
+
+    Certificates are issued on their date.  Returns and cancellations
+    aren't dated, and are taken to happen when vesting stopped, or else
+    on the date of issue, as are exercises.  Notes are issued at their
+    principal over the default price, and the interest is added when
+    they convert, or today if they haven't.  Options authorized are
+    added on the date of each addition.
+    """
+    today = datetime.date.today()
+    result = []
+    for a in snapshot.additions:
+        if a.security is not None and a.authorized and (
+                a.security.security_type == SECURITY_TYPE_OPTION):
+            result.append(Event(a.date, 'authorized', None, 0, 0, a.authorized))
+
+    for c in snapshot.certificates:
+        investor = c.shareholder.investor_id
+        security = c.security
+        stopped = c.vesting_stop or c.date
+
+        if security.security_type in [SECURITY_TYPE_COMMON, SECURITY_TYPE_PREFERRED]:
+            ratio = 1
+            if security.security_type == SECURITY_TYPE_PREFERRED:
+                ratio = security.conversion_ratio
+            changes = [
+                (c.date, 'issued', c.shares * ratio),
+                (stopped, 'returned', -c.returned * ratio)]
+        elif security.security_type == SECURITY_TYPE_CONVERTIBLE:
+            issued = c.principal / security.price_per_share
+            changes = [
+                (c.date, 'issued', issued),
+                (c.converted_date or today,
+                 'converted' if c.converted_date else 'accrued',
+                 c.exchanged() - issued)]
+        else:
+            changes = [
+                (c.date, 'issued', c.granted),
+                (c.date, 'exercised', -c.exercised),
+                (stopped, 'cancelled', -c.cancelled)]
+
+        is_option = security.security_type == SECURITY_TYPE_OPTION
+        for date, kind, shares in changes:
+            if shares:
+                result.append(Event(
+                    date, kind, investor, shares,
+                    shares if is_option else 0, 0))
+
+    result.sort(key=lambda e: (e.date, KINDS.index(e.kind)))
+    return result
+
+
+def replay(snapshot):
+    """Replay the events of a snapshot into a history of its ownership.
+
+    The events are applied one at a time, in a single pass, keeping a
+    running total of the shares of each investor and of the option pool;
+    the state after the last event of each day is a point of the history.
+    Returns a dictionary of the ``dates``, and at each of them the
+    ``total`` fully diluted shares, the options ``available`` in the
+    plans, and the ``shares`` and ``rata`` of every investor.
+    """
+    investors = sorted(snapshot.investors, key=lambda i: i.name)
+    shares = dict((i.pk, 0) for i in investors)
+    held = options = authorized = 0
+
+    history = {
+        'dates': [],
+        'total': [],
+        'available': [],
+        'investors': [{
+            'pk': i.pk,
+            'name': i.name,
+            'slug': i.slug,
+            'shares': [],
+            'rata': [],
+        } for i in investors],
+    }
+
+    def record(date):
+        # Options granted are counted in the plans they are granted from.
+        total = held - options + authorized
+        history['dates'].append(date)
+        history['total'].append(total)
+        history['available'].append(authorized - options)
+        for i in history['investors']:
+            i['shares'].append(shares[i['pk']])
+            i['rata'].append(shares[i['pk']] / total if total else 0)
+
+    ordered = events(snapshot)
+    for n, event in enumerate(ordered):
+        if event.investor is not None:
+            shares[event.investor] += event.shares
+        held += event.shares
+        options += event.options
+        authorized += event.authorized
+        if n + 1 == len(ordered) or ordered[n + 1].date != event.date:
+            record(event.date)
+    return history
+
+
+def ownership_history():
+    """Return the ``replay`` of the cap table, cached against its version."""
+    return versioned(
+        'captable:ownership', lambda: replay(CapTableSnapshot()))
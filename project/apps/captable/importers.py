@@ -0,0 +1,289 @@
+from __future__ import division
+
+import csv
+import datetime
+
+from django.db import transaction
+from django.db.models import get_model
+from django.utils.text import slugify
+
+from .constants import *
+
+from .rollups import rebuild
+from .cache import bump_version
+
+
+NUMBER_FIELDS = [
+    'shares', 'returned', 'cash', 'refunded', 'principal', 'forgiven',
+    'granted', 'exercised', 'cancelled', 'vesting_term', 'vesting_cliff',
+    'vesting_immediate', 'vested_direct']
+DATE_FIELDS = ['date', 'converted_date', 'vesting_start', 'vesting_stop']
+BOOLEAN_FIELDS = ['is_prorata', 'is_approved']
+TEXT_FIELDS = ['notes', 'vesting_notes']
+REFERENCE_FIELDS = ['name', 'shareholder', 'investor', 'security', 'security_type']
+TRIGGER_FIELDS = ['vesting_trigger']
+
+COLUMNS = (
+    REFERENCE_FIELDS + NUMBER_FIELDS + DATE_FIELDS + BOOLEAN_FIELDS +
+    TEXT_FIELDS + TRIGGER_FIELDS)
+REQUIRED_COLUMNS = ['name', 'shareholder', 'security']
+
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y']
+TRUE = ['1', 'true', 'yes', 'y', 't', 'x']
+FALSE = ['0', 'false', 'no', 'n', 'f', '']
+
+
+class RowError(ValueError):
+    pass
+
+
+class Rollback(Exception):
+    pass
+
+
+def parse_number(value):
+    try:
+        return float(value.replace(',', '').replace('$', ''))
+    except ValueError:
+        raise RowError(u"'{0}' is not a number".format(value))
+
+
+def parse_date(value):
+    for format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format).date()
+        except ValueError:
+            pass
+    raise RowError(u"'{0}' is not a date".format(value))
+
+
+def parse_boolean(value):
+    if value.lower() in TRUE:
+        return True
+    if value.lower() in FALSE:
+        return False
+    raise RowError(u"'{0}' is not yes or no".format(value))
+
+
+class CertificateImport(object):
+    """Import certificates from a CSV file.
+
+    Certificates are otherwise entered one at a time in the admin, each
+    of them saved, and slugged, on its own.  This streams the rows of a
+    CSV file -- such as the export of another cap table system or a
+    spreadsheet -- one at a time, and writes the certificates with
+    ``bulk_create`` in batches of ``batch_size`` within one transaction.
+
+    Each row names its ``security`` and ``shareholder``, and optionally
+    the ``investor`` behind the shareholder; these are resolved through
+    maps of the existing rows loaded up front, shareholders by their name
+    and investor.  Securities must already
+    exist, and if a ``security_type`` is given it must match that of the
+    security.  Shareholders and investors that do not exist yet are
+    created.  The remaining columns are the fields of ``Certificate``.
+
+    Every row is validated and the problems with each are collected in
+    ``errors`` as ``(line, message)``.  Nothing is written if there are
+    any errors, or with ``dry_run``; ``created`` is then the number of
+    certificates that would have been.
+    """
+
+    def __init__(self, dry_run=False, batch_size=1000):
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        self.securities = set()
+
+    @property
+    def committed(self):
+        return not self.dry_run and not self.errors and self.created > 0
+
+    def load(self):
+        investor = get_model('captable', 'Investor')
+        shareholder = get_model('captable', 'Shareholder')
+        security = get_model('captable', 'Security')
+        certificate = get_model('captable', 'Certificate')
+
+        self._securities = {}
+        for pk, name, slug, security_type in security.objects.values_list(
+                'pk', 'name', 'slug', 'security_type'):
+            self._securities[name.lower()] = (pk, security_type)
+            self._securities[slug] = (pk, security_type)
+        self._investors = {}
+        for pk, name, slug in investor.objects.values_list('pk', 'name', 'slug'):
+            self._investors[name.lower()] = pk
+            self._investors[slug] = pk
+        self._shareholders = {}
+        self._names = {}
+        for pk, name, investor_id in shareholder.objects.order_by(
+                '-pk').values_list('pk', 'name', 'investor'):
+            self._shareholders[(name.lower(), investor_id)] = pk
+            self._names[name.lower()] = pk
+        self._slugs = set(certificate.objects.values_list('slug', flat=True))
+
+        self._security_types = {}
+        for group in security.SECURITY_TYPE:
+            for value, label in group[1]:
+                self._security_types[label.lower()] = value
+                self._security_types[str(value)] = value
+        self._triggers = {}
+        for value, label in certificate.TRIGGER_CHOICES:
+            self._triggers[label.lower()] = value
+            self._triggers[str(value)] = value
+
+    def run(self, f):
+        """Import the certificates from an open CSV file."""
+        self.load()
+        reader = csv.DictReader(f)
+        # Spreadsheet headers such as "Security Type" name the columns too.
+        columns = [
+            '_'.join(c.strip().lower().split())
+            for c in reader.fieldnames or []]
+        reader.fieldnames = columns
+        unknown = [c for c in columns if c not in COLUMNS]
+        missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+        if unknown:
+            self.errors.append(
+                (1, u"Unknown columns: {0}".format(', '.join(unknown))))
+        if missing:
+            self.errors.append(
+                (1, u"Missing columns: {0}".format(', '.join(missing))))
+        if self.errors:
+            return self
+
+        certificate = get_model('captable', 'Certificate')
+        batch = []
+        rows = iter(reader)
+        try:
+            with transaction.atomic():
+                while True:
+                    try:
+                        row = next(rows)
+                    except StopIteration:
+                        break
+                    except csv.Error as e:
+                        self.errors.append((reader.line_num, unicode(e)))
+                        break
+                    self.rows += 1
+                    try:
+                        batch.append(self.certificate(row))
+                    except RowError as e:
+                        self.errors.append((reader.line_num, unicode(e)))
+                        continue
+                    if len(batch) >= self.batch_size:
+                        certificate.objects.bulk_create(batch)
+                        self.created += len(batch)
+                        batch = []
+                if batch:
+                    certificate.objects.bulk_create(batch)
+                    self.created += len(batch)
+                if self.dry_run or self.errors:
+                    raise Rollback
+        except Rollback:
+            pass
+
+        if self.committed:
+            # ``bulk_create`` sends no signals, so bring the rollups and
+            # the cap table version up to date.
+            security = get_model('captable', 'Security')
+            for s in security.objects.filter(pk__in=self.securities):
+                rebuild(s)
+            bump_version()
+        return self
+
+    def certificate(self, row):
+        """Build the certificate for a row, raising ``RowError`` if invalid."""
+        certificate = get_model('captable', 'Certificate')
+        try:
+            row = dict(
+                (k, (v or '').decode('utf-8').strip())
+                for k, v in row.items() if k)
+        except UnicodeDecodeError:
+            raise RowError(u"The row is not encoded as UTF-8")
+        for column in REQUIRED_COLUMNS:
+            if not row.get(column):
+                raise RowError(u"The {0} is required".format(column))
+
+        name = row['name']
+        slug = slugify(name)
+        if slug in self._slugs:
+            raise RowError(u"Certificate {0} already exists".format(name))
+
+        security = self._securities.get(row['security'].lower())
+        if security is None:
+            raise RowError(u"Unknown security {0}".format(row['security']))
+        if row.get('security_type'):
+            security_type = self._security_types.get(row['security_type'].lower())
+            if security_type is None:
+                raise RowError(
+                    u"Unknown security type {0}".format(row['security_type']))
+            if security_type != security[1]:
+                raise RowError(u"{0} is not of type {1}".format(
+                    row['security'], row['security_type']))
+
+        fields = {}
+        for f in NUMBER_FIELDS:
+            if row.get(f):
+                fields[f] = parse_number(row[f])
+        for f in DATE_FIELDS:
+            if row.get(f):
+                fields[f] = parse_date(row[f])
+        for f in BOOLEAN_FIELDS:
+            if f in row:
+                fields[f] = parse_boolean(row[f])
+        for f in TEXT_FIELDS:
+            if row.get(f):
+                fields[f] = row[f]
+        if row.get('vesting_trigger'):
+            trigger = self._triggers.get(row['vesting_trigger'].lower())
+            if trigger is None:
+                raise RowError(
+                    u"Unknown vesting trigger {0}".format(row['vesting_trigger']))
+            fields['vesting_trigger'] = trigger
+
+        self._slugs.add(slug)
+        self.securities.add(security[0])
+        return certificate(
+            name=name, slug=slug, security_id=security[0],
+            shareholder_id=self.shareholder(row['shareholder'], row.get('investor')),
+            **fields)
+
+    def investor(self, name):
+        """Return the primary key of an investor, creating it if need be."""
+        key = name.lower()
+        if key not in self._investors:
+            key = slugify(name)
+        if key not in self._investors:
+            investor = get_model('captable', 'Investor').objects.create(
+                name=name)
+            self._investors[name.lower()] = investor.pk
+            self._investors[investor.slug] = investor.pk
+            return investor.pk
+        return self._investors[key]
+
+    def shareholder(self, name, investor_name=None):
+        """Return the primary key of a shareholder, creating it if need be.
+
+        Shareholders of the same name are told apart by their investor;
+        without one, the first shareholder of the name is taken, or else
+        one is created under an investor of its own name.
+        """
+        key = name.lower()
+        if not investor_name:
+            if key in self._names:
+                return self._names[key]
+            investor_name = name
+        investor_id = self.investor(investor_name)
+        if (key, investor_id) not in self._shareholders:
+            pk = get_model('captable', 'Shareholder').objects.create(
+                name=name, investor_id=investor_id).pk
+            self._shareholders[(key, investor_id)] = pk
+            self._names.setdefault(key, pk)
+        return self._shareholders[(key, investor_id)]
+
+
+def import_certificates(f, dry_run=False, batch_size=1000):
+    """Import certificates from an open CSV file; see ``CertificateImport``."""
+    return CertificateImport(dry_run, batch_size).run(f)
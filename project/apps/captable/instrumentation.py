@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+import traceback
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.template.base import Template
+
+
+_local = threading.local()
+
+# Queries are attributed to the frames in these modules that ran them.
+CALLERS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ['models.py', 'managers.py']]
+
+# Identical SQL run this many times in a request is taken for an N+1.
+REPEATED = 3
+
+
+# A query run while recording: its SQL, before parameters, the seconds
+# it took, the ``caller`` in ``CALLERS`` it was run from and the
+# template being rendered when it ran.
+Query = namedtuple('Query', ['sql', 'time', 'caller', 'template'])
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def caller(stack=None):
+    """Return where in ``CALLERS`` the current query was run from, if anywhere.
+
+    Every frame of the stack in ``CALLERS`` is given as ``file:line
+    (function)``, innermost first, so a query run by a helper in
+    ``managers.py`` is traced back to the property of the model that
+    called it.
+    """
+    frames = [
+        '{0}:{1} ({2})'.format(os.path.basename(filename), line, function)
+        for filename, line, function, text
+        in reversed(stack or traceback.extract_stack())
+        if os.path.abspath(filename) in CALLERS]
+    return ' < '.join(frames) or None
+
+
+class RecordingCursor(object):
+    """Wrap a database cursor to record each query with a recorder."""
+
+    def __init__(self, cursor, recorder):
+        self.cursor = cursor
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, sql, params=None):
+        return self.recorder.run(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self.recorder.run(self.cursor.executemany, sql, param_list)
+
+
+def _render(original):
+    def render(self, context):
+        recorders = getattr(_local, 'recorders', None)
+        if not recorders:
+            return original(self, context)
+        name = self.name or '<unknown source>'
+        for recorder in recorders:
+            recorder.rendering.append(name)
+        start = time.time()
+        try:
+            return original(self, context)
+        finally:
+            elapsed = time.time() - start
+            for recorder in recorders:
+                recorder.rendering.pop()
+                stats = recorder.template(name)
+                stats['renders'] += 1
+                stats['time'] += elapsed
+    render.original = original
+    return render
+
+
+def install():
+    """Time template renders while a recorder is running.
+
+    ``Template.render`` is wrapped once per process; outside of a
+    recorder the wrapper only calls through.
+    """
+    if not hasattr(Template.render, 'original'):
+        Template.render = _render(Template.render)
+
+
+class QueryRecorder(object):
+    """Record the queries run on a connection during a block.
+
+    Every query is timed and kept with the template being rendered, and
+    each template rendered is counted and timed, including the templates
+    it extends and includes.  Walking the stack for the caller of a
+    query is slow, so only queries over the ``budget``, and those whose
+    SQL has already been run when it may be repeated ``threshold`` times,
+    are kept with the caller in ``models.py`` or ``managers.py`` that
+    ran them.  Recorders nest, and each one records only the queries of
+    its own thread.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, budget=None, threshold=REPEATED):
+        self.connection = connections[using]
+        self.budget = budget
+        self.threshold = threshold
+        self.queries = []
+        self.templates = {}
+        self.rendering = []
+        self.start = self.stop = None
+        self._counts = {}
+
+    def __enter__(self):
+        install()
+        self._cursor = self.connection.__dict__.get('cursor')
+        cursor = self.connection.cursor
+        self.connection.cursor = lambda: RecordingCursor(cursor(), self)
+        _local.recorders = getattr(_local, 'recorders', []) + [self]
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop = time.time()
+        _local.recorders = [r for r in _local.recorders if r is not self]
+        if self._cursor is None:
+            del self.connection.cursor
+        else:
+            self.connection.cursor = self._cursor
+
+    def run(self, execute, sql, params):
+        start = time.time()
+        try:
+            return execute(sql, params)
+        finally:
+            elapsed = time.time() - start
+            template = self.rendering[-1] if self.rendering else None
+            count = self._counts[sql] = self._counts.get(sql, 0) + 1
+            traced = (
+                (self.threshold is not None and count > 1) or
+                (self.budget is not None and len(self.queries) >= self.budget))
+            self.queries.append(Query(
+                sql, elapsed, caller() if traced else None, template))
+            if template is not None:
+                self.template(template)['queries'] += 1
+
+    def template(self, name):
+        """Return the ``renders``, ``time`` and ``queries`` of a template."""
+        return self.templates.setdefault(
+            name, {'renders': 0, 'time': 0, 'queries': 0})
+
+    @property
+    def time(self):
+        return (self.stop or time.time()) - self.start
+
+    def repeated(self, threshold=REPEATED):
+        """Return the SQL run at least ``threshold`` times, most first.
+
+        Each is a dictionary of the ``sql``, the ``count`` of times it
+        ran, the seconds they took, the ``callers`` that ran it and the
+        ``templates`` being rendered when it ran.
+        """
+        groups = {}
+        for q in self.queries:
+            group = groups.setdefault(
+                q.sql, {'sql': q.sql, 'count': 0, 'time': 0,
+                        'callers': set(), 'templates': set()})
+            group['count'] += 1
+            group['time'] += q.time
+            if q.caller is not None:
+                group['callers'].add(q.caller)
+            if q.template is not None:
+                group['templates'].add(q.template)
+        result = [g for g in groups.values() if g['count'] >= threshold]
+        for g in result:
+            g['callers'] = sorted(g['callers'])
+            g['templates'] = sorted(g['templates'])
+        return sorted(result, key=lambda g: -g['count'])
+
+    def problems(self, budget=None, threshold=REPEATED):
+        """Describe the queries over ``budget`` and each N+1 pattern.
+
+        A ``threshold`` of ``None`` allows repeated queries.
+        """
+        problems = []
+        if budget is not None and len(self.queries) > budget:
+            problems.append('{0} queries, over a budget of {1}'.format(
+                len(self.queries), budget))
+        if threshold is None:
+            return problems
+        for g in self.repeated(threshold):
+            source = ', '.join(g['callers'] + g['templates']) or 'the view'
+            problems.append('N+1: {0} x {1} from {2}'.format(
+                g['count'], g['sql'], source))
+        return problems
+
+    def report(self):
+        """Describe the queries and time of the block and of each template."""
+        lines = ['{0} queries in {1:.1f}ms'.format(
+            len(self.queries), self.time * 1000)]
+        for name, stats in sorted(self.templates.items()):
+            lines.append('  {0}: {1} renders, {2} queries in {3:.1f}ms'.format(
+                name, stats['renders'], stats['queries'], stats['time'] * 1000))
+        return '\n'.join(lines)
+
+
+def view_budget(name):
+    """Return the query budget of a view from the ``QUERY_BUDGETS`` setting."""
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(name, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+
+
+@contextmanager
+def query_budget(budget=None, threshold=REPEATED, using=DEFAULT_DB_ALIAS):
+    """Fail a test whose block runs more than ``budget`` queries.
+
+    Raises ``QueryBudgetExceeded``, an ``AssertionError``, describing the
+    queries over budget, every N+1 pattern -- identical SQL run at least
+    ``threshold`` times -- and the callers it came from.  A ``threshold``
+    of ``None`` allows repeated queries.
+    """
+    recorder = QueryRecorder(using, budget, threshold)
+    with recorder:
+        yield recorder
+    problems = recorder.problems(budget, threshold)
+    if problems:
+        raise QueryBudgetExceeded('\n'.join(problems + [recorder.report()]))
@@ -0,0 +1,71 @@
+import json
+import platform
+import subprocess
+import sys
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.captable.benchmarks import SIZES, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = """Benchmarks the captable views and managers against synthetic
+        cap tables of increasing size, and writes the wall time, query count
+        and the growth in peak memory of a fresh process running each, as
+        JSON.  Runs in a test database."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes',
+            dest='sizes',
+            default=','.join(str(s) for s in SIZES),
+            help='Comma separated certificate counts to benchmark.'),
+        make_option('--repeat',
+            dest='repeat',
+            type='int',
+            default=3,
+            help='Runs of each target; the fastest is reported.'),
+        make_option('--only',
+            dest='only',
+            default='',
+            help='Comma separated names of the targets to run.'),
+        make_option('--output',
+            dest='output',
+            default=None,
+            help='File to write the results to, instead of stdout.'),
+    )
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',') if s]
+        only = [o for o in options['only'].split(',') if o]
+
+        def log(message):
+            self.stderr.write(message)
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmarks(sizes, options['repeat'], only, log)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        try:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                stderr=subprocess.STDOUT).strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        output = json.dumps({
+            'commit': commit,
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'results': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
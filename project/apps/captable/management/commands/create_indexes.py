@@ -0,0 +1,44 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import get_app, get_models
+
+
+class Command(BaseCommand):
+    help = """Creates the indexes of the captable fields that are missing
+        from the database.  The tables are created by syncdb, which adds no
+        index to a table that already exists, such as those of the dates of
+        certificates and additions."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Print the SQL without running it.'),
+    )
+
+    def handle(self, *args, **options):
+        cursor = connection.cursor()
+        tables = connection.introspection.table_names(cursor)
+        statements = []
+        for model in get_models(get_app('captable')):
+            table = model._meta.db_table
+            if table not in tables:
+                continue
+            indexed = connection.introspection.get_indexes(cursor, table)
+            for field in model._meta.local_fields:
+                if field.column not in indexed:
+                    statements.extend(connection.creation.sql_indexes_for_field(
+                        model, field, no_style()))
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                for statement in statements:
+                    cursor.execute(statement)
+        for statement in statements:
+            self.stdout.write(statement)
+        self.stdout.write("{0} indexes {1}.".format(
+            len(statements), 'missing' if options['dry_run'] else 'created'))
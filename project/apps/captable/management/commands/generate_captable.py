@@ -0,0 +1,67 @@
+import time
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.captable.models import Security
+from apps.captable.generators import clear_captable, generate_captable
+
+
+class Command(BaseCommand):
+    help = "Generates a synthetic cap table of any size."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--investors', dest='investors', type='int', default=100,
+            help='Number of investors in the preferred rounds.'),
+        make_option('--options', dest='options', type='int', default=1000,
+            help='Number of option grants.'),
+        make_option('--rounds', dest='rounds', type='int', default=2,
+            help='Number of preferred rounds.'),
+        make_option('--convertibles', dest='convertibles', type='int', default=10,
+            help='Number of convertible notes.'),
+        make_option('--warrants', dest='warrants', type='int', default=5,
+            help='Number of warrants.'),
+        make_option('--founders', dest='founders', type='int', default=2,
+            help='Number of founders holding common stock.'),
+        make_option('--seed', dest='seed', type='int', default=None,
+            help='Seed for reproducible data.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=None,
+            help='Rows written per insert; by default the most the database allows.'),
+        make_option('--clear', action='store_true', dest='clear', default=False,
+            help='Delete the existing cap table first.'),
+    )
+
+    def handle(self, *args, **options):
+        # The notes and preferred rounds are bought by the investors, or
+        # without them by the founders, employees or lenders.
+        holders = [
+            options[h] for h in ['founders', 'investors', 'options', 'warrants']]
+        unheld = [
+            name for name, count in [
+                ('convertible notes', options['convertibles']),
+                ('preferred rounds', options['rounds'])]
+            if count]
+        if unheld and not any(holders):
+            raise CommandError(
+                "There are no investors, founders, employees or lenders to "
+                "hold the {0}.".format(' and '.join(unheld)))
+        if options['clear']:
+            clear_captable()
+        elif Security.objects.exists():
+            raise CommandError(
+                "There is already a cap table; use --clear to replace it.")
+        start = time.time()
+        created = generate_captable(
+            investors=options['investors'],
+            options=options['options'],
+            rounds=options['rounds'],
+            convertibles=options['convertibles'],
+            warrants=options['warrants'],
+            founders=options['founders'],
+            seed=options['seed'],
+            batch_size=options['batch_size'])
+        self.stdout.write(
+            "Generated {certificates} certificates, {investors} investors and "
+            "{securities} securities in {seconds:.1f}s".format(
+                seconds=time.time() - start, **created))
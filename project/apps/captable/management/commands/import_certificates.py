@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.captable.importers import import_certificates, COLUMNS
+
+
+class Command(BaseCommand):
+    args = '<file.csv>'
+    help = """Imports certificates from a CSV file.  The columns are: {0}.
+        Nothing is imported if any row is invalid.""".format(', '.join(COLUMNS))
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help='Validate the file without importing anything.'),
+        make_option('--batch-size',
+            dest='batch_size',
+            type='int',
+            default=1000,
+            help='Certificates written per batch.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the CSV file to import.")
+        with open(args[0], 'rU') as f:
+            result = import_certificates(
+                f, options['dry_run'], options['batch_size'])
+        for line, message in result.errors:
+            self.stderr.write(u"Line {0}: {1}".format(line, message))
+        if result.errors:
+            raise CommandError("{0} of {1} rows are invalid; nothing was imported.".format(
+                len(result.errors), result.rows))
+        if options['dry_run']:
+            self.stdout.write("All {0} rows are valid.".format(result.rows))
+        else:
+            self.stdout.write("Imported {0} certificates.".format(result.created))
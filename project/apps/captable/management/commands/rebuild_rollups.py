@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.captable.models import Security
+from apps.captable.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recalculates the rollup of every security and reports any drift."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--check',
+            action='store_true',
+            dest='check',
+            default=False,
+            help='Only report drift, without updating the rollups.'),
+    )
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for security in Security.objects.all():
+            drift = rebuild(security, check=options['check'])
+            if drift:
+                drifted += 1
+            for total, stored, calculated in drift:
+                self.stdout.write("{security}: {total} is {stored}, not {calculated}".format(
+                    security=security,
+                    total=total,
+                    stored=stored,
+                    calculated=calculated))
+        if drifted and options['check']:
+            raise CommandError("{0} rollups have drifted.".format(drifted))
+        self.stdout.write("Checked the rollups of {0} securities".format(
+            Security.objects.count()))
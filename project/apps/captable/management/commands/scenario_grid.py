@@ -0,0 +1,100 @@
+import csv
+import multiprocessing
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.captable.exports import encode
+from apps.captable.grids import evaluate_grid
+
+
+def parse_values(value):
+    """Parse comma separated numbers, or ranges as ``start:stop:step``."""
+    values = []
+    for part in value.split(','):
+        if not part:
+            continue
+        try:
+            if ':' in part:
+                start, stop, step = [float(v) for v in part.split(':')]
+                if step <= 0:
+                    raise ValueError
+                n = 0
+                while start + n * step <= stop:
+                    values.append(start + n * step)
+                    n += 1
+            else:
+                values.append(float(part))
+        except ValueError:
+            raise CommandError("'{0}' is not a number or range".format(part))
+    return values
+
+
+class Command(BaseCommand):
+    args = 'financing|liquidation'
+    help = """Evaluates a grid of financing or liquidation scenarios across
+        worker processes and writes the table as CSV.  Financing grids take
+        every combination of --new-money, --pre-valuation and --pool, and
+        liquidation grids every --purchase-price.  Values are comma separated
+        numbers or start:stop:step ranges."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--new-money',
+            dest='new_money',
+            default='',
+            help='New money raised in each financing.'),
+        make_option('--pre-valuation',
+            dest='pre_valuation',
+            default='',
+            help='Pre-money valuations of each financing.'),
+        make_option('--pool',
+            dest='pool_rata',
+            default='0',
+            help='Option pools after each financing, as a percentage.'),
+        make_option('--purchase-price',
+            dest='purchase_price',
+            default='',
+            help='Purchase prices of each liquidation.'),
+        make_option('--processes',
+            dest='processes',
+            type='int',
+            default=multiprocessing.cpu_count(),
+            help='Worker processes to evaluate the grid with.'),
+        make_option('--chunk-size',
+            dest='chunk_size',
+            type='int',
+            default=100,
+            help='Scenarios sent to a worker at a time.'),
+        make_option('--output',
+            dest='output',
+            default=None,
+            help='File to write the table to, instead of stdout.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in ['financing', 'liquidation']:
+            raise CommandError("Give either financing or liquidation.")
+        kind = args[0]
+        if kind == 'financing':
+            axes = [
+                parse_values(options['new_money']),
+                parse_values(options['pre_valuation']),
+                [p / 100 for p in parse_values(options['pool_rata'])]]
+        else:
+            axes = [parse_values(options['purchase_price'])]
+        if not all(axes):
+            raise CommandError("Every input of the grid needs a value.")
+
+        columns, rows = evaluate_grid(
+            kind, axes, processes=options['processes'],
+            chunk_size=options['chunk_size'])
+
+        f = open(options['output'], 'wb') if options['output'] else self.stdout
+        try:
+            writer = csv.writer(f)
+            writer.writerow([encode(c) for c in columns])
+            writer.writerows(rows)
+        finally:
+            if options['output']:
+                f.close()
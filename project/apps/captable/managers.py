@@ -1,3 +1,7 @@
+from __future__ import division
+
+from collections import namedtuple
+
 from django.db import models
 
 from django.db.models import (
@@ -10,6 +14,9 @@ from django.db.models.query import QuerySet
 
 from .constants import *
 
+from .cache import cache_scope, versioned
+from .vesting import VestingTimeline
+
 
 
 class SecurityQuerySet(QuerySet):
@@ -43,25 +50,111 @@ class SecurityQuerySet(QuerySet):
         return sum(filter(
             None, [s.available for s in securities]))
 
+class InvestorQuerySet(QuerySet):
+    _with_totals = False
+    _with_holdings = False
+
+    def with_totals(self):
+        """Annotate each investor with its certificate totals.
+
+        Each of the investor totals would otherwise filter and walk the
+        certificates of that investor, for every investor on the page.
+        This instead totals the certificates of all the investors in a
+        single query grouped by investor (see ``certificate_totals``),
+        and sets ``total_outstanding``, ``total_paid``,
+        ``total_preference`` and ``total_liquidated`` on each investor,
+        which the corresponding properties then return.
+        """
+        return self._clone(_with_totals=True)
+
+    def with_holdings(self):
+        """Load the shareholders and certificates of each investor.
+
+        The shareholders of all the investors are loaded in one query,
+        and their certificates, with their securities, in another, and
+        both are cached on each investor and shareholder the same way as
+        ``prefetch_related('shareholder_set__certificate_set__security')``
+        would, but in three queries rather than four.  The investor
+        metrics then use the certificates loaded rather than querying
+        for them.
+        """
+        return self._clone(_with_holdings=True)
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('_with_totals', self._with_totals)
+        kwargs.setdefault('_with_holdings', self._with_holdings)
+        return super(InvestorQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def iterator(self):
+        investors = super(InvestorQuerySet, self).iterator()
+        if not self._with_totals and not self._with_holdings:
+            for investor in investors:
+                yield investor
+            return
+
+        investors = list(investors)
+        certificate = get_model('captable', 'Certificate')
+        if self._with_totals:
+            certificates = certificate.objects.filter(
+                shareholder__investor__in=self.values('pk'))
+            totals = certificate_totals(
+                certificates, INVESTOR_TOTALS, 'shareholder__investor')
+            for investor in investors:
+                for metric in INVESTOR_TOTALS:
+                    setattr(investor, 'total_' + metric,
+                            totals[metric].get(investor.pk, 0))
+        if self._with_holdings:
+            attach_holdings(investors, self.values('pk'))
+        for investor in investors:
+            yield investor
+
+
+def prefetched(instance, attname, cache_name, objects):
+    """Cache related objects on an instance as ``prefetch_related`` does."""
+    related = getattr(instance, attname).all()
+    related._result_cache = objects
+    related._prefetch_done = True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[cache_name] = related
+
+
+def attach_holdings(investors, pks):
+    """Load and cache the shareholders and certificates of investors."""
+    shareholder = get_model('captable', 'Shareholder')
+    certificate = get_model('captable', 'Certificate')
+    lookup = dict((i.pk, i) for i in investors)
+
+    shareholders = list(shareholder.objects.filter(investor__in=pks))
+    held = dict((s.pk, []) for s in shareholders)
+    for c in certificate.objects.select_related('security').filter(
+            shareholder__investor__in=pks):
+        held[c.shareholder_id].append(c)
+
+    holders = dict((i.pk, []) for i in investors)
+    for s in shareholders:
+        s.investor = lookup[s.investor_id]
+        for c in held[s.pk]:
+            c.shareholder = s
+        prefetched(s, 'certificate_set', 'certificate', held[s.pk])
+        holders[s.investor_id].append(s)
+    for i in investors:
+        prefetched(i, 'shareholder_set', 'shareholder', holders[i.pk])
+
+
 class CertificateQuerySet(QuerySet):
     @property
     def liquidated(self):
         """Calculates the as-converted share totals"""
-        certificates = self.select_related()
-        return sum(filter(
-            None, [t.liquidated for t in certificates]))
+        return certificate_totals(self, ['liquidated'])['liquidated']
 
     @property
     def preference(self):
-        certificates = self.select_related()
-        return sum(filter(
-            None, [t.preference for t in certificates]))
+        return certificate_totals(self, ['preference'])['preference']
 
     @property
     def paid(self):
-        certificates = self.select_related()
-        return sum(filter(
-            None, [t.paid for t in certificates]))
+        return certificate_totals(self, ['paid'])['paid']
 
     @property
     def outstanding_debt(self):
@@ -71,21 +164,15 @@ class CertificateQuerySet(QuerySet):
 
     @property
     def outstanding(self):
-        certificates = self.select_related()
-        return sum(filter(
-            None, [t.outstanding for t in certificates]))
+        return certificate_totals(self, ['outstanding'])['outstanding']
 
     @property
     def converted(self):
-        certificates = self.select_related()
-        return sum(filter(
-            None, [t.converted for t in certificates]))
+        return certificate_totals(self, ['converted'])['converted']
 
     @property
     def diluted(self):
-        certificates = self.select_related()
-        return sum(filter(
-            None, [t.diluted for t in certificates]))
+        return certificate_totals(self, ['diluted'])['diluted']
 
     def discounted(self, pre_valuation=None):
         certificates = self.select_related()
@@ -94,8 +181,9 @@ class CertificateQuerySet(QuerySet):
 
     def prorata(self, new_shares):
         certificates = self.select_related()
-        return sum(filter(
-            None, [t.prorata(new_shares) for t in certificates]))
+        with cache_scope():
+            return sum(filter(
+                None, [t.prorata(new_shares) for t in certificates]))
 
     def exchanged(self, pre_valuation, price):
         certificates = self.select_related()
@@ -168,16 +256,186 @@ class CertificateQuerySet(QuerySet):
         return sum(filter(
             None, [t.vested for t in certificates]))
 
+    @property
+    def vesting_timeline(self):
+        """Return the ``vesting.VestingTimeline`` of the certificates."""
+        return VestingTimeline(self.select_related('security'))
+
     @property
     def outstanding_shares(self):
         certificates = self.select_related()
         return sum(filter(
             None, [t.outstanding_shares for t in certificates]))
 
-    def proceeds(self, purchase_price):
+    def proceeds(self, purchase_price, price=None):
+        # The waterfall only depends on the purchase price and the cap
+        # table, so run it once and share the result across certificates.
+        if price is None:
+            price = share_price(purchase_price)
         certificates = self.select_related()
         return sum(filter(
-            None, [t.proceeds(purchase_price) for t in certificates]))
+            None, [t.proceeds(purchase_price, price) for t in certificates]))
+
+
+# The totals annotated by ``InvestorQuerySet.with_totals``.
+INVESTOR_TOTALS = ['outstanding', 'paid', 'preference', 'liquidated']
+
+# The certificate columns summed by ``certificate_totals``, and the
+# terms of the security needed to turn those sums into totals.
+SUMMED_FIELDS = [
+    'shares', 'returned', 'cash', 'refunded', 'principal', 'forgiven',
+    'granted', 'exercised', 'cancelled']
+TERM_FIELDS = [
+    'security__security_type', 'security__conversion_ratio',
+    'security__price_per_share', 'security__liquidation_preference']
+
+
+def _outstanding(row):
+    if row['security__security_type'] in [
+            SECURITY_TYPE_COMMON,
+            SECURITY_TYPE_PREFERRED]:
+        return row['shares'] - row['returned']
+    elif row['security__security_type'] in [
+            SECURITY_TYPE_WARRANT,
+            SECURITY_TYPE_OPTION]:
+        return row['granted'] - row['cancelled'] - row['exercised']
+    else:
+        return 0
+
+
+def _paid(row):
+    if row['security__security_type'] in [
+            SECURITY_TYPE_COMMON,
+            SECURITY_TYPE_PREFERRED,
+            SECURITY_TYPE_WARRANT]:
+        return row['cash'] - row['refunded']
+    elif row['security__security_type'] in [
+            SECURITY_TYPE_CONVERTIBLE]:
+        return row['principal'] - row['forgiven']
+    else:
+        return 0
+
+
+def _converted(row):
+    if row['security__security_type'] == SECURITY_TYPE_PREFERRED:
+        return _outstanding(row) * row['security__conversion_ratio']
+    elif row['security__security_type'] in [
+            SECURITY_TYPE_OPTION,
+            SECURITY_TYPE_WARRANT]:
+        return 0
+    else:
+        return _outstanding(row)
+
+
+def _diluted(row):
+    if row['security__security_type'] == SECURITY_TYPE_PREFERRED:
+        return _outstanding(row) * row['security__conversion_ratio']
+    elif row['security__security_type'] in [
+            SECURITY_TYPE_OPTION,
+            SECURITY_TYPE_WARRANT]:
+        return row['granted'] - row['cancelled'] - row['exercised']
+    else:
+        return _outstanding(row)
+
+
+def _liquidated(row):
+    if row['security__security_type'] == SECURITY_TYPE_PREFERRED:
+        return row['shares'] * row['security__conversion_ratio']
+    elif row['security__security_type'] == SECURITY_TYPE_WARRANT:
+        return row['granted']
+    else:
+        return 0
+
+
+def _preference(row):
+    if row['security__security_type'] == SECURITY_TYPE_PREFERRED:
+        return (
+            _outstanding(row)
+            * row['security__price_per_share']
+            * row['security__liquidation_preference'])
+    else:
+        return 0
+
+
+TOTALS = {
+    'outstanding': _outstanding,
+    'paid': _paid,
+    'converted': _converted,
+    'diluted': _diluted,
+    'liquidated': _liquidated,
+    'preference': _preference,
+}
+
+# Convertibles accrue interest and common stock and options vest, both
+# as of today, so these totals can not be summed by the database.
+DEFERRED_TOTALS = {
+    'outstanding': [],
+    'paid': [],
+    'converted': [SECURITY_TYPE_CONVERTIBLE],
+    'diluted': [SECURITY_TYPE_CONVERTIBLE],
+    'liquidated': [
+        SECURITY_TYPE_CONVERTIBLE,
+        SECURITY_TYPE_COMMON,
+        SECURITY_TYPE_OPTION],
+    'preference': [SECURITY_TYPE_CONVERTIBLE],
+}
+
+
+def certificate_totals(certificates, metrics, group_by=None):
+    """Total certificate metrics in the database.
+
+    Rather than building every certificate and summing its properties,
+    the certificate columns are summed by the database, grouped by the
+    terms of their security, and the totals are calculated from those
+    sums.  Only the date-dependent parts of the calculation -- vesting
+    and convertible interest -- fall back to the certificate properties,
+    and only for the certificates of those security types.
+
+    Returns a dictionary of the total of each of ``metrics``.  If
+    ``group_by`` is given as a lookup (such as ``'shareholder__investor'``)
+    each total is itself a dictionary keyed by the value of the lookup.
+    """
+    fields = TERM_FIELDS + ([group_by] if group_by else [])
+    rows = certificates.order_by().values(*fields).annotate(
+        **dict((f, Sum(f)) for f in SUMMED_FIELDS))
+
+    totals = dict((metric, {}) for metric in metrics)
+    deferred = set()
+    for row in rows:
+        key = row[group_by] if group_by else None
+        for metric in metrics:
+            if row['security__security_type'] in DEFERRED_TOTALS[metric]:
+                deferred.add(row['security__security_type'])
+                continue
+            totals[metric][key] = sum(filter(
+                None, [totals[metric].get(key), TOTALS[metric](row)]))
+
+    if deferred:
+        related = ['security']
+        if group_by:
+            path = group_by.split('__')
+            if len(path) > 1:
+                related.append('__'.join(path[:-1]))
+        for c in certificates.filter(
+                security__security_type__in=deferred).select_related(*related):
+            key = None
+            if group_by:
+                obj = c
+                for attr in path[:-1]:
+                    obj = getattr(obj, attr)
+                key = getattr(obj, path[-1] + '_id')
+            for metric in metrics:
+                if c.security.security_type in DEFERRED_TOTALS[metric]:
+                    totals[metric][key] = sum(filter(
+                        None, [totals[metric].get(key), getattr(c, metric)]))
+
+    if group_by:
+        return totals
+    return dict((metric, totals[metric].get(None, 0)) for metric in metrics)
+
+
+Tranche = namedtuple('Tranche', [
+    'shares', 'preference', 'is_participating', 'participation_cap'])
 
 
 def share_price(purchase_price):
@@ -186,50 +444,97 @@ def share_price(purchase_price):
     In the event of a liquidation different classes of stock are
     treated differently.  This function produces the price of
     each security per the terms under which it was offered.
+
+    Results are stored against the version of the cap table; see
+    ``cache.versioned``.
     """
+    return versioned(
+        'captable:share_price:{0!r}'.format(float(purchase_price)),
+        lambda: _share_price(purchase_price))
+
+
+def _share_price(purchase_price):
 
     # First, gather all the transactions for this company.
     certificate = get_model('captable', 'Certificate')
     certificates = certificate.objects.select_related()
 
+    # Determine the priority of the most senior security.
+    security = get_model('captable', 'Security')
+    seniority = security.objects.select_related().aggregate(
+            t=Max('seniority'))['t']
+
+    def tranche(x):
+        # Filter for all the certificates at this level of seniority,
+        # and set the number of shares and preference accordingly.
+        tranch_certificates = certificates.filter(security__seniority=x)
+
+        # We also need to check for participation.
+        is_participating = False
+        participation_cap = None
+        for t in tranch_certificates:
+            if t.security.is_participating:
+                is_participating = True
+                participation_cap = t.security.participation_cap
+                break
+
+        return Tranche(
+            tranch_certificates.liquidated,
+            tranch_certificates.preference,
+            is_participating,
+            participation_cap)
+
+    return liquidate(
+        purchase_price, certificates.liquidated, seniority, tranche)
+
+
+def liquidate(purchase_price, residual_shares, seniority, tranche, outcome=None):
+    """Run the liquidation waterfall.
+
+    This is the core of ``share_price``, separated from the database so
+    that it can be run against any representation of the cap table.
+    ``residual_shares`` is the total number of shares liquidated,
+    ``seniority`` the priority of the most senior security, and
+    ``tranche`` a callable returning the ``Tranche`` at a given seniority.
+    Returns a dictionary of the price per share at each seniority.
+
+    If an ``outcome`` dictionary is given, it is filled with the
+    ``WATERFALL_*`` outcome of each seniority: whether it fell short of
+    its preference, took it, participated, or converted to common.
+    """
+    if outcome is None:
+        outcome = {}
+
     # Set the intial values for the variables that will be used
     # within the liquidation loop.
     residual_cash = purchase_price
-    residual_shares = certificates.liquidated
 
     # Initiate the output variable
     price = {}
 
-    # Determine the priority of the most senior security.
-    security = get_model('captable', 'Security')
-    x = security.objects.select_related().aggregate(
-            t=Max('seniority'))['t']
+    x = seniority
 
     # We are now going to loop through all certificates, grouped
     # and ordered by security
     while x > 0:
 
+        # Get the shares, preference and participation of all the
+        # certificates at this level of seniority.
+        tranch_shares, tranch_preference, is_participating, participation_cap = tranche(x)
+
+        # Nothing may be held at a seniority, such as that of a series
+        # not yet issued as of some date, and then there's nothing to pay.
+        if not tranch_shares:
+            price.update({x: 0.0})
+            outcome.update({x: WATERFALL_PREFERENCE})
+            x -= 1
+            continue
+
         # Determine the price per share of whatever is left at
         # this point.  This number serves as the threshold for
         # all of the conditional logic.
         residual_price = residual_cash / residual_shares
 
-        # Now filter for all the certificates at this level of seniority.
-        tranch_certificates = certificates.filter(security__seniority=x)
-
-        # And set the number of shares and preference accordingly.
-        tranch_shares = tranch_certificates.liquidated
-        tranch_preference = tranch_certificates.preference
-
-        # We also need to check for participation, and set those
-        # variables for the conditional logic.
-        is_participating = False
-        for t in tranch_certificates:
-            if t.security.is_participating:
-                is_participating = True
-                participation_cap = t.security.participation_cap
-                break
-
         # With the prep work done, it's time for the core algorthm.
 
         # First we need to see if there's enough cash to cover the
@@ -239,9 +544,11 @@ def share_price(purchase_price):
         if tranch_preference > residual_cash:
             residual_price = residual_cash / tranch_shares
             price.update({x: residual_price})
+            outcome.update({x: WATERFALL_SHORTFALL})
             x -= 1
             while x > 0:
                 price.update({x: 0.0})
+                outcome.update({x: WATERFALL_EXHAUSTED})
                 x -= 1
             break
 
@@ -256,6 +563,7 @@ def share_price(purchase_price):
                 if (tranch_preference * participation_cap) / tranch_shares < residual_price:
                     while x > 0:
                         price.update({x: residual_price})
+                        outcome.update({x: WATERFALL_CONVERTED})
                         x -= 1
                     break
 
@@ -271,6 +579,7 @@ def share_price(purchase_price):
                     residual_cash -= part_price * tranch_shares
                     residual_shares -= tranch_shares
                     price.update({x: part_price})
+                    outcome.update({x: WATERFALL_PARTICIPATING})
                     x -= 1
 
             # If there is no cap then the security is fully
@@ -284,6 +593,7 @@ def share_price(purchase_price):
                     (residual_cash - tranch_preference) / residual_shares])
                 residual_cash -= tranch_preference
                 price.update({x: part_price})
+                outcome.update({x: WATERFALL_PARTICIPATING})
                 x -= 1
 
         # if the overall price per share, diluted, exceeds the preference then
@@ -299,6 +609,7 @@ def share_price(purchase_price):
         elif (tranch_preference / tranch_shares) < residual_price:
             while x > 0:
                 price.update({x: residual_price})
+                outcome.update({x: WATERFALL_CONVERTED})
                 x -= 1
             break
 
@@ -309,6 +620,7 @@ def share_price(purchase_price):
         # and send through the loop again.
         else:
             price.update({x: tranch_preference / tranch_shares})
+            outcome.update({x: WATERFALL_PREFERENCE})
             residual_cash -= tranch_preference
             residual_shares -= tranch_shares
             x -= 1
@@ -326,26 +638,26 @@ def proforma(new_money, pre_valuation, pool_rata):
     pre-valuation.  This function assumes the standard case that all
     convertibles and options are "in the pre", meaning that they are
     considered as part of the determination of the share price.
+
+    Results are stored against the version of the cap table; see
+    ``cache.versioned``.
     """
+    return versioned(
+        'captable:proforma:{0!r}:{1!r}:{2!r}'.format(
+            float(new_money), float(pre_valuation), float(pool_rata)),
+        lambda: _proforma(new_money, pre_valuation, pool_rata))
+
 
+def _proforma(new_money, pre_valuation, pool_rata):
     # First, get the certificates
     certificate = get_model('captable', 'Certificate')
     security = get_model('captable', 'Security')
     certificates = certificate.objects.select_related()
     securities = security.objects.select_related()
 
-    # The post valuation is simply the prevaluation plus the new cash.
-    post_valuation = pre_valuation + new_money
-
-    # First, calculate what the new investors will expect in terms of
-    # ownership after the financing has occured.
-    # This will include any prorata from existing investors.
-    new_investor_rata = new_money / post_valuation
-
     # Calculate what the convertible investors will expect per the terms
     # of their debt instrument.
     discounted = certificates.discounted(pre_valuation)
-    convert_rata = discounted / post_valuation
 
     # Add the available options for use in calculating
     # the new option pool.  This puts the resultant option
@@ -357,6 +669,36 @@ def proforma(new_money, pre_valuation, pool_rata):
     # pool rata, and is calculated on a fully diluted
     pre_shares = certificates.outstanding
 
+    with cache_scope():
+        return finance(
+            new_money, pre_valuation, pool_rata,
+            discounted, available, pre_shares, certificates.prorata)
+
+
+def finance(new_money, pre_valuation, pool_rata,
+            discounted, available, pre_shares, prorata):
+    """Calculate a prospective financing from cap table totals.
+
+    This is the core of ``proforma``, separated from the database so
+    that it can be run against any representation of the cap table.
+    ``discounted`` is the purchase power of all convertibles at the
+    pre-valuation, ``available`` the options available in the pool,
+    ``pre_shares`` the shares outstanding, and ``prorata`` a callable
+    returning the prorata shares elected for a number of new shares.
+    """
+
+    # The post valuation is simply the prevaluation plus the new cash.
+    post_valuation = pre_valuation + new_money
+
+    # First, calculate what the new investors will expect in terms of
+    # ownership after the financing has occured.
+    # This will include any prorata from existing investors.
+    new_investor_rata = new_money / post_valuation
+
+    # Calculate what the convertible investors will expect per the terms
+    # of their debt instrument.
+    convert_rata = discounted / post_valuation
+
     # Aggregate the rata and determine the total expansion of
     # capital from the existing number of outstanding shares
     # and available option pool.  If the pool is not being expanded
@@ -380,7 +722,7 @@ def proforma(new_money, pre_valuation, pool_rata):
     # ratably buy into the next round should they wish to.  See
     # additional explanation and some caveats in the prorata
     # method below under the Transaction model.
-    new_prorata_shares = certificates.prorata(new_money_shares)
+    new_prorata_shares = prorata(new_money_shares)
     new_investor_shares = new_money_shares - new_prorata_shares
 
     # Finally, calculate the price of the new offering.
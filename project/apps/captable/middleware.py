@@ -0,0 +1,84 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .cache import open_scope, close_scope, committed
+from .instrumentation import (
+    QueryRecorder, QueryBudgetExceeded, REPEATED, view_budget)
+
+
+logger = logging.getLogger(__name__)
+
+
+class CacheScopeMiddleware(object):
+    """Cache cap table totals for the duration of each request.
+
+    See ``cache.cache_scope``.  Changes the request made in a transaction,
+    such as those of the admin, move the cap table on to a new version
+    once it is over; see ``cache.committed``.
+    """
+
+    def process_request(self, request):
+        open_scope()
+
+    def process_response(self, request, response):
+        close_scope()
+        committed()
+        return response
+
+    def process_exception(self, request, exception):
+        close_scope()
+        committed()
+
+
+class QueryBudgetMiddleware(object):
+    """Count the queries and time of each view and its templates.
+
+    It's a diagnostic for development and tests, and is only used with
+    the ``QUERY_BUDGET_ENABLED`` setting.  Views that run more queries
+    than their budget in the ``QUERY_BUDGETS`` setting, keyed by the
+    name of their URL, or than ``QUERY_BUDGET_DEFAULT``, and views that
+    repeat identical SQL, are logged as warnings with the properties
+    that ran the queries.  With
+    ``QUERY_BUDGET_STRICT`` they raise ``QueryBudgetExceeded`` instead,
+    which fails the tests that request them.  It goes before
+    ``CacheScopeMiddleware``, so the scope is closed even when it raises.
+    Streamed responses run their queries after the middleware is done,
+    and aren't counted.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            raise MiddlewareNotUsed
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = getattr(request, 'resolver_match', None)
+        request.query_view = (match and match.url_name) or view_func.__name__
+        request.query_recorder = QueryRecorder(
+            budget=view_budget(request.query_view),
+            threshold=getattr(settings, 'QUERY_REPEATED', REPEATED)).__enter__()
+
+    def process_response(self, request, response):
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is None:
+            return response
+        recorder.__exit__(None, None, None)
+        del request.query_recorder
+
+        response['X-Query-Count'] = str(len(recorder.queries))
+        response['X-Query-Time'] = '{0:.1f}ms'.format(recorder.time * 1000)
+        problems = recorder.problems(recorder.budget, recorder.threshold)
+        if problems:
+            message = '{0}: {1}\n{2}'.format(
+                request.query_view, '\n'.join(problems), recorder.report())
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_exception(self, request, exception):
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is not None:
+            recorder.__exit__(None, None, None)
+            del request.query_recorder
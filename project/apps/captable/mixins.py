@@ -0,0 +1,445 @@
+from __future__ import division
+
+import datetime
+from dateutil.relativedelta import relativedelta
+
+from .constants import *
+
+from .vesting import Schedule
+
+
+class CertificateMixin(object):
+    """Calculations on a single certificate.
+
+    These calculations only depend on the fields of the certificate
+    and the terms of its underlying ``security``, so they are kept apart
+    from the ``Certificate`` model itself.  That allows the same math
+    to run against anything shaped like a certificate, such as the plain
+    records loaded by ``CapTableSnapshot``, without touching the database.
+
+    Vesting and interest are calculated as of today, or as of the date
+    ``as_of`` if it is set, as it is on the records of a snapshot of the
+    cap table as of that date.
+    """
+
+    as_of = None
+
+    @property
+    def vested(self):
+        """Calculates the vested shares.
+
+        Stock which is granted to founders, employees, advisors and other
+        non-investors typically vests over time.  This means that while
+        the underlying security has technically be granted to the recipient,
+        a portion of it is subject to repurchase according to a vesting
+        schedule.  Vesting is a technique used to ensure the continued
+        service of an employee of the company through time.  This
+        method calcuates the number of shares vested in the underlying
+        security given the terms of the original grant.
+
+        This property is specifically used in the calculation of
+        liquidation proceeds, which only considers vested shares.  Thus,
+        the calculation for convertibles consideres the default
+        conversion price, which occurs in a liquidation and is different
+        than the number of shares converted in a financing.
+        """
+
+        # First, directly address the conditions where vesting
+        # is irrelevant
+
+        # Preferred stock doesn't vest, as it is used by investors.
+        if self.security.security_type == SECURITY_TYPE_PREFERRED:
+            return self.outstanding
+
+        # Convertibles don't vest, but they do convert at the default price
+        # Thus vested represents what outstanding shares would be in play
+        # TODO Consider whether this should be zero.
+        if self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
+            return self.exchanged()
+
+        # TODO check and see where I might be considering warrants vested
+
+        # vested_direct allows for ad-hoc vesting.  If that is the
+        # case then enter that number and skip the rest.
+        if self.vested_direct:
+            return self.vested_direct
+
+        # A "Single Trigger" is a provision in an agreement which
+        # stipulates that all securities immediately vest in full
+        # upon a change of control.  It is rare to grant single-
+        # tiggers; a double-trigger is more common for founders/key
+        # executives.  Normal employees generally don't get trigger
+        # provisions at all.
+        if self.vesting_trigger == TRIGGER_SINGLE:
+            return self.outstanding
+
+
+        # All that remains at this point are common stock, options
+        # and warrants which follow standard vesting.
+        stake = self.outstanding
+
+        # Calculate the immediately vested portion.  Sometimes
+        # founders receive a year vesting immediately as a
+        # expression of "time served."  This also can be an
+        # inducement for a key hire/advisor, etc.
+        # If there is no immediate vesting it will have no
+        # impact on the equation.
+        immediate = stake * self.vesting_immediate
+        residual = stake - immediate
+
+        # For the remaining, non-immediately vested portion,
+        # calculate the number of months vesting
+        months_vesting_period = self.vesting_term
+
+        # If the vesting was halted due to termination, etc.,
+        # use that date for the ending period.  Otherwise,
+        # use today to calculate the total vesting period.
+        if self.vesting_stop:
+            vesting_stop = self.vesting_stop
+        else:
+            vesting_stop = self.as_of or datetime.date.today()
+        if self.as_of and vesting_stop > self.as_of:
+            vesting_stop = self.as_of
+
+        # Now calculate the total number of months vested from
+        # the start and the stop dates, in months.
+        rd = relativedelta(vesting_stop, self.vesting_start)
+        months_vested = rd.years * 12 + rd.months
+
+        # Many grants will have a "cliff", meaning an initial
+        # period before any grants will vest.  Determine the
+        # cliff in terms of months.
+        months_cliff = self.vesting_cliff
+
+        # Grants are fully vested if all time has passed.
+        if months_vested > months_vesting_period:
+            residual_vested = residual
+        # And nothing has vested if within the cliff
+        elif months_vested < months_cliff:
+            residual_vested = 0
+        # Finally, calculate the rata portion of whatever
+        # didn't immediately vest according to the amount of
+        # time passed.
+        else:
+            monthly_vested = residual / months_vesting_period
+            residual_vested = monthly_vested * months_vested
+        return immediate + residual_vested
+
+    @property
+    def vesting_schedule(self):
+        """Return the ``vesting.Schedule`` of the vested shares by date.
+
+        The schedule answers ``vested`` as of any date, where ``vested``
+        itself only knows today (or the date vesting stopped.)
+        """
+        return Schedule.for_certificate(self)
+
+    @property
+    def outstanding(self):
+        if self.security.security_type in [
+                SECURITY_TYPE_COMMON,
+                SECURITY_TYPE_PREFERRED]:
+            return self.shares - self.returned
+        elif self.security.security_type in [SECURITY_TYPE_WARRANT]:
+            return self.granted - self.cancelled - self.exercised
+        elif self.security.security_type in [SECURITY_TYPE_OPTION]:
+            return self.granted - self.cancelled - self.exercised
+        # elif self.security.security_type in [SECURITY_TYPE_CONVERTIBLE]:
+        #     return self.accrued - self.forgiven
+        else:
+            return 0
+
+
+
+    @property
+    def paid(self):
+        if self.security.security_type in [
+            SECURITY_TYPE_COMMON,
+            SECURITY_TYPE_PREFERRED,
+            SECURITY_TYPE_WARRANT]:
+            return self.cash - self.refunded
+        elif self.security.security_type in [
+            SECURITY_TYPE_CONVERTIBLE]:
+            return self.principal - self.forgiven
+        else:
+            return 0
+
+    @property
+    def converted(self):
+        """Calculate the number of shares on an ``as converted`` basis.
+
+        All securities have the potential to eventually become
+        shares of common stock.  This function takes the transaction
+        and produces the number of shares of common stock it represents
+        on a "as converted" basis.  This result is used directly in the
+        liquidation analysis, and is also used in calculating the
+        fully-diluted share price, the demoninator of which assumes
+        all securities convert to common.
+        """
+        # Preferred stock converts into a multiple of common stock.
+        if self.security.security_type == SECURITY_TYPE_PREFERRED:
+            return self.outstanding * self.security.conversion_ratio
+
+        # The as-converted number assumes the default price,
+        # so use the ``exchanged`` function
+        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
+            return self.exchanged()
+
+        # Converted assumes all rights are exercised fully,
+        # even the unvested portion
+        # TODO: this should included vested
+        elif self.security.security_type in [
+                SECURITY_TYPE_OPTION,
+                SECURITY_TYPE_WARRANT]:
+            # return self.granted - self.cancelled - self.exercised
+            return 0
+
+        # All that remains is common stock, which
+        # by definition requires no conversion.
+        else:
+            return self.outstanding
+
+    @property
+    def diluted(self):
+        """Calculate the number of shares on an ``fully diluted`` basis.
+
+        All securities have the potential to eventually become
+        shares of common stock.  This function takes the transaction
+        and produces the number of shares of common stock it represents
+        if all the possible issues that could be distributed and exercised
+        were distributed and exercised.
+        """
+        # Preferred stock converts into a multiple of common stock.
+        if self.security.security_type == SECURITY_TYPE_PREFERRED:
+            return self.outstanding * self.security.conversion_ratio
+
+        # The as-converted number assumes the default price,
+        # so use the ``exchanged`` function
+        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
+            return self.exchanged()
+
+        # Converted assumes all rights are exercised fully,
+        # even the unvested portion
+        # TODO: the difference here from converted should be one of VESTING
+        elif self.security.security_type in [
+                SECURITY_TYPE_OPTION,
+                SECURITY_TYPE_WARRANT]:
+            return self.granted - self.cancelled - self.exercised
+
+        # All that remains is common stock, which
+        # by definition requires no conversion.
+        else:
+            return self.outstanding
+
+    @property
+    def liquidated(self):
+        """Calculate the shares that would be liquidated in a liquidation.
+
+        Redeemed is a shortcut method that simply calculates shares that
+        would be liquidated in a liquidation at any given point in time.
+        It would typically represent the number of shares "as converted"
+        less the unallocated option pool and all unvested common stock/
+        options.  All debt converts at the default conversion price.
+        """
+
+        if self.security.security_type == SECURITY_TYPE_PREFERRED:
+            return self.shares * self.security.conversion_ratio
+        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
+            return self.exchanged()
+        elif self.security.security_type == SECURITY_TYPE_WARRANT:
+            return self.granted
+        else:
+            return self.vested
+
+    @property
+    def preference(self):
+        """Calculate the total preference of the transaction.
+
+        Preferred stock is entitled to be paid in preference to common
+        stock (hence the name 'preferred'.)  This function calculates
+        the amount of the cash preference per the terms of the security.
+        """
+        # We use the ``price_per_share`` variable here since the
+        # original investment vehicle may have been a convertible
+        # and the original cash paid may not be relevant.
+        # Note: this is an important concept which can affect future
+        # financings.  The term is called "liquidation overhang"
+        # and you should learn more about it.  Yokum Taku at WSGR
+        # has proposed  solutions to avoid it and you should
+        # read about them here:
+        # http://www.startupcompanylawyer.com/category/convertible-note-bridge-financing/
+        if self.security.security_type == SECURITY_TYPE_PREFERRED:
+            return (
+                self.outstanding
+                * self.security.price_per_share
+                * self.security.liquidation_preference)
+        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
+            try:
+                # If the stock converts it will share the same preference
+                # as its parent security.
+                return self.outstanding_debt * self.liquidation_preference
+                # But if there is no parent then it reverts to the debt itself
+                # This basically means that the preference is calling
+                # the loan itself due and payable (with interest.)
+            except:
+                return self.accrued
+        else:
+            return 0
+
+    @property
+    def accrued(self):
+        """Calculate the total accrued debt per the interest rate"""
+
+        # Only debt accrues interest.
+        if self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
+
+            # Calculate the interest and add to the principal.
+            if self.converted_date:
+                converted_date = self.converted_date
+            else:
+                converted_date = self.as_of or datetime.date.today()
+            if self.as_of and converted_date > self.as_of:
+                converted_date = self.as_of
+            # Convertible debt interest is nearly always simple interest.
+            interest = self.principal * self.security.interest_rate * (
+                (converted_date - self.date).days)/365
+            return round(self.principal + interest, 2)
+
+        else:
+            return None
+
+    def discounted(self, pre_valuation=None):
+        """Calculate the purchase power of a convertible.
+
+        Convertibles convert into preferred stock according to the terms
+        of the original note.  Typically this takes the form of
+        A) a discount off of the purchase price, or
+        B) a 'capped' price based on a specified pre-valuation.
+        Each of these approaches represents a specific number in the
+        purchase power of a given dollar of convertible debt.  For
+        instance, $1 is worth $1.25, discounted 20%. [(1/(1-.2))=1.25].
+
+        This function takes the existing convertible and
+        returns the current value of the transaction in terms of the
+        equivalent dollar value at which it can purchase the next round
+        (or default conversion) of preferred stock.
+        """
+        if self.security.security_type != SECURITY_TYPE_CONVERTIBLE:
+            return 0
+        else:
+            # Next we choose between the two conversion approaches
+
+            # Choice A is the the value of the original loan in
+            # equivalent dollars per the discount rate.
+            discounted = self.accrued / (1-self.security.discount_rate)
+
+            # Choice B is the value of the original loan in
+            # equivalent dollars per the capped value in relation
+            # to the pre-valuation
+            if not pre_valuation:
+                pre_valuation = self.security.pre
+            capped = self.accrued * (pre_valuation/self.security.price_cap)
+
+            # Then, simply pick whichever approach is best and return that.
+            return max(discounted, capped)
+
+
+    def exchanged(self, pre_valuation=None, price=None):
+        """Calculate the shares from a convertible note.
+
+        Convertible debt is designed to convert into the next security
+        offering as part of a financing.  Convertibles used to be called
+        'bridge loans' specifically because there were typically only
+        used in those transitional situations.  However, convertibles
+        have become more popular as financing instruments in their own
+        right, and there are often situations where there is no subsequent
+        financing and the convertibles must convert in a liquidation.
+
+        Typically there will be 'change of control' provisions written
+        into the terms of the convertible, with the standard case being
+        that they convert into the latest round of preferred stock at a
+        predetermined default price.  This function returns what the
+        convertible represents in shares under those considitions.
+        Note: if your convertible terms do not include these provisions
+        then get them added immediatley.  You don't want to get into
+        legal wrangling over unclear terms in the event of a liquidation.
+        It will be a huge hassle and you don't want to make a potential
+        purchaser worried about the unknowns involved.
+
+        Note holders will also often have the right to make their
+        debt immediately due upon a change of control; use the accrued
+        property to determine what that amount will be should they
+        elect to do so.
+        """
+        #  Don't convert what can't be converted
+        if self.security.security_type != SECURITY_TYPE_CONVERTIBLE:
+            return 0
+        elif pre_valuation:
+            # Get the discounted value according to that method,
+            # and divide by the price to calculate the number of shares.
+            return self.discounted(pre_valuation) / price
+        else:
+            # Use the accrued value divided by the default price.
+            return self.accrued / self.security.price_per_share
+
+
+class memoized(object):
+    """A ``CertificateMixin`` property, calculated once per evaluation."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calculate = getattr(CertificateMixin, name).fget
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        values = instance._values
+        if self.name not in values:
+            values[self.name] = self.calculate(instance)
+        return values[self.name]
+
+
+class CertificateEvaluation(CertificateMixin):
+    """The calculations of a single certificate, each made only once.
+
+    The properties of ``CertificateMixin`` call one another -- ``vested``
+    calls ``outstanding`` and ``converted`` calls ``exchanged``, which
+    calls ``accrued`` -- and each of them reads the terms of the security
+    again, which on a model without ``select_related`` can mean a query.
+    An evaluation resolves the security once, reads the fields of the
+    certificate through to it, and remembers every metric, and the
+    discounted and exchanged shares at each price, the first time they
+    are calculated.  It's a snapshot of the certificate as it is when
+    evaluated, so make a new one if the certificate changes.
+    """
+
+    outstanding = memoized('outstanding')
+    paid = memoized('paid')
+    converted = memoized('converted')
+    diluted = memoized('diluted')
+    vested = memoized('vested')
+    liquidated = memoized('liquidated')
+    preference = memoized('preference')
+    accrued = memoized('accrued')
+
+    def __init__(self, certificate):
+        self._certificate = certificate
+        self._values = {}
+        self.security = certificate.security
+        self.as_of = certificate.as_of
+
+    def __getattr__(self, name):
+        return getattr(self._certificate, name)
+
+    def discounted(self, pre_valuation=None):
+        key = ('discounted', pre_valuation)
+        if key not in self._values:
+            self._values[key] = CertificateMixin.discounted(self, pre_valuation)
+        return self._values[key]
+
+    def exchanged(self, pre_valuation=None, price=None):
+        key = ('exchanged', pre_valuation, price)
+        if key not in self._values:
+            self._values[key] = CertificateMixin.exchanged(
+                self, pre_valuation, price)
+        return self._values[key]
@@ -1,7 +1,6 @@
 from __future__ import division
 
 import datetime
-from dateutil.relativedelta import relativedelta
 
 from django.db import models
 from django.db.models import Sum, Max
@@ -15,7 +14,15 @@ from model_utils.managers import PassThroughManager
 
 from .constants import *
 
+from .mixins import CertificateMixin, CertificateEvaluation
+
+from .cache import (
+    cache_scope, cached, memoize, clear, bump_version, generation)
+
+from . import rollups
+
 from .managers import (
+    InvestorQuerySet,
     SecurityQuerySet,
     CertificateQuerySet,
     share_price,
@@ -49,6 +56,8 @@ class Investor(models.Model):
     notes = models.TextField(blank=True, help_text="""
         A free-form notes field added for convenience.""")
 
+    objects = PassThroughManager.for_queryset_class(InvestorQuerySet)()
+
     class Meta:
         ordering = ['name']
 
@@ -62,49 +71,88 @@ class Investor(models.Model):
     def get_absolute_url(self):
         return reverse('investor_detail', args=[str(self.slug)])
 
-    def proceeds(self, purchase_price):
-        certificates = Certificate.objects.filter(
-            shareholder__investor=self)
-        return sum(filter(None, [c.proceeds(purchase_price) for c in certificates]))
+    @memoize
+    def proceeds(self, purchase_price, price=None):
+        if price is None:
+            price = share_price(purchase_price)
+        return sum(filter(None, [
+            c.proceeds(purchase_price, price) for c in self.certificates()]))
+
+    def holdings(self):
+        """Return the prefetched certificates of the investor, if any.
+
+        The certificates are those cached by ``with_holdings``, or by
+        ``prefetch_related('shareholder_set__certificate_set__security')``;
+        None is returned if they haven't been.
+        """
+        shareholders = getattr(self, '_prefetched_objects_cache', {}).get(
+            'shareholder')
+        if shareholders is None:
+            return None
+        certificates = []
+        for s in shareholders:
+            if 'certificate' not in getattr(s, '_prefetched_objects_cache', {}):
+                return None
+            certificates.extend(s.certificate_set.all())
+        return certificates
+
+    def certificates(self):
+        """Return the certificates of the investor, prefetched if they are."""
+        certificates = self.holdings()
+        if certificates is None:
+            certificates = Certificate.objects.select_related('security').filter(
+                shareholder__investor=self)
+        return certificates
+
+    def _total(self, metric):
+        # Use the total annotated by ``with_totals`` if there is one.
+        total = getattr(self, 'total_' + metric, None)
+        if total is not None:
+            return total
+        certificates = self.holdings()
+        if certificates is not None:
+            return sum(filter(None, [getattr(c, metric) for c in certificates]))
+        return getattr(Certificate.objects.filter(
+            shareholder__investor=self), metric)
 
     @property
+    @memoize
     def liquidated(self):
-        certificates = Certificate.objects.filter(
-            shareholder__investor=self)
-        return sum(filter(None, [c.liquidated for c in certificates]))
+        return self._total('liquidated')
 
     @property
+    @memoize
     def outstanding(self):
-        certificates = Certificate.objects.filter(
-            shareholder__investor=self)
-        return sum(filter(None, [c.outstanding for c in certificates]))
+        return self._total('outstanding')
 
     @property
+    @memoize
     def paid(self):
-        certificates = Certificate.objects.filter(
-            shareholder__investor=self)
-        return sum(filter(None, [c.paid for c in certificates]))
+        return self._total('paid')
 
     @property
+    @memoize
     def preference(self):
-        certificates = Certificate.objects.filter(
-            shareholder__investor=self)
-        return sum(filter(None, [c.preference for c in certificates]))
-
-    def proceeds_rata(self, purchase_price):
-        proceeds = self.proceeds(purchase_price)
-        total = Certificate.objects.select_related().proceeds(purchase_price)
+        return self._total('preference')
+
+    @memoize
+    def proceeds_rata(self, purchase_price, price=None):
+        if price is None:
+            price = share_price(purchase_price)
+        proceeds = self.proceeds(purchase_price, price)
+        total = Certificate.objects.select_related().proceeds(purchase_price, price)
         return proceeds / total
 
+    @memoize
     def prorata(self, new_shares):
-        certificates = Certificate.objects.filter(
-            shareholder__investor=self)
-        return sum(filter(None, [c.prorata(new_shares) for c in certificates]))
+        with cache_scope():
+            return sum(filter(None, [
+                c.prorata(new_shares) for c in self.certificates()]))
 
+    @memoize
     def exchanged(self, pre_valuation=None, price=None):
-        certificates = Certificate.objects.filter(
-            shareholder__investor=self)
-        return sum(filter(None, [c.exchanged(pre_valuation, price) for c in certificates]))
+        return sum(filter(None, [
+            c.exchanged(pre_valuation, price) for c in self.certificates()]))
 
 
 class Shareholder(models.Model):
@@ -261,37 +309,46 @@ class Security(models.Model):
             return u'Rights'
 
     @property
+    @memoize
     def authorized(self):
         return Addition.objects.select_related().filter(
             security=self).aggregate(t=Sum('authorized'))['t']
 
     @property
+    @memoize
     def available(self):
         return self.authorized - self.outstanding
 
     @property
+    @memoize
     def outstanding(self):
         return Certificate.objects.select_related().filter(
             security=self).outstanding
 
     @property
+    @memoize
     def outstanding_rata(self):
         outstanding = self.outstanding
-        total = Certificate.objects.select_related().outstanding
+        total = cached(
+            'outstanding', lambda: Certificate.objects.select_related().outstanding)
         return outstanding / total
 
     @property
+    @memoize
     def converted(self):
         return Certificate.objects.select_related().filter(
             security=self).converted
 
     @property
+    @memoize
     def converted_rata(self):
         converted = self.converted
-        total = Certificate.objects.select_related().converted
+        total = cached(
+            'converted', lambda: Certificate.objects.select_related().converted)
         return converted / total
 
     @property
+    @memoize
     def diluted(self):
         if self.security_type == SECURITY_TYPE_OPTION:
             return Addition.objects.select_related().filter(
@@ -301,13 +358,18 @@ class Security(models.Model):
                 security=self).diluted
 
     @property
+    @memoize
     def diluted_rata(self):
         diluted = self.diluted
-        certs = Certificate.objects.select_related().diluted
-        avail = Addition.objects.select_related().filter(
-            security__security_type=SECURITY_TYPE_OPTION).aggregate(
-                t=Sum('authorized'))['t']
-        total = sum(filter(None, [certs, avail]))
+
+        def fully_diluted():
+            certs = Certificate.objects.select_related().diluted
+            avail = Addition.objects.select_related().filter(
+                security__security_type=SECURITY_TYPE_OPTION).aggregate(
+                    t=Sum('authorized'))['t']
+            return sum(filter(None, [certs, avail]))
+
+        total = cached('diluted', fully_diluted)
         return diluted / total
 
 
@@ -321,7 +383,7 @@ class Addition(models.Model):
     allows for the total authorized sum of each Security to fluctutate
     through time as needed by the board.
     """
-    date = models.DateField(default=datetime.date.today, help_text="""
+    date = models.DateField(default=datetime.date.today, db_index=True, help_text="""
         The date the additional shares/options were added to the security.""")
     authorized = models.IntegerField(blank=True, null=True, help_text="""
         This is the number of new shares/options added to the authorized
@@ -341,7 +403,7 @@ class Addition(models.Model):
             date=self.date)
 
 
-class Certificate(models.Model):
+class Certificate(CertificateMixin, models.Model):
     """Certificate represents a specific record of ownership.
 
     The Certificate model represents the physical record of ownership,
@@ -368,7 +430,7 @@ class Certificate(models.Model):
     slug = models.SlugField(unique=True, help_text="""
         The slug forms the URL at which this certificate may be accessed.
         It is automatically generated, but can be overwritten heres.""")
-    date = models.DateField(default=datetime.date.today, help_text="""
+    date = models.DateField(default=datetime.date.today, db_index=True, help_text="""
         The date when the certificate was issued.""")
     shares = models.FloatField(default=0, help_text="""
         The shares of the transction, as expressed by the
@@ -470,351 +532,72 @@ class Certificate(models.Model):
     def get_absolute_url(self):
         return reverse('certificate_detail', args=[str(self.slug)])
 
-
     @property
-    def vested(self):
-        """Calculates the vested shares.
-
-        Stock which is granted to founders, employees, advisors and other
-        non-investors typically vests over time.  This means that while
-        the underlying security has technically be granted to the recipient,
-        a portion of it is subject to repurchase according to a vesting
-        schedule.  Vesting is a technique used to ensure the continued
-        service of an employee of the company through time.  This
-        method calcuates the number of shares vested in the underlying
-        security given the terms of the original grant.
-
-        This property is specifically used in the calculation of
-        liquidation proceeds, which only considers vested shares.  Thus,
-        the calculation for convertibles consideres the default
-        conversion price, which occurs in a liquidation and is different
-        than the number of shares converted in a financing.
+    def evaluation(self):
+        """Return the ``CertificateEvaluation`` of the certificate.
+
+        Within a cache scope the certificate is evaluated once, so its
+        metrics are each calculated once however often they are read,
+        until a field of the certificate is set or the cap table
+        changes.  The evaluation is kept on the certificate, and goes
+        with it.  Otherwise each metric is evaluated afresh, with the
+        security resolved once for the whole of it.
         """
-
-        # First, directly address the conditions where vesting
-        # is irrelevant
-
-        # Preferred stock doesn't vest, as it is used by investors.
-        if self.security.security_type == SECURITY_TYPE_PREFERRED:
-            return self.outstanding
-
-        # Convertibles don't vest, but they do convert at the default price
-        # Thus vested represents what outstanding shares would be in play
-        # TODO Consider whether this should be zero.
-        if self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
-            return self.exchanged()
-
-        # TODO check and see where I might be considering warrants vested
-
-        # vested_direct allows for ad-hoc vesting.  If that is the
-        # case then enter that number and skip the rest.
-        if self.vested_direct:
-            return vested_direct
-
-        # A "Single Trigger" is a provision in an agreement which
-        # stipulates that all securities immediately vest in full
-        # upon a change of control.  It is rare to grant single-
-        # tiggers; a double-trigger is more common for founders/key
-        # executives.  Normal employees generally don't get trigger
-        # provisions at all.
-        if self.vesting_trigger == TRIGGER_SINGLE:
-            return self.outstanding
-
-
-        # All that remains at this point are common stock, options
-        # and warrants which follow standard vesting.
-        stake = self.outstanding
-
-        # Calculate the immediately vested portion.  Sometimes
-        # founders receive a year vesting immediately as a
-        # expression of "time served."  This also can be an
-        # inducement for a key hire/advisor, etc.
-        # If there is no immediate vesting it will have no
-        # impact on the equation.
-        immediate = stake * self.vesting_immediate
-        residual = stake - immediate
-
-        # For the remaining, non-immediately vested portion,
-        # calculate the number of months vesting
-        months_vesting_period = self.vesting_term
-
-        # If the vesting was halted due to termination, etc.,
-        # use that date for the ending period.  Otherwise,
-        # use today to calculate the total vesting period.
-        if self.vesting_stop:
-            vesting_stop = self.vesting_stop
-        else:
-            vesting_stop = datetime.date.today()
-
-        # Now calculate the total number of months vested from
-        # the start and the stop dates, in months.
-        rd = relativedelta(vesting_stop, self.vesting_start)
-        months_vested = rd.years * 12 + rd.months
-
-        # Many grants will have a "cliff", meaning an initial
-        # period before any grants will vest.  Determine the
-        # cliff in terms of months.
-        months_cliff = self.vesting_cliff
-
-        # Grants are fully vested if all time has passed.
-        if months_vested > months_vesting_period:
-            residual_vested = residual
-        # And nothing has vested if within the cliff
-        elif months_vested < months_cliff:
-            residual_vested = 0
-        # Finally, calculate the rata portion of whatever
-        # didn't immediately vest according to the amount of
-        # time passed.
-        else:
-            monthly_vested = residual / months_vesting_period
-            residual_vested = monthly_vested * months_vested
-        return immediate + residual_vested
-
+        current = generation()
+        if current is None:
+            return CertificateEvaluation(self)
+        evaluation = self.__dict__.get('_evaluation')
+        if evaluation is None or self.__dict__['_generation'] != current:
+            evaluation = CertificateEvaluation(self)
+            self.__dict__['_evaluation'] = evaluation
+            self.__dict__['_generation'] = current
+        return evaluation
+
+    def __setattr__(self, name, value):
+        # Setting a field, such as ``returned`` in a form, makes the
+        # evaluation out of date.
+        if '_evaluation' in self.__dict__ and name in CERTIFICATE_FIELDS:
+            del self.__dict__['_evaluation']
+        super(Certificate, self).__setattr__(name, value)
+
+    # The metrics of ``CertificateMixin``, calculated by an evaluation.
     @property
     def outstanding(self):
-        if self.security.security_type in [
-                SECURITY_TYPE_COMMON,
-                SECURITY_TYPE_PREFERRED]:
-            return self.shares - self.returned
-        elif self.security.security_type in [SECURITY_TYPE_WARRANT]:
-            return self.granted - self.cancelled - self.exercised
-        elif self.security.security_type in [SECURITY_TYPE_OPTION]:
-            return self.granted - self.cancelled - self.exercised
-        # elif self.security.security_type in [SECURITY_TYPE_CONVERTIBLE]:
-        #     return self.accrued - self.forgiven
-        else:
-            return 0
-
-
+        return self.evaluation.outstanding
 
     @property
     def paid(self):
-        if self.security.security_type in [
-            SECURITY_TYPE_COMMON,
-            SECURITY_TYPE_PREFERRED,
-            SECURITY_TYPE_WARRANT]:
-            return self.cash - self.refunded
-        elif self.security.security_type in [
-            SECURITY_TYPE_CONVERTIBLE]:
-            return self.principal - self.forgiven
-        else:
-            return 0
+        return self.evaluation.paid
 
     @property
     def converted(self):
-        """Calculate the number of shares on an ``as converted`` basis.
-
-        All securities have the potential to eventually become
-        shares of common stock.  This function takes the transaction
-        and produces the number of shares of common stock it represents
-        on a "as converted" basis.  This result is used directly in the
-        liquidation analysis, and is also used in calculating the
-        fully-diluted share price, the demoninator of which assumes
-        all securities convert to common.
-        """
-        # Preferred stock converts into a multiple of common stock.
-        if self.security.security_type == SECURITY_TYPE_PREFERRED:
-            return self.outstanding * self.security.conversion_ratio
-
-        # The as-converted number assumes the default price,
-        # so use the ``exchanged`` function
-        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
-            return self.exchanged()
-
-        # Converted assumes all rights are exercised fully,
-        # even the unvested portion
-        # TODO: this should included vested
-        elif self.security.security_type in [
-                SECURITY_TYPE_OPTION,
-                SECURITY_TYPE_WARRANT]:
-            # return self.granted - self.cancelled - self.exercised
-            return 0
-
-        # All that remains is common stock, which
-        # by definition requires no conversion.
-        else:
-            return self.outstanding
+        return self.evaluation.converted
 
     @property
     def diluted(self):
-        """Calculate the number of shares on an ``fully diluted`` basis.
+        return self.evaluation.diluted
 
-        All securities have the potential to eventually become
-        shares of common stock.  This function takes the transaction
-        and produces the number of shares of common stock it represents
-        if all the possible issues that could be distributed and exercised
-        were distributed and exercised.
-        """
-        # Preferred stock converts into a multiple of common stock.
-        if self.security.security_type == SECURITY_TYPE_PREFERRED:
-            return self.outstanding * self.security.conversion_ratio
-
-        # The as-converted number assumes the default price,
-        # so use the ``exchanged`` function
-        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
-            return self.exchanged()
-
-        # Converted assumes all rights are exercised fully,
-        # even the unvested portion
-        # TODO: the difference here from converted should be one of VESTING
-        elif self.security.security_type in [
-                SECURITY_TYPE_OPTION,
-                SECURITY_TYPE_WARRANT]:
-            return self.granted - self.cancelled - self.exercised
-
-        # All that remains is common stock, which
-        # by definition requires no conversion.
-        else:
-            return self.outstanding
+    @property
+    def vested(self):
+        return self.evaluation.vested
 
     @property
     def liquidated(self):
-        """Calculate the shares that would be liquidated in a liquidation.
-
-        Redeemed is a shortcut method that simply calculates shares that
-        would be liquidated in a liquidation at any given point in time.
-        It would typically represent the number of shares "as converted"
-        less the unallocated option pool and all unvested common stock/
-        options.  All debt converts at the default conversion price.
-        """
-
-        if self.security.security_type == SECURITY_TYPE_PREFERRED:
-            return self.shares * self.security.conversion_ratio
-        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
-            return self.exchanged()
-        elif self.security.security_type == SECURITY_TYPE_WARRANT:
-            return self.granted
-        else:
-            return self.vested
+        return self.evaluation.liquidated
 
     @property
     def preference(self):
-        """Calculate the total preference of the transaction.
-
-        Preferred stock is entitled to be paid in preference to common
-        stock (hence the name 'preferred'.)  This function calculates
-        the amount of the cash preference per the terms of the security.
-        """
-        # We use the ``price_per_share`` variable here since the
-        # original investment vehicle may have been a convertible
-        # and the original cash paid may not be relevant.
-        # Note: this is an important concept which can affect future
-        # financings.  The term is called "liquidation overhang"
-        # and you should learn more about it.  Yokum Taku at WSGR
-        # has proposed  solutions to avoid it and you should
-        # read about them here:
-        # http://www.startupcompanylawyer.com/category/convertible-note-bridge-financing/
-        if self.security.security_type == SECURITY_TYPE_PREFERRED:
-            return (
-                self.outstanding
-                * self.security.price_per_share
-                * self.security.liquidation_preference)
-        elif self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
-            try:
-                # If the stock converts it will share the same preference
-                # as its parent security.
-                return self.outstanding_debt * self.liquidation_preference
-                # But if there is no parent then it reverts to the debt itself
-                # This basically means that the preference is calling
-                # the loan itself due and payable (with interest.)
-            except:
-                return self.accrued
-        else:
-            return 0
+        return self.evaluation.preference
 
     @property
     def accrued(self):
-        """Calculate the total accrued debt per the interest rate"""
-
-        # Only debt accrues interest.
-        if self.security.security_type == SECURITY_TYPE_CONVERTIBLE:
-
-            # Calculate the interest and add to the principal.
-            if self.converted_date:
-                converted_date = self.converted_date
-            else:
-                converted_date = datetime.date.today()
-            # Convertible debt interest is nearly always simple interest.
-            interest = self.principal * self.security.interest_rate * (
-                (converted_date - self.date).days)/365
-            return round(self.principal + interest, 2)
-
-        else:
-            return None
+        return self.evaluation.accrued
 
     def discounted(self, pre_valuation=None):
-        """Calculate the purchase power of a convertible.
-
-        Convertibles convert into preferred stock according to the terms
-        of the original note.  Typically this takes the form of
-        A) a discount off of the purchase price, or
-        B) a 'capped' price based on a specified pre-valuation.
-        Each of these approaches represents a specific number in the
-        purchase power of a given dollar of convertible debt.  For
-        instance, $1 is worth $1.25, discounted 20%. [(1/(1-.2))=1.25].
-
-        This function takes the existing convertible and
-        returns the current value of the transaction in terms of the
-        equivalent dollar value at which it can purchase the next round
-        (or default conversion) of preferred stock.
-        """
-        if self.security.security_type != SECURITY_TYPE_CONVERTIBLE:
-            return 0
-        else:
-            # Next we choose between the two conversion approaches
-
-            # Choice A is the the value of the original loan in
-            # equivalent dollars per the discount rate.
-            discounted = self.accrued / (1-self.security.discount_rate)
-
-            # Choice B is the value of the original loan in
-            # equivalent dollars per the capped value in relation
-            # to the pre-valuation
-            if not pre_valuation:
-                pre_valuation = self.security.pre
-            capped = self.accrued * (pre_valuation/self.security.price_cap)
-
-            # Then, simply pick whichever approach is best and return that.
-            return max(discounted, capped)
-
+        return self.evaluation.discounted(pre_valuation)
 
     def exchanged(self, pre_valuation=None, price=None):
-        """Calculate the shares from a convertible note.
-
-        Convertible debt is designed to convert into the next security
-        offering as part of a financing.  Convertibles used to be called
-        'bridge loans' specifically because there were typically only
-        used in those transitional situations.  However, convertibles
-        have become more popular as financing instruments in their own
-        right, and there are often situations where there is no subsequent
-        financing and the convertibles must convert in a liquidation.
-
-        Typically there will be 'change of control' provisions written
-        into the terms of the convertible, with the standard case being
-        that they convert into the latest round of preferred stock at a
-        predetermined default price.  This function returns what the
-        convertible represents in shares under those considitions.
-        Note: if your convertible terms do not include these provisions
-        then get them added immediatley.  You don't want to get into
-        legal wrangling over unclear terms in the event of a liquidation.
-        It will be a huge hassle and you don't want to make a potential
-        purchaser worried about the unknowns involved.
-
-        Note holders will also often have the right to make their
-        debt immediately due upon a change of control; use the accrued
-        property to determine what that amount will be should they
-        elect to do so.
-        """
-        #  Don't convert what can't be converted
-        if self.security.security_type != SECURITY_TYPE_CONVERTIBLE:
-            return 0
-        elif pre_valuation:
-            # Get the discounted value according to that method,
-            # and divide by the price to calculate the number of shares.
-            return self.discounted(pre_valuation) / price
-        else:
-            # Use the accrued value divided by the default price.
-            return self.accrued / self.security.price_per_share
+        return self.evaluation.exchanged(pre_valuation, price)
 
     def prorata(self, new_shares):
         """Return the Investor's prorata.
@@ -839,7 +622,8 @@ class Certificate(models.Model):
         if self.is_prorata:
 
             # Calculation of the rata is done on a fully-diluted basis.
-            fully_diluted = Security.objects.diluted
+            fully_diluted = cached(
+                'fully_diluted', lambda: Security.objects.diluted)
 
             # Get the current rata
             current_rata = self.outstanding / fully_diluted
@@ -849,10 +633,70 @@ class Certificate(models.Model):
         else:
             return 0
 
-    def proceeds(self, purchase_price):
+    def proceeds(self, purchase_price, price=None):
         """Calculate proceeds from transaction at given purchase price.
 
         Calculates the proceeds from a transaction given a particular purchase
-        price.
+        price.  The per-seniority ``price`` produced by ``share_price`` is
+        the same for every certificate at a given purchase price, so callers
+        summing proceeds over many certificates should calculate it once
+        and pass it in rather than replaying the waterfall each time.
         """
-        return self.liquidated * share_price(purchase_price)[self.security.seniority]
+        if price is None:
+            price = share_price(purchase_price)
+        return self.liquidated * price[self.security.seniority]
+
+
+# The names of the fields of a certificate, and of their attributes.
+CERTIFICATE_FIELDS = frozenset(
+    name for f in Certificate._meta.fields for name in [f.name, f.attname])
+
+
+class SecurityRollup(models.Model):
+    """SecurityRollup holds the running share totals of a Security.
+
+    The totals of a security would otherwise be recalculated from all of
+    its additions and certificates on every access.  The rollup instead
+    keeps them in a single row, which is adjusted by the difference each
+    addition or certificate makes as it is saved or deleted (see
+    ``rollups``.)  Bulk updates bypass that, so use the
+    ``rebuild_rollups`` command to recalculate and check the rollups.
+
+    Convertibles accrue interest daily, so the converted and diluted
+    shares of convertible securities are not rolled up and are
+    calculated from the certificates instead.
+    """
+    security = models.OneToOneField(Security, related_name='rollup', help_text="""
+        The security whose totals are rolled up.""")
+    authorized = models.FloatField(blank=True, null=True, help_text="""
+        The total shares authorized by the additions to the security.""")
+    outstanding = models.FloatField(default=0, help_text="""
+        The total shares outstanding of the certificates of the security.""")
+    converted = models.FloatField(default=0, help_text="""
+        The total shares of the certificates on an as converted basis.""")
+    diluted = models.FloatField(default=0, help_text="""
+        The total shares on a fully diluted basis.  For option plans, this
+        is the total authorized.""")
+
+    def __unicode__(self):
+        return "{security} rollup".format(
+            security=self.security)
+
+    @property
+    def available(self):
+        return self.authorized - self.outstanding
+
+
+# Discard any cached cap table totals and results once the rows they
+# are calculated from change.
+for model in [Investor, Shareholder, Security, Addition, Certificate]:
+    models.signals.post_save.connect(bump_version, sender=model)
+    models.signals.post_delete.connect(bump_version, sender=model)
+
+# Keep the security rollups up to date.
+models.signals.post_save.connect(rollups.security_saved, sender=Security)
+for model in [Addition, Certificate]:
+    models.signals.pre_save.connect(rollups.read_row, sender=model)
+    models.signals.post_save.connect(rollups.row_saved, sender=model)
+    models.signals.pre_delete.connect(rollups.read_row, sender=model)
+    models.signals.post_delete.connect(rollups.row_deleted, sender=model)
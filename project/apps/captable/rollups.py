@@ -0,0 +1,170 @@
+from __future__ import division
+
+from django.db.models import get_model, F
+
+from .constants import *
+
+from .snapshot import CertificateRecord, SecurityRecord
+
+
+# The fields of each row which its contribution to a rollup depends on.
+ROLLUP_FIELDS = {
+    'certificate': [
+        'security_id', 'shares', 'returned', 'granted', 'cancelled',
+        'exercised'],
+    'addition': ['security_id', 'authorized'],
+}
+
+TOTALS = ['authorized', 'outstanding', 'converted', 'diluted']
+
+
+def state(instance):
+    fields = ROLLUP_FIELDS[instance._meta.model_name]
+    return dict((f, instance.__dict__.get(f)) for f in fields)
+
+
+def contribution(kind, state, security):
+    """Return the amount a row adds to each total of its security's rollup.
+
+    ``state`` holds the ``ROLLUP_FIELDS`` of the row and ``security`` the
+    terms of its security.
+    """
+    totals = dict((t, 0) for t in TOTALS)
+    if kind == 'addition':
+        totals['authorized'] = state['authorized'] or 0
+        if security.security_type == SECURITY_TYPE_OPTION:
+            totals['diluted'] = totals['authorized']
+        return totals
+
+    certificate = CertificateRecord(**state)
+    certificate.security = security
+    totals['outstanding'] = certificate.outstanding
+    # Convertibles accrue, so they are calculated as needed, and option
+    # plans are diluted by everything authorized rather than granted.
+    if security.security_type != SECURITY_TYPE_CONVERTIBLE:
+        totals['converted'] = certificate.converted
+        if security.security_type != SECURITY_TYPE_OPTION:
+            totals['diluted'] = certificate.diluted
+    return totals
+
+
+def _security(pk):
+    security = get_model('captable', 'Security')
+    rows = security.objects.filter(pk=pk).values(
+        'id', 'security_type', 'conversion_ratio')
+    return SecurityRecord(**rows[0]) if rows else None
+
+
+def calculate(security):
+    """Calculate the rollup totals of a security from scratch."""
+    addition = get_model('captable', 'Addition')
+    certificate = get_model('captable', 'Certificate')
+    security = _security(security.pk)
+    totals = dict((t, 0) for t in TOTALS)
+    rows = (
+        [('addition', row) for row in addition.objects.filter(
+            security=security.pk).values(*ROLLUP_FIELDS['addition'])] +
+        [('certificate', row) for row in certificate.objects.filter(
+            security=security.pk).values(*ROLLUP_FIELDS['certificate'])])
+    authorized = False
+    for kind, row in rows:
+        if kind == 'addition' and row['authorized'] is not None:
+            authorized = True
+        for t, value in contribution(kind, row, security).items():
+            totals[t] += value
+    # As with ``Security.authorized``, nothing is authorized without
+    # any additions.
+    if not authorized:
+        totals['authorized'] = None
+    return totals
+
+
+def rebuild(security, check=False):
+    """Recalculate the rollup of a security.
+
+    Returns a list of ``(total, stored, calculated)`` for each total that
+    had drifted.  With ``check`` the rollup is not updated.
+    """
+    rollup_model = get_model('captable', 'SecurityRollup')
+    totals = calculate(security)
+    try:
+        rollup = rollup_model.objects.get(security=security.pk)
+    except rollup_model.DoesNotExist:
+        rollup = rollup_model(security_id=security.pk)
+    drift = []
+    for t in TOTALS:
+        stored = getattr(rollup, t) if rollup.pk else None
+        # Nothing authorized and none authorized amount to the same.
+        difference = abs((stored or 0) - (totals[t] or 0))
+        if not rollup.pk or difference > 1e-6 * max(1, abs(totals[t] or 0)):
+            drift.append((t, stored, totals[t]))
+        setattr(rollup, t, totals[t])
+    if drift and not check:
+        rollup.save()
+    return drift
+
+
+def adjust(kind, old, new):
+    """Apply the difference between two states of a row to the rollups."""
+    deltas = {}
+    securities = {}
+    for sign, row in [(-1, old), (1, new)]:
+        if not row or not row['security_id']:
+            continue
+        pk = row['security_id']
+        if pk not in securities:
+            securities[pk] = _security(pk)
+        if securities[pk] is None:
+            continue
+        delta = deltas.setdefault(pk, dict((t, 0) for t in TOTALS))
+        for t, value in contribution(kind, row, securities[pk]).items():
+            delta[t] += sign * value
+
+    rollup = get_model('captable', 'SecurityRollup')
+    for pk, delta in deltas.items():
+        if not any(delta.values()):
+            continue
+        rollups = rollup.objects.filter(security=pk)
+        if delta['authorized']:
+            rollups.filter(authorized__isnull=True).update(authorized=0)
+        rollups.update(**dict((t, F(t) + delta[t]) for t in TOTALS))
+
+
+def read_row(sender, instance, raw=False, **kwargs):
+    """Read what a row contributes to its rollup before it changes.
+
+    Connected to the ``pre_save`` and ``pre_delete`` signals of additions
+    and certificates.  The row is read back from the database rather than
+    from the state the instance was loaded with, since another instance
+    of the same row may have been saved since.
+    """
+    instance._rollup = None
+    if instance.pk is not None and not raw:
+        rows = sender._default_manager.filter(pk=instance.pk).values(
+            *ROLLUP_FIELDS[instance._meta.model_name])
+        instance._rollup = rows[0] if rows else None
+
+
+def row_saved(sender, instance, created=False, raw=False, **kwargs):
+    """Apply the difference a saved addition or certificate made."""
+    kind = instance._meta.model_name
+    new = state(instance)
+    if raw:
+        # Fixtures are loaded without reading what the row was before.
+        security = _security(new['security_id']) if new['security_id'] else None
+        if security is not None:
+            rebuild(security)
+    else:
+        adjust(kind, getattr(instance, '_rollup', None), new)
+    instance._rollup = None
+
+
+def row_deleted(sender, instance, **kwargs):
+    """Remove what a deleted addition or certificate contributed."""
+    adjust(instance._meta.model_name, getattr(instance, '_rollup', None), None)
+    instance._rollup = None
+
+
+def security_saved(sender, instance, **kwargs):
+    """Recalculate the rollup of a security as its terms change."""
+    rebuild(instance)
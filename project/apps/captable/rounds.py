@@ -0,0 +1,190 @@
+from __future__ import division
+
+import datetime
+import itertools
+
+from django.db.models import get_model
+from django.utils.text import slugify
+
+from .constants import *
+
+from .managers import finance
+from .snapshot import (
+    InvestorRecord,
+    ShareholderRecord,
+    SecurityRecord,
+    AdditionRecord,
+    CertificateRecord,
+)
+
+
+class Financing(object):
+    """The terms of a hypothetical round of financing.
+
+    ``new_money`` is raised at ``pre_valuation``, with the option pool
+    expanded to ``pool_rata`` of the post (or left as is if zero), all
+    "in the pre" as with ``managers.proforma``.  The round issues a new
+    series of preferred stock called ``name``, which by default is the
+    most senior security and has a 1x non-participating preference.
+
+    Every holder of prorata rights takes up all of their prorata unless
+    ``prorata`` maps the primary key of their investor to the fraction
+    of it that they elect; whatever is not taken up goes to the new
+    ``investor``.  Outstanding convertibles convert into the new series
+    with interest accrued up to the ``date`` of the round.
+    """
+
+    def __init__(self, new_money, pre_valuation, pool_rata=0, name=None,
+                 investor=None, date=None, liquidation_preference=1,
+                 is_participating=False, participation_cap=None,
+                 seniority=None, prorata=None):
+        self.new_money = new_money
+        self.pre_valuation = pre_valuation
+        self.pool_rata = pool_rata
+        self.name = name
+        self.investor = investor
+        self.date = date or datetime.date.today()
+        self.liquidation_preference = liquidation_preference
+        self.is_participating = is_participating
+        self.participation_cap = participation_cap
+        self.seniority = seniority
+        self.prorata = prorata or {}
+
+    def __repr__(self):
+        return '<Financing: {0} on {1}>'.format(
+            self.new_money, self.pre_valuation)
+
+
+def defaults(model_name):
+    """Return the default value of every field of a model."""
+    model = get_model('captable', model_name)
+    return dict((f.attname, f.get_default()) for f in model._meta.fields)
+
+
+def apply_financing(snapshot, financing):
+    """Apply a hypothetical financing to a snapshot of the cap table.
+
+    Returns a new ``CapTableSnapshot`` of the cap table after the round,
+    holding the new series, the certificates of the new investors and of
+    the prorata elected, the converted notes and the expanded option
+    pool.  The convertibles that converted are no longer held.  Nothing
+    is written to the database and the given snapshot is left as it is,
+    records being shared between the two, so any number of rounds can be
+    chained and the last of them liquidated like any other snapshot.
+
+    The new snapshot has the ``rounds`` applied so far, each of them the
+    ``Financing`` and the ``managers.finance`` result of the round.
+    """
+    new_money = financing.new_money
+    pre_valuation = financing.pre_valuation
+    date = financing.date
+
+    # Records created by rounds have negative keys, which are never
+    # those of a row in the database.
+    keys = itertools.count(min([0] + [
+        r.pk for r in itertools.chain(
+            snapshot.investors, snapshot.shareholders, snapshot.securities,
+            snapshot.additions, snapshot.certificates)]) - 1, -1)
+
+    # Notes convert with the interest accrued up to the round.
+    notes = [
+        CertificateRecord(**dict(
+            c.__dict__, converted_date=c.converted_date or date))
+        for c in snapshot.certificates
+        if c.security.security_type == SECURITY_TYPE_CONVERTIBLE]
+
+    # The prorata taken up by each shareholder, for any number of new
+    # shares, on a fully diluted basis.
+    fully_diluted = snapshot.fully_diluted
+
+    def elections(new_shares):
+        elected = {}
+        for c in snapshot.certificates:
+            if c.is_prorata and c.outstanding:
+                rata = financing.prorata.get(c.shareholder.investor_id, 1)
+                elected[c.shareholder] = elected.get(c.shareholder, 0) + (
+                    c.outstanding / fully_diluted * new_shares * rata)
+        return elected
+
+    proforma = finance(
+        new_money, pre_valuation, financing.pool_rata,
+        sum(filter(None, [c.discounted(pre_valuation) for c in notes])),
+        snapshot.options_available,
+        snapshot.outstanding(),
+        lambda new_shares: sum(elections(new_shares).values()))
+    price = proforma['price']
+
+    investors = list(snapshot.investors)
+    shareholders = list(snapshot.shareholders)
+    securities = list(snapshot.securities)
+    additions = list(snapshot.additions)
+    certificates = [
+        c for c in snapshot.certificates
+        if c.security.security_type != SECURITY_TYPE_CONVERTIBLE]
+
+    number = len(snapshot.rounds) + 1
+    name = financing.name or 'Round {0}'.format(number)
+    series = SecurityRecord(**dict(
+        defaults('Security'), id=next(keys), name=name,
+        slug=slugify(unicode(name)), date=date,
+        security_type=SECURITY_TYPE_PREFERRED, price_per_share=price,
+        conversion_ratio=1, pre=pre_valuation,
+        liquidation_preference=financing.liquidation_preference,
+        is_participating=financing.is_participating,
+        participation_cap=financing.participation_cap,
+        seniority=financing.seniority or max(
+            [s.seniority for s in securities] or [0]) + 1))
+    securities.append(series)
+    additions.append(AdditionRecord(**dict(
+        defaults('Addition'), id=next(keys), date=date, security_id=series.pk,
+        authorized=proforma['new_money_shares'] + proforma['new_converted_shares'])))
+
+    certificate = defaults('Certificate')
+
+    def issue(shareholder, shares, cash):
+        n = len(certificates) + 1
+        certificates.append(CertificateRecord(**dict(
+            certificate, id=next(keys),
+            name='{0}-{1}'.format(series.slug, n), slug='{0}-{1}'.format(series.slug, n),
+            date=date, security_id=series.pk, shareholder_id=shareholder.pk,
+            shares=shares, cash=cash)))
+
+    if proforma['new_investor_shares']:
+        investor_name = financing.investor or '{0} Investors'.format(name)
+        investor = InvestorRecord(**dict(
+            defaults('Investor'), id=next(keys), name=investor_name,
+            slug=slugify(unicode(investor_name))))
+        shareholder = ShareholderRecord(**dict(
+            defaults('Shareholder'), id=next(keys), name=investor_name,
+            investor_id=investor.pk))
+        investors.append(investor)
+        shareholders.append(shareholder)
+        issue(shareholder, proforma['new_investor_shares'],
+              proforma['new_investor_cash'])
+
+    for shareholder, shares in elections(proforma['new_money_shares']).items():
+        if shares:
+            issue(shareholder, shares, shares * price)
+
+    for c in notes:
+        issue(c.shareholder, c.exchanged(pre_valuation, price), 0)
+
+    if proforma['new_pool_shares']:
+        pools = [
+            s for s in securities if s.security_type == SECURITY_TYPE_OPTION]
+        if pools:
+            pool = pools[0]
+        else:
+            pool = SecurityRecord(**dict(
+                defaults('Security'), id=next(keys), name='Option Plan',
+                slug='option-plan', date=date,
+                security_type=SECURITY_TYPE_OPTION))
+            securities.append(pool)
+        additions.append(AdditionRecord(**dict(
+            defaults('Addition'), id=next(keys), date=date,
+            security_id=pool.pk, authorized=proforma['new_pool_shares'])))
+
+    after = snapshot.from_records(
+        investors, shareholders, securities, additions, certificates)
+    after.rounds = snapshot.rounds + ((financing, proforma),)
+    return after
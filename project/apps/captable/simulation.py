@@ -0,0 +1,160 @@
+from __future__ import division
+
+import datetime
+import math
+import multiprocessing
+
+from dateutil.relativedelta import relativedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import get_model
+
+from .vectorized import CertificateArrays, numpy
+
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# A lognormal exit around $100M, give or take a factor of e.
+PURCHASE_PRICE = ('lognormal', math.log(100000000), 1.0)
+
+
+def sample(distribution, size, rng):
+    """Draw samples from a distribution.
+
+    A distribution is the name of a ``numpy.random.RandomState`` method
+    followed by its arguments, such as ``('lognormal', mean, sigma)``,
+    ``('uniform', low, high)`` or ``('triangular', left, mode, right)``.
+    """
+    name, args = distribution[0], distribution[1:]
+    return getattr(rng, name)(*args, size=size)
+
+
+def share_prices(solver, purchase_prices):
+    """Return the price per share of every seniority at many purchase prices.
+
+    The ``WaterfallSolver`` gives the price of each seniority as a linear
+    function of the purchase price on each of its segments, so the
+    prices of a whole batch are a lookup and a multiply.  Returns an
+    array of one row per purchase price and one column per seniority,
+    starting with a seniority of one.
+    """
+    seniorities = range(1, (solver.seniority or 0) + 1)
+    starts = numpy.array([s.start for s in solver.segments])
+    a = numpy.array([[s.price[x][0] for x in seniorities] for s in solver.segments])
+    b = numpy.array([[s.price[x][1] for x in seniorities] for s in solver.segments])
+    segment = numpy.maximum(
+        numpy.searchsorted(starts, purchase_prices, 'right') - 1, 0)
+    return a[segment] + b[segment] * purchase_prices[:, numpy.newaxis]
+
+
+def payouts(arrays, purchase_prices, months=None):
+    """Run the liquidation waterfall for a batch of exits.
+
+    ``purchase_prices`` is an array of exit values, and ``months`` an
+    optional array of the number of whole months from ``arrays.today``
+    until each exit, which vest shares and accrue interest on notes.
+    Returns the investors, as an array of their primary keys, and the
+    proceeds of each of them, with one row per exit and one column per
+    investor.
+    """
+    investors, column = numpy.unique(arrays.investor, return_inverse=True)
+    result = numpy.zeros((len(purchase_prices), len(investors)))
+    if months is None:
+        months = numpy.zeros(len(purchase_prices), dtype=int)
+    today = arrays.today.astype(datetime.date)
+
+    # The waterfall only changes with the date, so solve it once for
+    # each month of exit and price every exit in that month at once.
+    for month in numpy.unique(months):
+        exits = months == month
+        at = arrays.at(today + relativedelta(months=int(month)))
+        solver = at.waterfall_solver()
+        if solver.seniority is None:
+            continue
+
+        # The shares each investor has liquidated at each seniority.
+        holdings = numpy.zeros((solver.seniority, len(investors)))
+        numpy.add.at(
+            holdings, (at.seniority - 1, column),
+            numpy.nan_to_num(at.liquidated))
+
+        result[exits] = share_prices(
+            solver, purchase_prices[exits]).dot(holdings)
+    return investors, result
+
+
+_arrays = None
+
+
+def _initialize(arrays):
+    global _arrays
+    _arrays = arrays
+
+
+def _payouts(batch):
+    return payouts(_arrays, *batch)[1]
+
+
+def simulate(samples=10000, purchase_price=PURCHASE_PRICE, exit_months=None,
+             percentiles=PERCENTILES, seed=None, processes=1,
+             batch_size=100000, arrays=None):
+    """Simulate the payouts of uncertain exits.
+
+    Samples ``samples`` exit values from the ``purchase_price``
+    distribution (see ``sample``) and, if ``exit_months`` is given, the
+    number of months until each exit from that distribution, rounded
+    down to whole months.  Each exit is run through the liquidation
+    waterfall in batches, as of its date, against certificates loaded
+    once up front.  With more than one of ``processes`` the batches are
+    spread across a pool of worker processes.
+
+    Returns a dictionary of the ``percentiles`` of the purchase price
+    and of the proceeds of every investor -- founders and employees as
+    much as investors -- along with the mean of their proceeds.
+    """
+    if numpy is None:
+        raise ImproperlyConfigured(
+            "The simulation requires NumPy to be installed.")
+    if arrays is None:
+        arrays = CertificateArrays()
+
+    rng = numpy.random.RandomState(seed)
+    prices = numpy.maximum(sample(purchase_price, samples, rng), 0)
+    months = None
+    if exit_months is not None:
+        months = numpy.maximum(
+            numpy.floor(sample(exit_months, samples, rng)), 0).astype(int)
+
+    batches = [
+        (prices[n:n + batch_size],
+         months[n:n + batch_size] if months is not None else None)
+        for n in range(0, samples, batch_size)]
+    investors = numpy.unique(arrays.investor)
+    if processes > 1 and len(batches) > 1:
+        pool = multiprocessing.Pool(processes, _initialize, (arrays,))
+        try:
+            results = pool.map(_payouts, batches)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [payouts(arrays, *batch)[1] for batch in batches]
+    proceeds = numpy.vstack(results) if results else numpy.zeros((0, len(investors)))
+
+    names = dict(get_model('captable', 'Investor').objects.filter(
+        pk__in=investors.tolist()).values_list('pk', 'name'))
+
+    def summarize(values):
+        return dict(zip(
+            percentiles, numpy.percentile(values, percentiles).tolist()))
+
+    return {
+        'samples': samples,
+        'purchase_price': summarize(prices),
+        'investors': [{
+            'pk': pk,
+            'name': names.get(pk),
+            'mean': float(proceeds[:, n].mean()),
+            'percentiles': summarize(proceeds[:, n]),
+        } for n, pk in enumerate(investors.tolist())],
+    }
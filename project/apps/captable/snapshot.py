@@ -0,0 +1,423 @@
+from __future__ import division
+
+from django.db.models import get_model
+
+from .constants import *
+
+from .mixins import CertificateMixin
+from .vesting import VestingTimeline
+
+from .managers import (
+    Tranche,
+    liquidate,
+    finance,
+)
+
+
+class Record(object):
+    """A plain, database-free copy of a single row."""
+
+    kind = None
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+        self.pk = kwargs.get('id')
+
+    def __repr__(self):
+        return '<{0}: {1}>'.format(
+            self.__class__.__name__, getattr(self, 'name', self.pk))
+
+
+class InvestorRecord(Record):
+    kind = 'investor'
+
+
+class ShareholderRecord(Record):
+    kind = 'shareholder'
+
+
+class SecurityRecord(Record):
+    kind = 'security'
+
+
+class AdditionRecord(Record):
+    kind = 'addition'
+
+
+class CertificateRecord(CertificateMixin, Record):
+    kind = 'certificate'
+
+
+class CapTableSnapshot(object):
+    """An in-memory copy of the entire cap table.
+
+    Walking the models to produce a summary runs queries for nearly
+    every number on the page: each certificate loads its security, each
+    security reloads its certificates and each investor filters all
+    certificates again.  The snapshot instead loads every investor,
+    shareholder, security, addition and certificate up front, in one
+    query per table, and answers everything from plain Python objects.
+
+    Metrics take an investor, security or certificate -- either a
+    model instance or one of the records held by the snapshot -- and
+    return the same numbers as the corresponding model property.  With
+    no object, the total over all certificates is returned, as with
+    the ``CertificateQuerySet`` totals.
+
+    With an ``as_of`` date the snapshot is of the cap table as it stood
+    on that date: only the certificates issued and the shares authorized
+    by then are loaded, and vesting and interest are calculated as of
+    then.  Returns, cancellations and exercises aren't dated, and are
+    taken as they are today.
+    """
+
+    # The hypothetical financings applied to the cap table; see ``finance``.
+    rounds = ()
+
+    as_of = None
+
+    def __init__(self, as_of=None):
+        investor = get_model('captable', 'Investor')
+        shareholder = get_model('captable', 'Shareholder')
+        security = get_model('captable', 'Security')
+        addition = get_model('captable', 'Addition')
+        certificate = get_model('captable', 'Certificate')
+
+        self.investors = [
+            InvestorRecord(**row) for row in investor.objects.values()]
+        self.shareholders = [
+            ShareholderRecord(**row) for row in shareholder.objects.values()]
+        self.securities = [
+            SecurityRecord(**row) for row in security.objects.values()]
+        additions = addition.objects.all()
+        certificates = certificate.objects.all()
+        if as_of is not None:
+            # Both are indexed by date.
+            additions = additions.filter(date__lte=as_of)
+            certificates = certificates.filter(date__lte=as_of)
+        self.as_of = as_of
+        self.additions = [
+            AdditionRecord(**row) for row in additions.values()]
+        self.certificates = [
+            CertificateRecord(as_of=as_of, **row)
+            for row in certificates.values()]
+        self._index()
+
+    @classmethod
+    def from_records(cls, investors, shareholders, securities, additions,
+                     certificates):
+        """Return a snapshot of the given records, without any queries.
+
+        Records may be shared with other snapshots, as they are never
+        changed once loaded.
+        """
+        snapshot = cls.__new__(cls)
+        snapshot.investors = list(investors)
+        snapshot.shareholders = list(shareholders)
+        snapshot.securities = list(securities)
+        snapshot.additions = list(additions)
+        snapshot.certificates = list(certificates)
+        snapshot._index()
+        return snapshot
+
+    def _index(self):
+        self._investors = dict((i.pk, i) for i in self.investors)
+        self._shareholders = dict((s.pk, s) for s in self.shareholders)
+        self._securities = dict((s.pk, s) for s in self.securities)
+
+        # Wire up the relations so that the records can be walked the
+        # same way as the models.
+        for s in self.shareholders:
+            s.investor = self._investors[s.investor_id]
+        for a in self.additions:
+            a.security = self._securities.get(a.security_id)
+        for c in self.certificates:
+            c.security = self._securities[c.security_id]
+            c.shareholder = self._shareholders[c.shareholder_id]
+
+        # Index the certificates and additions by their owners.
+        self._certificates = {}
+        for c in self.certificates:
+            self._certificates.setdefault(('certificate', c.pk), []).append(c)
+            self._certificates.setdefault(('security', c.security_id), []).append(c)
+            self._certificates.setdefault(
+                ('investor', c.shareholder.investor_id), []).append(c)
+        self._additions = {}
+        for a in self.additions:
+            self._additions.setdefault(a.security_id, []).append(a)
+
+        # The records never change, so neither do the totals over all of
+        # them, which every rata and prorata divides by.
+        self._totals = {}
+
+    def _total(self, name, calculate):
+        if name not in self._totals:
+            self._totals[name] = calculate()
+        return self._totals[name]
+
+    def _key(self, obj):
+        kind = getattr(obj, 'kind', None) or obj._meta.model_name
+        return kind, obj.pk
+
+    def certificates_for(self, obj=None):
+        """Return the certificates held by an investor, or of a security."""
+        if obj is None:
+            return self.certificates
+        return self._certificates.get(self._key(obj), [])
+
+    def investor(self, obj):
+        return self._investors[obj.pk]
+
+    def security(self, obj):
+        return self._securities[obj.pk]
+
+    def _sum(self, attr, obj=None):
+        if obj is None:
+            return self._total(attr, lambda: sum(filter(
+                None, [getattr(c, attr) for c in self.certificates])))
+        return sum(filter(
+            None, [getattr(c, attr) for c in self.certificates_for(obj)]))
+
+    def outstanding(self, obj=None):
+        return self._sum('outstanding', obj)
+
+    def paid(self, obj=None):
+        return self._sum('paid', obj)
+
+    def converted(self, obj=None):
+        return self._sum('converted', obj)
+
+    def liquidated(self, obj=None):
+        return self._sum('liquidated', obj)
+
+    def preference(self, obj=None):
+        return self._sum('preference', obj)
+
+    def vested(self, obj=None):
+        return self._sum('vested', obj)
+
+    def vesting_timeline(self, obj=None):
+        """Return the ``vesting.VestingTimeline`` of the certificates.
+
+        With an investor or security only its certificates are included.
+        """
+        return VestingTimeline(self.certificates_for(obj))
+
+    def diluted(self, obj=None):
+        # The fully diluted option pool is everything authorized for
+        # it, whether or not it has been granted.
+        if obj is not None:
+            kind, pk = self._key(obj)
+            if kind == 'security':
+                if self._securities[pk].security_type == SECURITY_TYPE_OPTION:
+                    return self.authorized(obj)
+        return self._sum('diluted', obj)
+
+    def discounted(self, obj=None, pre_valuation=None):
+        return sum(filter(None, [
+            c.discounted(pre_valuation) for c in self.certificates_for(obj)]))
+
+    def exchanged(self, obj=None, pre_valuation=None, price=None):
+        return sum(filter(None, [
+            c.exchanged(pre_valuation, price) for c in self.certificates_for(obj)]))
+
+    def authorized(self, security):
+        authorized = [
+            a.authorized for a in self._additions.get(security.pk, [])
+            if a.authorized is not None]
+        if not authorized:
+            return None
+        return sum(authorized)
+
+    def available(self, security):
+        # A plan with nothing authorized as of the date has nothing left.
+        return (self.authorized(security) or 0) - self.outstanding(security)
+
+    @property
+    def options_available(self):
+        """Return the options authorized but not yet granted."""
+        return self._total('options_available', lambda: sum(filter(None, [
+            self.available(s) for s in self.securities
+            if s.security_type == SECURITY_TYPE_OPTION])))
+
+    @property
+    def fully_diluted(self):
+        """Return the fully diluted share count of all securities."""
+        return self._total('fully_diluted', lambda: sum(filter(
+            None, [self.diluted(s) for s in self.securities])))
+
+    def outstanding_rata(self, obj):
+        return self.outstanding(obj) / self.outstanding()
+
+    def converted_rata(self, obj):
+        return self.converted(obj) / self.converted()
+
+    def diluted_rata(self, obj):
+        def total():
+            avail = sum(filter(None, [
+                self.authorized(s) for s in self.securities
+                if s.security_type == SECURITY_TYPE_OPTION]))
+            return sum(filter(None, [self.diluted(), avail]))
+        return self.diluted(obj) / self._total('diluted_rata', total)
+
+    def prorata(self, new_shares, obj=None):
+        # Calculation of the rata is done on a fully-diluted basis.
+        fully_diluted = self.fully_diluted
+        return sum(filter(None, [
+            c.outstanding / fully_diluted * new_shares
+            for c in self.certificates_for(obj) if c.is_prorata]))
+
+    def share_price(self, purchase_price):
+        """Calculate the per-security purchase price in liquidation.
+
+        See ``managers.share_price``.
+        """
+        seniority = max([s.seniority for s in self.securities] or [None])
+        return liquidate(
+            purchase_price, self.liquidated(), seniority, self.tranche)
+
+    def tranche(self, seniority):
+        """Return the ``Tranche`` of certificates at a seniority."""
+        certificates = [
+            c for c in self.certificates if c.security.seniority == seniority]
+        is_participating = False
+        participation_cap = None
+        for c in certificates:
+            if c.security.is_participating:
+                is_participating = True
+                participation_cap = c.security.participation_cap
+                break
+        return Tranche(
+            sum(filter(None, [c.liquidated for c in certificates])),
+            sum(filter(None, [c.preference for c in certificates])),
+            is_participating,
+            participation_cap)
+
+    def waterfall_solver(self):
+        """Return a ``WaterfallSolver`` for the tranches of the snapshot."""
+        from .solver import WaterfallSolver
+        seniority = max([s.seniority for s in self.securities] or [None])
+        return WaterfallSolver(self.liquidated(), seniority, self.tranche)
+
+    def share_price_curve(self, prices, tolerance=0.01):
+        """Run the liquidation waterfall across many purchase prices.
+
+        Exit modelling needs the waterfall at hundreds of purchase prices
+        to draw payout curves.  This works from the tranches and holdings
+        of the snapshot, so the cap table is only loaded once however
+        many prices are given.  Returns a dictionary of:
+
+        - ``prices``, the purchase prices in ascending order,
+        - ``share_price``, the price per share of each seniority at each
+          of those prices,
+        - ``investors``, the proceeds of each investor (by primary key)
+          at each of those prices, and
+        - ``breakpoints``, the purchase prices, to within ``tolerance``,
+          at which a seniority changes its ``WATERFALL_*`` outcome: where
+          its preference is covered, where participation caps trigger
+          conversion, and so on.  Only changes between two of the given
+          prices are found, so sweep finely enough to bracket them.
+        """
+        prices = sorted(prices)
+        seniority = max([s.seniority for s in self.securities] or [None])
+        residual_shares = self.liquidated()
+
+        tranches = {}
+
+        def tranche(x):
+            if x not in tranches:
+                tranches[x] = self.tranche(x)
+            return tranches[x]
+
+        def run(purchase_price):
+            outcome = {}
+            price = liquidate(
+                purchase_price, residual_shares, seniority, tranche, outcome)
+            return price, outcome
+
+        # Each investor's liquidated shares at each seniority.
+        holdings = {}
+        for c in self.certificates:
+            key = (c.shareholder.investor_id, c.security.seniority)
+            holdings[key] = sum(filter(None, [holdings.get(key), c.liquidated]))
+
+        curve = {}
+        investors = dict((i.pk, []) for i in self.investors)
+        breakpoints = []
+        previous = None
+        for purchase_price in prices:
+            price, outcome = run(purchase_price)
+            for x, value in price.items():
+                curve.setdefault(x, []).append(value)
+            proceeds = dict((pk, 0) for pk in investors)
+            for (pk, x), liquidated in holdings.items():
+                proceeds[pk] += liquidated * price[x]
+            for pk, value in proceeds.items():
+                investors[pk].append(value)
+
+            if previous is not None and previous[1] != outcome:
+                low, low_outcome = previous
+                while low_outcome != outcome:
+                    # Bisect for the first change of outcome above ``low``.
+                    a, b = low, purchase_price
+                    while b - a > tolerance:
+                        middle = (a + b) / 2
+                        if run(middle)[1] == low_outcome:
+                            a = middle
+                        else:
+                            b = middle
+                    b_outcome = run(b)[1]
+                    for x in sorted(b_outcome, reverse=True):
+                        if low_outcome.get(x) != b_outcome[x]:
+                            breakpoints.append({
+                                'purchase_price': b,
+                                'seniority': x,
+                                'from': low_outcome.get(x),
+                                'to': b_outcome[x],
+                            })
+                    low, low_outcome = b, b_outcome
+            previous = purchase_price, outcome
+
+        return {
+            'prices': prices,
+            'share_price': curve,
+            'investors': investors,
+            'breakpoints': breakpoints,
+        }
+
+    def proceeds(self, purchase_price, obj=None, price=None):
+        if price is None:
+            price = self.share_price(purchase_price)
+        return sum(filter(None, [
+            c.liquidated * price[c.security.seniority]
+            for c in self.certificates_for(obj)]))
+
+    def proceeds_rata(self, purchase_price, obj, price=None):
+        if price is None:
+            price = self.share_price(purchase_price)
+        return (
+            self.proceeds(purchase_price, obj, price)
+            / self.proceeds(purchase_price, None, price))
+
+    def finance(self, *financings):
+        """Apply hypothetical financings, returning the resulting snapshot.
+
+        See ``rounds.apply_financing``; this snapshot is left unchanged.
+        """
+        from .rounds import apply_financing
+        snapshot = self
+        for financing in financings:
+            snapshot = apply_financing(snapshot, financing)
+        return snapshot
+
+    def proforma(self, new_money, pre_valuation, pool_rata):
+        """Calculate the price and share totals of a prospective financing.
+
+        See ``managers.proforma``.
+        """
+        return finance(
+            new_money, pre_valuation, pool_rata,
+            self.discounted(None, pre_valuation),
+            self.options_available,
+            self.outstanding(),
+            self.prorata)
@@ -0,0 +1,197 @@
+from __future__ import division
+
+from bisect import bisect_right
+from collections import namedtuple
+
+from .constants import *
+
+
+Segment = namedtuple('Segment', ['start', 'price', 'outcome'])
+
+
+class WaterfallSolver(object):
+    """Solve the liquidation waterfall for every purchase price at once.
+
+    ``managers.liquidate`` decides, seniority by seniority, whether the
+    purchase price covers the preference, whether participation is
+    capped and whether the security is better off converting.  Every
+    one of those decisions compares two amounts that are linear in the
+    purchase price, so the price per share of each seniority is a
+    piecewise linear function of it.
+
+    The solver walks the waterfall once per piece, carrying the residual
+    cash as a linear function of the purchase price instead of a number,
+    and solves each of the decisions for the purchase price at which it
+    flips.  The next of those is where the following piece starts.  Any
+    purchase price can then be answered by a binary search over the
+    pieces, and the exact purchase price at which a seniority changes
+    outcome -- such as the exit value at which Series A converts -- can
+    be read off directly.
+
+    Takes the same ``residual_shares``, ``seniority`` and ``tranche``
+    arguments as ``liquidate``.
+    """
+
+    def __init__(self, residual_shares, seniority, tranche):
+        self.residual_shares = residual_shares
+        self.seniority = seniority
+        self.tranches = {}
+        x = seniority
+        while x > 0:
+            self.tranches[x] = tranche(x)
+            x -= 1
+        self.segments = self._solve()
+        self._starts = [s.start for s in self.segments]
+
+    def _walk(self, purchase_price):
+        """Walk the waterfall at a purchase price.
+
+        Returns the price of each seniority, and each decision made, as
+        ``(a, b)`` pairs meaning ``a + b * purchase_price``, along with
+        the outcome of each seniority.
+        """
+        cash = (0.0, 1.0)
+        shares = self.residual_shares
+        price = {}
+        outcome = {}
+        decisions = []
+
+        def value(linear):
+            return linear[0] + linear[1] * purchase_price
+
+        def settle(x, linear, result):
+            while x > 0:
+                price[x] = linear
+                outcome[x] = result
+                x -= 1
+
+        x = self.seniority
+        while x > 0:
+            tranch_shares, tranch_preference, is_participating, participation_cap = self.tranches[x]
+
+            if not tranch_shares:
+                price[x] = (0.0, 0.0)
+                outcome[x] = WATERFALL_PREFERENCE
+                x -= 1
+                continue
+
+            residual_price = (cash[0] / shares, cash[1] / shares)
+
+            shortfall = (tranch_preference - cash[0], -cash[1])
+            decisions.append(shortfall)
+            if value(shortfall) > 0:
+                price[x] = (cash[0] / tranch_shares, cash[1] / tranch_shares)
+                outcome[x] = WATERFALL_SHORTFALL
+                settle(x - 1, (0.0, 0.0), WATERFALL_EXHAUSTED)
+                break
+
+            elif is_participating:
+                part_price = (
+                    tranch_preference / tranch_shares
+                    + (cash[0] - tranch_preference) / shares,
+                    cash[1] / shares)
+                if participation_cap:
+                    capped = (
+                        residual_price[0]
+                        - (tranch_preference * participation_cap) / tranch_shares,
+                        residual_price[1])
+                    decisions.append(capped)
+                    if value(capped) > 0:
+                        settle(x, residual_price, WATERFALL_CONVERTED)
+                        break
+                    cash = (
+                        cash[0] - part_price[0] * tranch_shares,
+                        cash[1] - part_price[1] * tranch_shares)
+                    shares -= tranch_shares
+                else:
+                    cash = (cash[0] - tranch_preference, cash[1])
+                price[x] = part_price
+                outcome[x] = WATERFALL_PARTICIPATING
+                x -= 1
+
+            else:
+                converts = (
+                    residual_price[0] - tranch_preference / tranch_shares,
+                    residual_price[1])
+                decisions.append(converts)
+                if value(converts) > 0:
+                    settle(x, residual_price, WATERFALL_CONVERTED)
+                    break
+                price[x] = (tranch_preference / tranch_shares, 0.0)
+                outcome[x] = WATERFALL_PREFERENCE
+                cash = (cash[0] - tranch_preference, cash[1])
+                shares -= tranch_shares
+                x -= 1
+
+        return price, outcome, decisions
+
+    def _solve(self):
+        segments = []
+        start = 0.0
+        probe = 0.0
+        # Every seniority can only change outcome a few times, so this
+        # bounds the walk should rounding ever stall it.
+        for _ in range(4 * (self.seniority or 0) + 4):
+            price, outcome, decisions = self._walk(probe)
+            if not segments or outcome != segments[-1].outcome:
+                segments.append(Segment(start, price, outcome))
+            else:
+                segments[-1] = Segment(segments[-1].start, price, outcome)
+
+            # The next piece starts where the first of the decisions
+            # made along this path flips.
+            roots = [
+                -a / b for a, b in decisions
+                if b and -a / b > probe]
+            if not roots:
+                break
+            start = min(roots)
+            probe = start + 1e-9 * max(1.0, abs(start))
+        return segments
+
+    def segment(self, purchase_price):
+        """Return the ``Segment`` containing a purchase price."""
+        return self.segments[max(0, bisect_right(self._starts, purchase_price) - 1)]
+
+    def share_price(self, purchase_price):
+        """Return the price of each seniority, as ``share_price`` does."""
+        segment = self.segment(purchase_price)
+        return dict(
+            (x, a + b * purchase_price) for x, (a, b) in segment.price.items())
+
+    @property
+    def breakpoints(self):
+        """Every purchase price at which a seniority changes outcome."""
+        breakpoints = []
+        for previous, segment in zip(self.segments, self.segments[1:]):
+            for x in sorted(segment.outcome, reverse=True):
+                if previous.outcome.get(x) != segment.outcome[x]:
+                    breakpoints.append({
+                        'purchase_price': segment.start,
+                        'seniority': x,
+                        'from': previous.outcome.get(x),
+                        'to': segment.outcome[x],
+                    })
+        return breakpoints
+
+    def threshold(self, seniority, outcome):
+        """Return the lowest purchase price giving a seniority an outcome.
+
+        Returns None if there is no such purchase price.
+        """
+        for segment in self.segments:
+            if segment.outcome.get(seniority) == outcome:
+                return segment.start
+        return None
+
+    def conversion_price(self, seniority):
+        """Return the lowest purchase price at which a seniority converts."""
+        return self.threshold(seniority, WATERFALL_CONVERTED)
+
+    def coverage_price(self, seniority):
+        """Return the lowest purchase price covering a seniority's preference."""
+        for segment in self.segments:
+            if segment.outcome.get(seniority) not in [
+                    WATERFALL_SHORTFALL, WATERFALL_EXHAUSTED]:
+                return segment.start
+        return None
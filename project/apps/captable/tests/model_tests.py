@@ -1,11 +1,42 @@
 from __future__ import division
 
 from django.test import TestCase
+from django.utils.unittest import skipIf
 from django.test.client import Client
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.models import Sum
+from django.core.management.color import no_style
 
 from apps.captable.factories import *
-
+from apps.captable.managers import share_price, proforma, liquidate
+from apps.captable.snapshot import CapTableSnapshot
+from apps.captable.mixins import CertificateMixin
+from apps.captable.cache import cache_scope, version, committed
+from django.core.cache import cache
+from apps.captable.models import SecurityRollup
+from apps.captable.rollups import rebuild
+from apps.captable.views import summary_context, financing_context
+from apps.captable.rounds import Financing
+from apps.captable.grids import evaluate_grid
+from apps.captable.history import ownership_history
+from apps.captable.benchmarks import run_benchmarks
+from apps.captable.generators import clear_captable, generate_captable
+from apps.captable.importers import import_certificates
+from apps.captable.exports import ledger
+from apps.captable.templatetags.captabletags import shares, currency
+from apps.captable.vectorized import CertificateArrays, numpy
+from apps.captable.simulation import simulate, payouts, PERCENTILES
+from apps.captable.instrumentation import query_budget, QueryBudgetExceeded
+from apps.captable.middleware import QueryBudgetMiddleware
+
+import csv
+import json
 import datetime
+import tempfile
+from StringIO import StringIO
 from dateutil.relativedelta import relativedelta
 
 
@@ -512,6 +543,789 @@ class MainTests(TestCase):
         self.assertEqual(round(self.certificate6.proceeds(25000000),2),1307589.92)
         self.assertEqual(round(self.certificate7.proceeds(25000000),2),20495.16)
 
+    def test_certificate_proceeds_shared_price(self):
+        price = share_price(25000000)
+        with self.assertNumQueries(0):
+            self.assertEqual(round(self.certificate4.proceeds(25000000, price),2),5943597.68)
+            self.assertEqual(round(self.certificate6.proceeds(25000000, price),2),1307589.92)
+        self.assertEqual(
+            round(Certificate.objects.proceeds(25000000, price), 2),
+            round(Certificate.objects.proceeds(25000000), 2))
+        self.assertEqual(
+            round(self.investor3.proceeds_rata(10000000, share_price(10000000)),2), .1000)
+
+# Certificate Evaluation
+    def test_certificate_evaluation(self):
+        metrics = [
+            'outstanding', 'paid', 'converted', 'diluted', 'vested',
+            'liquidated', 'preference', 'accrued']
+        for certificate in [self.certificate1, self.certificate5, self.certificate6]:
+            c = Certificate.objects.get(pk=certificate.pk)
+            # Only the security is loaded, once, for every metric.
+            with self.assertNumQueries(1):
+                values = [getattr(c, m) for m in metrics]
+            self.assertEqual(
+                values, [getattr(CertificateMixin, m).fget(c) for m in metrics])
+            self.assertEqual(
+                c.exchanged(40000000, 2), CertificateMixin.exchanged(c, 40000000, 2))
+
+        with cache_scope():
+            evaluation = self.certificate6.evaluation
+            self.assertIs(self.certificate6.evaluation, evaluation)
+            self.certificate6.converted
+            self.assertIn('accrued', evaluation._values)
+            self.certificate6.save()
+            self.assertIsNot(self.certificate6.evaluation, evaluation)
+
+            # Setting a field discards the evaluation.
+            c = Certificate.objects.get(pk=self.certificate1.pk)
+            outstanding = c.outstanding
+            c.returned = 40
+            self.assertEqual(c.outstanding, outstanding - 40)
+
+            # As do the prorata and proceeds, which are calculated from it.
+            c = Certificate.objects.get(pk=self.certificate3.pk)
+            prorata = c.prorata(1000000)
+            proceeds = c.proceeds(25000000)
+            c.shares += 1000
+            self.assertGreater(c.prorata(1000000), prorata)
+            self.assertGreater(c.proceeds(25000000), proceeds)
+            c.is_prorata = False
+            self.assertEqual(c.prorata(1000000), 0)
+
+# Investor QuerySet
+    def test_investor_with_totals(self):
+        # One query for the investors, one grouped query for the totals and
+        # one for the vesting and interest that can't be totaled in SQL.
+        with self.assertNumQueries(3):
+            investors = list(Investor.objects.with_totals())
+        self.assertEqual(len(investors), 7)
+        with self.assertNumQueries(0):
+            for i in investors:
+                for attr in ['outstanding', 'paid', 'preference', 'liquidated']:
+                    getattr(i, attr)
+        for i in investors:
+            fresh = Investor.objects.get(pk=i.pk)
+            for attr in ['outstanding', 'paid', 'preference', 'liquidated']:
+                self.assertAlmostEqual(getattr(i, attr), getattr(fresh, attr), 2)
+
+    def test_investor_with_totals_clone(self):
+        investors = Investor.objects.with_totals().filter(name='Joe Founder')
+        self.assertEqual(investors[0].total_outstanding, 3500000)
+
+    def test_with_holdings(self):
+        expected = dict(
+            (i.pk, (i.outstanding, i.paid, i.preference, i.liquidated,
+                    i.exchanged(40000000, 2)))
+            for i in Investor.objects.all())
+        with self.assertNumQueries(3):
+            investors = list(Investor.objects.with_holdings())
+        with self.assertNumQueries(0):
+            for i in investors:
+                self.assertEqual(
+                    (i.outstanding, i.paid, i.preference, i.liquidated,
+                     i.exchanged(40000000, 2)),
+                    expected[i.pk])
+                for s in i.shareholder_set.all():
+                    self.assertIs(s.investor, i)
+
+        investors = list(Investor.objects.prefetch_related(
+            'shareholder_set__certificate_set__security'))
+        with self.assertNumQueries(0):
+            for i in investors:
+                self.assertEqual(i.outstanding, expected[i.pk][0])
+        self.assertIsNone(self.investor1.holdings())
+
+# Certificate QuerySet
+    def test_certificate_totals(self):
+        certificates = Certificate.objects.select_related()
+        for attr in ['outstanding', 'paid', 'converted', 'diluted',
+                     'liquidated', 'preference']:
+            expected = sum(filter(None, [getattr(c, attr) for c in certificates]))
+            self.assertAlmostEqual(getattr(Certificate.objects, attr), expected, 2)
+            self.assertAlmostEqual(
+                getattr(Certificate.objects.filter(security=self.series_a), attr),
+                getattr(self.certificate3, attr), 2)
+
+    def test_certificate_totals_queries(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Certificate.objects.outstanding, 11610000)
+        with self.assertNumQueries(1):
+            self.assertEqual(Certificate.objects.paid, 7007000)
+        with self.assertNumQueries(2):
+            self.assertEqual(round(Certificate.objects.preference), 7100006)
+
+# Caching
+    def test_cache_scope(self):
+        prorata = self.certificate3.prorata(1000000)
+        with cache_scope():
+            self.assertEqual(self.certificate3.prorata(1000000), prorata)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.certificate3.prorata(1000000), prorata)
+
+            # Saving a certificate discards the cached denominators.
+            self.certificate1.returned = self.certificate1.shares
+            self.certificate1.save()
+            self.assertNotEqual(self.certificate3.prorata(1000000), prorata)
+
+    def test_versioned(self):
+        price = share_price(10000000)
+        with self.assertNumQueries(0):
+            self.assertEqual(share_price(10000000), price)
+            self.assertEqual(share_price(10000000.0), price)
+
+        # Any write moves the cap table on to a new version.
+        current = version()
+        self.investor1.save()
+        self.assertEqual(version(), current + 1)
+        self.certificate5.delete()
+        self.assertEqual(version(), current + 2)
+        self.assertNotEqual(share_price(10000000), price)
+
+        # Changes made in a transaction move it on again once it is over,
+        # after other processes can see them.
+        self.investor1.save()
+        current = version()
+        committed()
+        self.assertEqual(version(), current)
+        connection.in_atomic_block = False
+        try:
+            committed()
+            self.assertEqual(version(), current + 1)
+            committed()
+            self.assertEqual(version(), current + 1)
+        finally:
+            connection.in_atomic_block = True
+
+        # Results are stored for the day, as shares vest and notes accrue.
+        price = share_price(10000000)
+        self.assertEqual(cache.get('captable:share_price:10000000.0:{0}'.format(
+            today.isoformat()), version=version()), price)
+
+        # Without a cache every process shares, nothing is kept across
+        # requests.
+        with self.settings(VERSIONED_CACHE=False):
+            share_price(20000000)
+            self.assertIsNone(cache.get('captable:share_price:20000000.0:{0}'.format(
+                today.isoformat()), version=version()))
+            with cache_scope():
+                share_price(20000000)
+                with self.assertNumQueries(0):
+                    share_price(20000000)
+
+    def test_memoize(self):
+        with cache_scope():
+            outstanding = self.investor1.outstanding
+            proceeds = self.investor3.proceeds(10000000)
+            diluted_rata = self.series_a.diluted_rata
+            investor = Investor.objects.get(pk=self.investor1.pk)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.investor1.outstanding, outstanding)
+                self.assertEqual(investor.outstanding, outstanding)
+                self.assertEqual(self.investor3.proceeds(10000000), proceeds)
+                self.assertEqual(self.series_a.diluted_rata, diluted_rata)
+
+            # A change to the cap table discards what was remembered.
+            self.certificate1.shares += 1000
+            self.certificate1.save()
+            self.assertEqual(self.investor1.outstanding, outstanding + 1000)
+
+        # Outside of a scope nothing is remembered.
+        with self.assertNumQueries(1):
+            self.investor1.outstanding
+        with self.assertNumQueries(1):
+            self.investor1.outstanding
+
+# Rollups
+    def test_security_rollup(self):
+        def check():
+            snapshot = CapTableSnapshot()
+            for security in Security.objects.select_related('rollup'):
+                rollup = security.rollup
+                self.assertEqual(rebuild(security, check=True), [])
+                self.assertEqual(rollup.authorized, snapshot.authorized(security))
+                self.assertAlmostEqual(
+                    rollup.outstanding, snapshot.outstanding(security), 4)
+                if security.security_type != SECURITY_TYPE_CONVERTIBLE:
+                    self.assertAlmostEqual(
+                        rollup.converted, snapshot.converted(security), 4)
+                    self.assertAlmostEqual(
+                        rollup.diluted, snapshot.diluted(security) or 0, 4)
+
+        check()
+        self.certificate3.returned = 1000
+        self.certificate3.save()
+        self.certificate4.security = self.common
+        self.certificate4.save()
+        self.certificate1.delete()
+        AdditionFactory(security=self.option_plan, authorized=5000)
+        check()
+
+        # Saving two copies of the same certificate applies the
+        # difference from the row as stored, not as each was loaded.
+        first = Certificate.objects.get(pk=self.certificate3.pk)
+        second = Certificate.objects.get(pk=self.certificate3.pk)
+        first.shares = 200
+        first.save()
+        second.shares = 300
+        second.save()
+        check()
+
+        # A missing rollup is calculated for the summary, not written.
+        SecurityRollup.objects.filter(security=self.series_b).delete()
+        self.assertAlmostEqual(
+            summary_context()['total']['outstanding'],
+            CapTableSnapshot().outstanding(), 4)
+        self.assertFalse(
+            SecurityRollup.objects.filter(security=self.series_b).exists())
+        rebuild(self.series_b)
+
+        # Rows changed without signals are caught by the rebuild.
+        Certificate.objects.filter(pk=self.certificate3.pk).update(returned=0)
+        self.assertEqual(
+            [t for t, stored, calculated in rebuild(self.series_a)],
+            ['outstanding', 'converted', 'diluted'])
+        check()
+        Certificate.objects.filter(pk=self.certificate3.pk).update(returned=10)
+        self.assertRaises(
+            CommandError, call_command, 'rebuild_rollups', check=True,
+            stdout=StringIO())
+        call_command('rebuild_rollups', stdout=StringIO())
+        check()
+
+    def test_summary_rollups(self):
+        snapshot = CapTableSnapshot()
+        with self.assertNumQueries(2):
+            context = summary_context()
+        for row in context['securities']:
+            security = Security.objects.get(slug=row['slug'])
+            self.assertAlmostEqual(
+                row['outstanding_rata'], snapshot.outstanding_rata(security), 6)
+            self.assertAlmostEqual(
+                row['converted'], snapshot.converted(security), 4)
+            self.assertAlmostEqual(
+                row['diluted_rata'], snapshot.diluted_rata(security), 6)
+        self.assertAlmostEqual(
+            context['total']['diluted'], snapshot.fully_diluted, 4)
+        self.assertAlmostEqual(
+            context['options']['available'], snapshot.options_available, 4)
+
+# Snapshot
+    def test_snapshot_queries(self):
+        with self.assertNumQueries(5):
+            snapshot = CapTableSnapshot()
+        with self.assertNumQueries(0):
+            snapshot.share_price(25000000)
+            snapshot.proforma(10000000, 40000000, .2)
+
+        # The totals are calculated once, so the prorata of each investor
+        # only walks its own certificates.
+        walked = []
+        certificates_for = snapshot.certificates_for
+        snapshot.certificates_for = lambda obj=None: (
+            walked.append(obj) or certificates_for(obj))
+        for investor in snapshot.investors:
+            snapshot.prorata(1000000, investor)
+            snapshot.outstanding_rata(investor)
+        self.assertEqual(walked, [
+            i for i in snapshot.investors for n in range(2)])
+
+    def test_snapshot_certificates(self):
+        snapshot = CapTableSnapshot()
+        for c in Certificate.objects.all():
+            for attr in ['outstanding', 'paid', 'converted', 'diluted',
+                         'liquidated', 'preference', 'vested']:
+                self.assertAlmostEqual(
+                    getattr(snapshot, attr)(c), getattr(c, attr), 2)
+            self.assertAlmostEqual(
+                snapshot.proceeds(25000000, c), c.proceeds(25000000), 2)
+            self.assertAlmostEqual(
+                snapshot.prorata(1000000, c), c.prorata(1000000), 2)
+
+    def test_snapshot_investors(self):
+        snapshot = CapTableSnapshot()
+        for i in Investor.objects.all():
+            for attr in ['outstanding', 'paid', 'liquidated', 'preference']:
+                self.assertAlmostEqual(
+                    getattr(snapshot, attr)(i), getattr(i, attr), 2)
+            self.assertAlmostEqual(
+                snapshot.proceeds(10000000, i), i.proceeds(10000000), 2)
+            self.assertAlmostEqual(
+                snapshot.proceeds_rata(10000000, i), i.proceeds_rata(10000000), 4)
+            self.assertAlmostEqual(
+                snapshot.exchanged(i), i.exchanged(), 2)
+
+    def test_snapshot_securities(self):
+        snapshot = CapTableSnapshot()
+        for s in Security.objects.all():
+            for attr in ['authorized', 'outstanding', 'converted', 'diluted',
+                         'outstanding_rata', 'converted_rata', 'diluted_rata']:
+                self.assertAlmostEqual(
+                    getattr(snapshot, attr)(s), getattr(s, attr), 4)
+        self.assertEqual(snapshot.fully_diluted, Security.objects.diluted)
+        self.assertEqual(
+            snapshot.options_available,
+            Security.objects.filter(security_type=SECURITY_TYPE_OPTION).available)
+
+    def test_snapshot_share_price(self):
+        snapshot = CapTableSnapshot()
+        for purchase_price in [1000000, 10000000, 25000000, 100000000]:
+            self.assertEqual(
+                snapshot.share_price(purchase_price), share_price(purchase_price))
+
+    def test_snapshot_proforma(self):
+        snapshot = CapTableSnapshot()
+        expected = proforma(10000000, 40000000, .2)
+        for key, value in snapshot.proforma(10000000, 40000000, .2).items():
+            self.assertAlmostEqual(value, expected[key], 4)
+
+    def test_snapshot_share_price_curve(self):
+        snapshot = CapTableSnapshot()
+        prices = [p * 1000000 for p in range(1, 101)]
+        with self.assertNumQueries(0):
+            curve = snapshot.share_price_curve(prices)
+        for n, purchase_price in enumerate(prices):
+            price = snapshot.share_price(purchase_price)
+            for x in price:
+                self.assertAlmostEqual(curve['share_price'][x][n], price[x], 6)
+            for i in snapshot.investors:
+                self.assertAlmostEqual(
+                    curve['investors'][i.pk][n],
+                    snapshot.proceeds(purchase_price, i, price), 2)
+
+        # Series B and the convertible are covered at their preference.
+        covered = [b for b in curve['breakpoints'] if b['seniority'] == 3][0]
+        self.assertEqual(covered['from'], WATERFALL_SHORTFALL)
+        self.assertEqual(covered['to'], WATERFALL_PREFERENCE)
+        self.assertAlmostEqual(covered['purchase_price'], 6100006, -1)
+
+    def test_as_of(self):
+        three_years_ago = today - relativedelta(years=3)
+        snapshot = CapTableSnapshot(three_years_ago)
+        self.assertEqual(
+            sorted(c.name for c in snapshot.certificates),
+            ['certificate1', 'certificate2'])
+        self.assertEqual(snapshot.outstanding(), 7000000)
+        self.assertEqual(
+            snapshot.authorized(self.common),
+            Addition.objects.filter(
+                security=self.common, date__lte=three_years_ago).aggregate(
+                    Sum('authorized'))['authorized__sum'])
+        self.assertAlmostEqual(
+            snapshot.vested(self.certificate1),
+            self.certificate1.vesting_schedule.vested(three_years_ago))
+        self.assertLess(snapshot.vested(), CapTableSnapshot().vested())
+
+        # Notes only accrue interest up to the date.
+        self.assertLess(
+            CapTableSnapshot(six_months_ago).preference(self.certificate6),
+            self.certificate6.accrued)
+        current = CapTableSnapshot(today)
+        self.assertEqual(
+            current.preference(self.certificate6), self.certificate6.accrued)
+        self.assertEqual(
+            summary_context(today)['total'], summary_context()['total'])
+
+        response = self.client.get(
+            '/summary/?as_of={0}'.format(three_years_ago.isoformat()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total']['outstanding'], 7000000)
+        response = self.client.get(
+            '/liquidation/10000000?as_of={0}'.format(three_years_ago.isoformat()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/summary/?as_of=someday').status_code, 400)
+
+        # Dates before the first issue render an empty cap table.
+        before = (five_years_ago - relativedelta(years=1)).isoformat()
+        response = self.client.get('/summary/?as_of={0}'.format(before))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total']['outstanding'], 0)
+        self.assertEqual(response.context['options']['available'], 0)
+        for url in [
+                '/summary.csv', '/liquidation/10000000',
+                '/liquidation/10000000.csv']:
+            response = self.client.get('{0}?as_of={1}'.format(url, before))
+            self.assertEqual(response.status_code, 200)
+            list(getattr(response, 'streaming_content', []))
+        # There's no price to finance at before anything is issued.
+        for url in [
+                '/financing/10000000,40000000,20',
+                '/financing/10000000,40000000,20.csv']:
+            response = self.client.get('{0}?as_of={1}'.format(url, before))
+            self.assertEqual(response.status_code, 400)
+
+    def test_create_indexes(self):
+        out = StringIO()
+        call_command('create_indexes', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), '0 indexes missing.\n')
+
+        # A table that predates the index has it created.
+        field = Certificate._meta.get_field('date')
+        statement, = connection.creation.sql_indexes_for_field(
+            Certificate, field, no_style())
+        connection.cursor().execute('DROP INDEX {0}'.format(statement.split()[2]))
+        out = StringIO()
+        call_command('create_indexes', stdout=out)
+        self.assertEqual(out.getvalue(), statement + '\n1 indexes created.\n')
+        self.assertIn('date', connection.introspection.get_indexes(
+            connection.cursor(), Certificate._meta.db_table))
+
+# Waterfall Solver
+    def test_waterfall_solver(self):
+        snapshot = CapTableSnapshot()
+        with self.assertNumQueries(0):
+            solver = snapshot.waterfall_solver()
+        for purchase_price in [p * 250000 for p in range(0, 401)]:
+            price = snapshot.share_price(purchase_price)
+            solved = solver.share_price(purchase_price)
+            for x in price:
+                self.assertAlmostEqual(solved[x], price[x], 6)
+
+        # The exact breakpoints agree with the sweep.
+        curve = snapshot.share_price_curve(
+            [p * 1000000 for p in range(1, 101)])
+        for b in curve['breakpoints']:
+            self.assertIn(
+                (b['seniority'], b['from'], b['to']),
+                [(s['seniority'], s['from'], s['to'])
+                 for s in solver.breakpoints])
+        self.assertAlmostEqual(
+            solver.coverage_price(3), 6100006, -1)
+
+        # Series A converts once its share of the residual beats its
+        # preference, and Series B after it.
+        self.assertAlmostEqual(solver.conversion_price(2), 11478888, 0)
+        self.assertAlmostEqual(solver.conversion_price(3), 21031058.4, 1)
+        for x in [2, 3]:
+            conversion_price = solver.conversion_price(x)
+            below = {}
+            above = {}
+            liquidate(conversion_price - 1, snapshot.liquidated(), 3,
+                      snapshot.tranche, below)
+            liquidate(conversion_price + 1, snapshot.liquidated(), 3,
+                      snapshot.tranche, above)
+            self.assertNotEqual(below[x], WATERFALL_CONVERTED)
+            self.assertEqual(above[x], WATERFALL_CONVERTED)
+
+# Financing Rounds
+    def test_financing_rounds(self):
+        snapshot = CapTableSnapshot()
+        with self.assertNumQueries(0):
+            first = snapshot.finance(Financing(10000000, 40000000, .2))
+            second = first.finance(Financing(
+                30000000, 120000000, .15, name='Series C',
+                prorata={self.investor1.pk: 0}))
+
+        # The first round is the same as the proforma of the cap table.
+        financing, terms = first.rounds[0]
+        proforma = snapshot.proforma(10000000, 40000000, .2)
+        self.assertAlmostEqual(terms['price'], proforma['price'])
+        self.assertAlmostEqual(
+            first.outstanding(),
+            snapshot.outstanding() + proforma['new_money_shares']
+            + proforma['new_converted_shares'])
+        self.assertAlmostEqual(
+            first.options_available,
+            snapshot.options_available + proforma['new_pool_shares'])
+        self.assertFalse([
+            c for c in first.certificates
+            if c.security.security_type == SECURITY_TYPE_CONVERTIBLE])
+
+        # Each round leaves the snapshot it was applied to as it was.
+        self.assertEqual(
+            len(snapshot.certificates), Certificate.objects.count())
+        self.assertEqual(len(first.rounds), 1)
+        self.assertEqual(len(second.rounds), 2)
+        self.assertGreater(second.rounds[1][1]['price'], terms['price'])
+
+        # Prorata declined goes to the new investors.
+        self.assertEqual(
+            second.outstanding(self.investor1), first.outstanding(self.investor1))
+        series = [s for s in second.securities if s.name == 'Series C'][0]
+        self.assertAlmostEqual(
+            second.outstanding(series), second.rounds[1][1]['new_money_shares'])
+
+        # The result can be liquidated like any other cap table.
+        self.assertAlmostEqual(second.proceeds(500000000), 500000000, 2)
+        self.assertEqual(second.share_price(1000000)[series.seniority],
+                         1000000 / second.tranche(series.seniority).shares)
+
+# Scenario Grids
+    def test_scenario_grid(self):
+        snapshot = CapTableSnapshot()
+        axes = [[5000000, 10000000], [20000000, 40000000, 60000000], [0, .2]]
+        columns, rows = evaluate_grid('financing', axes, snapshot, chunk_size=5)
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(
+            rows[1][columns.index('price')],
+            snapshot.proforma(5000000, 20000000, .2)['price'])
+        self.assertEqual(
+            evaluate_grid(
+                'financing', axes, snapshot, processes=2, chunk_size=5),
+            (columns, rows))
+
+        columns, rows = evaluate_grid(
+            'liquidation', [[1000000, 10000000]], snapshot, processes=2,
+            chunk_size=1)
+        self.assertAlmostEqual(
+            rows[1][columns.index(self.investor1.name)],
+            self.investor1.proceeds(10000000))
+
+        out = StringIO()
+        call_command(
+            'scenario_grid', 'financing', new_money='5000000:10000000:5000000',
+            pre_valuation='20000000,40000000', pool_rata='20', processes=1,
+            stdout=out)
+        lines = list(csv.reader(out.getvalue().splitlines()))
+        self.assertEqual(lines[0][:3], ['new_money', 'pre_valuation', 'pool_rata'])
+        self.assertEqual(len(lines), 5)
+        with self.assertRaises(CommandError):
+            call_command('scenario_grid', 'liquidation', stdout=StringIO())
+
+# Vesting
+    def test_vesting_schedule(self):
+        today = datetime.date.today()
+        for c in Certificate.objects.select_related('security'):
+            schedule = c.vesting_schedule
+            self.assertAlmostEqual(schedule.vested(today), c.vested, 4)
+            dates = [date for date, vested in schedule.steps]
+            self.assertEqual(dates, sorted(dates))
+
+        self.certificate1.vesting_start = datetime.date(2012, 1, 31)
+        self.certificate1.vesting_stop = None
+        self.certificate1.vesting_term = 48
+        self.certificate1.vesting_cliff = 12
+        self.certificate1.vesting_immediate = .25
+        schedule = self.certificate1.vesting_schedule
+        stake = self.certificate1.outstanding
+        self.assertEqual(schedule.vested(datetime.date(2012, 1, 1)), stake * .25)
+        self.assertEqual(schedule.vested(datetime.date(2013, 1, 30)), stake * .25)
+        self.assertEqual(
+            schedule.vested(datetime.date(2013, 1, 31)), stake * (.25 + .75 / 4))
+        self.assertEqual(
+            schedule.vested(datetime.date(2013, 3, 1)), stake * (.25 + .75 * 13 / 48))
+        self.assertEqual(schedule.vested(datetime.date(2020, 1, 1)), stake)
+
+        snapshot = CapTableSnapshot()
+        timeline = snapshot.vesting_timeline()
+        self.assertAlmostEqual(timeline.vested(), snapshot.vested(), 2)
+        self.assertAlmostEqual(
+            Certificate.objects.vesting_timeline.vested(), snapshot.vested(), 2)
+        self.assertAlmostEqual(
+            snapshot.vesting_timeline(self.investor1).vested(),
+            snapshot.vested(self.investor1), 2)
+        series = timeline.series(datetime.date(2010, 1, 1), today, 6)
+        self.assertEqual(
+            [vested for date, vested in series],
+            sorted(vested for date, vested in series))
+
+# Ownership History
+    def test_ownership_history(self):
+        snapshot = CapTableSnapshot()
+        history = ownership_history()
+        self.assertEqual(history['dates'], sorted(set(history['dates'])))
+        self.assertEqual(history['dates'][0], five_years_ago)
+        self.assertAlmostEqual(history['total'][-1], snapshot.fully_diluted, 2)
+        for i in history['investors']:
+            self.assertAlmostEqual(
+                i['shares'][-1], snapshot.diluted(Investor(pk=i['pk'])), 2)
+            self.assertEqual(len(i['rata']), len(history['dates']))
+        founder = [
+            i for i in history['investors'] if i['pk'] == self.investor1.pk][0]
+        self.assertEqual(founder['shares'][0], 3500000)
+        self.assertLess(founder['rata'][-1], founder['rata'][0])
+
+        with self.assertNumQueries(0):
+            ownership_history()
+        response = self.client.get('/api/ownership/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content)['dates'][0], five_years_ago.isoformat())
+
+# Vectorized
+    @skipIf(numpy is None, "NumPy is not installed")
+    def test_vectorized_certificates(self):
+        arrays = CertificateArrays()
+        certificates = dict((c.pk, c) for c in Certificate.objects.all())
+        for attr in ['outstanding', 'paid', 'converted', 'diluted',
+                     'vested', 'liquidated', 'preference']:
+            for pk, value in zip(arrays.id, getattr(arrays, attr)):
+                self.assertAlmostEqual(
+                    value, getattr(certificates[pk], attr), 4)
+        for pk, value in zip(arrays.id, arrays.exchanged(40000000, 2.62314)):
+            self.assertAlmostEqual(
+                value, certificates[pk].exchanged(40000000, 2.62314), 4)
+        self.assertAlmostEqual(
+            arrays.total('liquidated'), Certificate.objects.liquidated, 2)
+        self.assertAlmostEqual(
+            arrays.total('outstanding', by='investor')[self.investor1.pk],
+            self.investor1.outstanding, 2)
+
+    @skipIf(numpy is None, "NumPy is not installed")
+    def test_vectorized_months_vested(self):
+        starts = [
+            datetime.date(2012, 1, 31), datetime.date(2012, 2, 29),
+            datetime.date(2013, 3, 15), datetime.date(2013, 12, 31)]
+        stops = [
+            datetime.date(2012, 2, 29), datetime.date(2013, 2, 28),
+            datetime.date(2013, 3, 14), datetime.date(2014, 6, 30),
+            datetime.date(2011, 12, 31), datetime.date(2012, 1, 30)]
+        for start in starts:
+            for stop in stops:
+                self.certificate1.vesting_start = start
+                self.certificate1.vesting_stop = stop
+                self.certificate1.save()
+                arrays = CertificateArrays(
+                    Certificate.objects.filter(pk=self.certificate1.pk))
+                rd = relativedelta(stop, start)
+                self.assertEqual(arrays.months_vested[0], rd.years * 12 + rd.months)
+                self.assertAlmostEqual(arrays.vested[0], self.certificate1.vested, 4)
+
+    @skipIf(numpy is None, "NumPy is not installed")
+    def test_simulation(self):
+        arrays = CertificateArrays()
+        prices = numpy.array([0, 1000000, 10000000, 100000000])
+        investors, proceeds = payouts(arrays, prices)
+        snapshot = CapTableSnapshot()
+        for n, purchase_price in enumerate(prices):
+            price = snapshot.share_price(purchase_price)
+            for i, pk in enumerate(investors):
+                self.assertAlmostEqual(
+                    proceeds[n, i],
+                    snapshot.proceeds(purchase_price, Investor(pk=pk), price), 2)
+
+        # Later exits vest more shares and accrue more interest.
+        investors, later = payouts(
+            arrays, prices, numpy.array([0, 0, 0, 36]))
+        self.assertTrue((later[:3] == proceeds[:3]).all())
+        self.assertAlmostEqual(later[3].sum(), 100000000, 2)
+        self.assertFalse((later[3] == proceeds[3]).all())
+
+        results = simulate(
+            samples=1000, exit_months=('uniform', 0, 24), seed=1,
+            batch_size=300, arrays=arrays)
+        parallel = simulate(
+            samples=1000, exit_months=('uniform', 0, 24), seed=1,
+            batch_size=300, arrays=arrays, processes=2)
+        self.assertEqual(results, parallel)
+        self.assertEqual(len(results['investors']), len(investors))
+        for investor in results['investors']:
+            percentiles = [investor['percentiles'][p] for p in PERCENTILES]
+            self.assertEqual(percentiles, sorted(percentiles))
+
+# Benchmarks
+    def test_benchmarks(self):
+        results = run_benchmarks(
+            [10], repeat=1, only=['views.summary', 'managers.share_price'])
+        self.assertEqual(
+            [r['target'] for r in results],
+            ['views.summary', 'managers.share_price'])
+        self.assertEqual(results[0]['queries'], 2)
+        for result in results:
+            self.assertGreaterEqual(result['peak_memory_kb'], 0)
+        self.assertEqual(Certificate.objects.count(), 10)
+        self.assertEqual(
+            set(Security.objects.values_list('security_type', flat=True)),
+            set([SECURITY_TYPE_COMMON, SECURITY_TYPE_PREFERRED,
+                 SECURITY_TYPE_CONVERTIBLE, SECURITY_TYPE_OPTION,
+                 SECURITY_TYPE_WARRANT]))
+
+# Generators and Importers
+    def test_generate_captable(self):
+        clear_captable()
+        created = generate_captable(
+            investors=20, options=50, rounds=3, convertibles=4, warrants=2,
+            seed=1)
+        self.assertEqual(created['certificates'], Certificate.objects.count())
+        self.assertEqual(Investor.objects.count(), 2 + 20 + 25 + 2)
+        self.assertEqual(
+            Certificate.objects.filter(
+                security__security_type=SECURITY_TYPE_OPTION).count(), 50)
+        self.assertEqual(
+            Security.objects.filter(
+                security_type=SECURITY_TYPE_PREFERRED).count(), 3)
+        for security in Security.objects.all():
+            self.assertEqual(rebuild(security, check=True), [])
+        self.assertGreater(
+            sum(share_price(100000000).values()), 0)
+        self.assertRaises(
+            CommandError, call_command, 'generate_captable', stdout=StringIO())
+
+        # Notes need someone to hold them.
+        with self.assertRaisesRegexp(CommandError, 'hold the convertible notes'):
+            call_command(
+                'generate_captable', clear=True, founders=0, investors=0,
+                options=0, warrants=0, rounds=0, convertibles=1,
+                stdout=StringIO())
+        self.assertTrue(Security.objects.exists())
+
+    def test_import_certificates(self):
+        rows = [
+            'Name,Shareholder,Investor,Security,Security Type,Date,Shares,Cash,Is_Prorata',
+            'certificate10,VP Fund IV,Venture Partners,Series A,Preferred,2013-01-15,"100,000","$62,500",yes',
+            'certificate11,New Angel,,series-a,,1/15/2013,1000,625,no',
+        ]
+        outstanding = self.series_a.outstanding
+        result = import_certificates(StringIO('\n'.join(rows)))
+        self.assertEqual(result.errors, [])
+        self.assertEqual(result.created, 2)
+        certificate = Certificate.objects.get(slug='certificate10')
+        self.assertEqual(certificate.shares, 100000)
+        self.assertEqual(certificate.date, datetime.date(2013, 1, 15))
+        self.assertTrue(certificate.is_prorata)
+        self.assertEqual(certificate.shareholder.investor, self.investor3)
+        self.assertEqual(
+            Shareholder.objects.get(name='New Angel').investor.name, 'New Angel')
+        self.assertEqual(self.series_a.outstanding, outstanding + 101000)
+        self.assertEqual(rebuild(self.series_a, check=True), [])
+
+        # Nothing is written if any row is invalid.
+        rows = [
+            'name,shareholder,security,security_type,shares,date',
+            'certificate12,Eric Baker,Series A,Common,1000,2013-01-15',
+            'certificate13,Eric Baker,Series Z,,1000,2013-01-15',
+            'certificate14,Eric Baker,Series A,,lots,2013-01-15',
+            'certificate10,Eric Baker,Series A,,1000,2013-01-15',
+            'certificate15,Eric Baker,Series A,,1000,2013-01-15',
+        ]
+        result = import_certificates(StringIO('\n'.join(rows)))
+        self.assertEqual([line for line, message in result.errors], [2, 3, 4, 5])
+        self.assertFalse(Certificate.objects.filter(slug='certificate15').exists())
+
+        result = import_certificates(
+            StringIO('\n'.join(rows[:1] + rows[-1:])), dry_run=True)
+        self.assertEqual((result.errors, result.created), ([], 1))
+        self.assertFalse(Certificate.objects.filter(slug='certificate15').exists())
+
+        # Shareholders of the same name are told apart by their investor.
+        rows = [
+            'name,shareholder,investor,security,shares,date',
+            'certificate16,Family Trust,Joe Founder,Series A,1000,2013-01-15',
+            'certificate17,Family Trust,Venture Partners,Series A,1000,2013-01-15',
+            'certificate18,Family Trust,Joe Founder,Series A,1000,2013-01-15',
+        ]
+        result = import_certificates(StringIO('\n'.join(rows)))
+        self.assertEqual(result.errors, [])
+        self.assertEqual(
+            [Certificate.objects.get(slug=slug).shareholder.investor
+             for slug in ['certificate16', 'certificate17', 'certificate18']],
+            [self.investor1, self.investor3, self.investor1])
+        self.assertEqual(Shareholder.objects.filter(name='Family Trust').count(), 2)
+
+        rows = [
+            'name,shareholder,security,shares,date',
+            u'certificate19,Zo\xeb Trust,S\xe9rie Z,1000,2013-01-15',
+        ]
+        with tempfile.NamedTemporaryFile(suffix='.csv') as f:
+            f.write(u'\n'.join(rows).encode('utf-8'))
+            f.flush()
+            err = StringIO()
+            self.assertRaises(
+                CommandError, call_command, 'import_certificates', f.name,
+                stdout=StringIO(), stderr=err)
+        self.assertIn(u'Unknown security S\xe9rie Z', err.getvalue().decode('utf-8'))
+
+# Views
     def test_view_home(self):
         response = self.client.get('/')
         self.assertEqual(response.status_code, 200)
@@ -565,3 +1379,127 @@ class MainTests(TestCase):
     def test_liquidation_summary(self):
         response = self.client.get('/liquidation/10000000')
         self.assertEqual(response.status_code, 200)
+
+    def test_exports(self):
+        for url, rows in [
+                ('/summary.csv', Security.objects.count() + 3),
+                ('/financing/10000000,40000000,20.csv', None),
+                ('/liquidation/10000000.csv', Investor.objects.count() + 2),
+                ('/certificate.csv', Certificate.objects.count() + 1)]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'text/csv')
+            lines = list(csv.reader(''.join(response.streaming_content).splitlines()))
+            if rows:
+                self.assertEqual(len(lines), rows)
+
+        ledger_rows = dict((row[0], row) for row in lines[1:])
+        self.assertEqual(
+            ledger_rows['certificate3'][5], shares(self.certificate3.outstanding))
+        self.assertEqual(
+            ledger_rows['certificate3'][6], currency(self.certificate3.paid))
+        self.assertEqual(
+            [row['name'] for row in ledger(chunk_size=2)],
+            list(Certificate.objects.order_by('pk').values_list('name', flat=True)))
+
+    def test_scenarios(self):
+        body = json.dumps({'scenarios': [
+            {'type': 'financing', 'new_money': 10000000,
+             'pre_valuation': 40000000, 'pool_rata': .2},
+            {'type': 'liquidation', 'purchase_price': 10000000},
+            {'type': 'liquidation', 'purchase_price': 100000000},
+        ]})
+        # Every scenario is evaluated against the same snapshot.
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                '/api/scenarios/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEqual(len(results), 3)
+
+        financing = financing_context(10000000, 40000000, .2)
+        self.assertEqual(
+            [i['post_shares'] for i in results[0]['investors']],
+            [i['post_shares'] for i in financing['financing']])
+        self.assertEqual(len(results[0]['securities']), Security.objects.count() + 1)
+
+        liquidation = results[2]
+        self.assertAlmostEqual(
+            sum(s['proceeds'] for s in liquidation['securities']),
+            liquidation['total']['proceeds'])
+        investors = dict(
+            (i['slug'], i['proceeds']) for i in liquidation['investors'])
+        self.assertAlmostEqual(
+            investors[self.investor1.slug], self.investor1.proceeds(100000000))
+
+        financing = {'type': 'financing', 'new_money': 10000000,
+                     'pre_valuation': 40000000, 'pool_rata': .2}
+        invalid = [
+            {'type': 'liquidation', 'purchase_price': 0},
+            {'type': 'liquidation', 'purchase_price': -10000000},
+            {'type': 'liquidation', 'purchase_price': 'nan'},
+            {'type': 'liquidation', 'purchase_price': 'inf'},
+            dict(financing, new_money=0),
+            dict(financing, pre_valuation=0),
+            dict(financing, pre_valuation='nan'),
+            dict(financing, pool_rata=1),
+            dict(financing, pool_rata=-.1),
+        ]
+        before = (five_years_ago - relativedelta(years=1)).isoformat()
+        for body in ['nonsense', '{}', json.dumps({'scenarios': [{'type': 'ipo'}]}),
+                     json.dumps({'scenarios': [{'type': 'liquidation'}]}),
+                     json.dumps({'scenarios': [financing], 'as_of': before})] + [
+                     json.dumps({'scenarios': [scenario]}) for scenario in invalid]:
+            response = self.client.post(
+                '/api/scenarios/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', json.loads(response.content))
+        self.assertEqual(self.client.get('/api/scenarios/').status_code, 405)
+
+    def test_summary_cached(self):
+        response = self.client.get('/financing/10000000,40000000,20')
+        with self.assertNumQueries(0):
+            cached = self.client.get('/financing/10000000,40000000,20')
+        # The page is stamped with the time it was rendered.
+        for key in ['financing', 'total']:
+            self.assertEqual(cached.context[key], response.context[key])
+        self.certificate1.save()
+        with self.assertNumQueries(5):
+            self.client.get('/financing/10000000,40000000,20')
+
+# Query Budgets
+    def test_query_budget(self):
+        with query_budget(5) as recorder:
+            response = self.client.get('/certificate/')
+        self.assertEqual(response['X-Query-Count'], str(len(recorder.queries)))
+        self.assertEqual(
+            recorder.templates['certificate_list.html']['renders'], 1)
+
+        # Totalling each investor in turn is an N+1, traced back
+        # to the property that runs the query.
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with query_budget() as recorder:
+                for investor in Investor.objects.all():
+                    investor.outstanding
+        self.assertIn('N+1', str(raised.exception))
+        self.assertIn('(certificate_totals) < ', str(raised.exception))
+        self.assertIn('(outstanding)', str(raised.exception))
+        self.assertEqual(
+            recorder.repeated()[0]['count'], Investor.objects.count())
+        # Only queries that repeat are traced to their callers.
+        self.assertEqual(
+            [q.caller is not None for q in recorder.queries[:3]],
+            [False, False, True])
+
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(0):
+                list(Security.objects.all())
+
+        # Views over their budget fail.
+        with self.settings(QUERY_BUDGETS={'investor_list': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/investor/')
+
+        # Outside of development and tests the middleware isn't used.
+        with self.settings(QUERY_BUDGET_ENABLED=False):
+            self.assertRaises(MiddlewareNotUsed, QueryBudgetMiddleware)
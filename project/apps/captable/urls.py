@@ -10,6 +10,14 @@ urlpatterns = patterns(
     url(r'liquidation/(?P<purchase_price>\d+)$', 'liquidation_summary', name='liquidation_summary'),
     url(r'financing/(?P<new_money>\d+),(?P<pre_valuation>\d+),(?P<pool_rata>\d+)$', 'financing_summary', name='financing_summary'),
 
+    url(r'summary\.csv$', 'summary_export', name='summary_export'),
+    url(r'liquidation/(?P<purchase_price>\d+)\.csv$', 'liquidation_export', name='liquidation_export'),
+    url(r'financing/(?P<new_money>\d+),(?P<pre_valuation>\d+),(?P<pool_rata>\d+)\.csv$', 'financing_export', name='financing_export'),
+    url(r'certificate\.csv$', 'certificate_export', name='certificate_export'),
+
+    url(r'api/scenarios/$', 'scenarios', name='scenarios'),
+    url(r'api/ownership/$', 'ownership', name='ownership'),
+
     url(r'security/$', 'security_list', name='security_list'),
     url(r'investor/$', 'investor_list', name='investor_list'),
     url(r'certificate/$', 'certificate_list', name='certificate_list'),
@@ -0,0 +1,325 @@
+from __future__ import division
+
+import copy
+import datetime
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import get_model
+
+from .constants import *
+
+from .managers import Tranche
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# The certificate columns, and the terms of their security, loaded into
+# arrays.  Missing numbers are loaded as NaN and missing dates as NaT.
+NUMBER_FIELDS = [
+    'shares', 'returned', 'cash', 'refunded', 'principal', 'forgiven',
+    'granted', 'exercised', 'cancelled', 'vesting_term', 'vesting_cliff',
+    'vesting_immediate', 'vested_direct']
+TERM_FIELDS = [
+    'conversion_ratio', 'liquidation_preference', 'price_per_share',
+    'price_cap', 'discount_rate', 'interest_rate', 'pre']
+DATE_FIELDS = ['date', 'converted_date', 'vesting_start', 'vesting_stop']
+
+METRICS = [
+    'outstanding', 'paid', 'accrued', 'converted', 'diluted', 'vested',
+    'liquidated', 'preference']
+
+
+class CertificateArrays(object):
+    """A columnar, NumPy-backed view of the certificates.
+
+    The certificate properties branch on the security type of each
+    certificate in turn, which is fine for a page of certificates but
+    slow for option tables with hundreds of thousands of grants.  This
+    loads the certificates, and the terms of their securities, into
+    arrays in one query and calculates each metric for every certificate
+    at once with masked array operations.  The results are the same as
+    the scalar properties on ``Certificate``.
+
+    NumPy is an optional dependency; it is only required to use this
+    class.
+    """
+
+    def __init__(self, certificates=None, today=None):
+        if numpy is None:
+            raise ImproperlyConfigured(
+                "CertificateArrays requires NumPy to be installed.")
+        if certificates is None:
+            certificates = get_model('captable', 'Certificate').objects.all()
+        if today is None:
+            today = datetime.date.today()
+        self.today = numpy.datetime64(today, 'D')
+
+        fields = (
+            ['id', 'security', 'shareholder__investor', 'is_prorata',
+             'vesting_trigger', 'security__security_type',
+             'security__seniority', 'security__is_participating',
+             'security__participation_cap'] +
+            NUMBER_FIELDS + DATE_FIELDS +
+            ['security__' + f for f in TERM_FIELDS])
+        rows = list(certificates.order_by().values_list(*fields))
+        columns = zip(*rows) if rows else [()] * len(fields)
+        columns = dict(zip(fields, columns))
+
+        def numbers(values, dtype=float):
+            return numpy.array(
+                [numpy.nan if v is None else v for v in values], dtype=dtype)
+
+        def dates(values):
+            return numpy.array(
+                [numpy.datetime64(v, 'D') if v else numpy.datetime64('NaT')
+                 for v in values], dtype='datetime64[D]')
+
+        self.id = numpy.array(columns['id'], dtype=int)
+        self.security = numpy.array(columns['security'], dtype=int)
+        self.investor = numpy.array(columns['shareholder__investor'], dtype=int)
+        self.is_prorata = numpy.array(columns['is_prorata'], dtype=bool)
+        self.trigger = numpy.array(
+            [-1 if v is None else v for v in columns['vesting_trigger']], dtype=int)
+        self.security_type = numpy.array(
+            columns['security__security_type'], dtype=int)
+        self.seniority = numpy.array(columns['security__seniority'], dtype=int)
+        self.is_participating = numpy.array(
+            columns['security__is_participating'], dtype=bool)
+        self.participation_cap = numbers(columns['security__participation_cap'])
+        for f in NUMBER_FIELDS:
+            setattr(self, f, numbers(columns[f]))
+        for f in TERM_FIELDS:
+            setattr(self, f, numbers(columns['security__' + f]))
+        for f in DATE_FIELDS:
+            setattr(self, f, dates(columns[f]))
+
+        self.is_common = self.security_type == SECURITY_TYPE_COMMON
+        self.is_preferred = self.security_type == SECURITY_TYPE_PREFERRED
+        self.is_convertible = self.security_type == SECURITY_TYPE_CONVERTIBLE
+        self.is_option = self.security_type == SECURITY_TYPE_OPTION
+        self.is_warrant = self.security_type == SECURITY_TYPE_WARRANT
+        self.is_right = self.is_option | self.is_warrant
+
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.id)
+
+    def at(self, today):
+        """Return the same certificates as of another date.
+
+        Vesting and accrued interest are calculated as of ``today``; the
+        arrays themselves are shared rather than loaded again.
+        """
+        arrays = copy.copy(self)
+        arrays.today = numpy.datetime64(today, 'D')
+        arrays._cache = {}
+        return arrays
+
+    def _cached(self, name, calculate):
+        if name not in self._cache:
+            self._cache[name] = calculate()
+        return self._cache[name]
+
+    @property
+    def outstanding(self):
+        return self._cached('outstanding', lambda: numpy.where(
+            self.is_common | self.is_preferred,
+            self.shares - self.returned,
+            numpy.where(
+                self.is_right,
+                self.granted - self.cancelled - self.exercised,
+                0.0)))
+
+    @property
+    def paid(self):
+        return self._cached('paid', lambda: numpy.where(
+            self.is_common | self.is_preferred | self.is_warrant,
+            self.cash - self.refunded,
+            numpy.where(
+                self.is_convertible,
+                self.principal - self.forgiven,
+                0.0)))
+
+    @property
+    def accrued(self):
+        """Accrued debt of each convertible, and NaN for everything else."""
+        def calculate():
+            converted_date = numpy.where(
+                numpy.isnat(self.converted_date), self.today, self.converted_date)
+            days = (converted_date - self.date).astype(float)
+            interest = self.principal * self.interest_rate * days / 365
+            return numpy.where(
+                self.is_convertible,
+                _round(self.principal + interest, 2),
+                numpy.nan)
+        with numpy.errstate(invalid='ignore'):
+            return self._cached('accrued', calculate)
+
+    def exchanged(self, pre_valuation=None, price=None):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            if pre_valuation:
+                shares = self.discounted(pre_valuation) / price
+            else:
+                shares = self.accrued / self.price_per_share
+            return numpy.where(self.is_convertible, shares, 0.0)
+
+    def discounted(self, pre_valuation=None):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            discounted = self.accrued / (1 - self.discount_rate)
+            if pre_valuation:
+                capped = self.accrued * (pre_valuation / self.price_cap)
+            else:
+                capped = self.accrued * (self.pre / self.price_cap)
+            return numpy.where(
+                self.is_convertible, numpy.maximum(discounted, capped), 0.0)
+
+    @property
+    def converted(self):
+        return self._cached('converted', lambda: numpy.where(
+            self.is_preferred,
+            self.outstanding * self.conversion_ratio,
+            numpy.where(
+                self.is_convertible,
+                self.exchanged(),
+                numpy.where(self.is_right, 0.0, self.outstanding))))
+
+    @property
+    def diluted(self):
+        return self._cached('diluted', lambda: numpy.where(
+            self.is_preferred,
+            self.outstanding * self.conversion_ratio,
+            numpy.where(
+                self.is_convertible,
+                self.exchanged(),
+                numpy.where(
+                    self.is_right,
+                    self.granted - self.cancelled - self.exercised,
+                    self.outstanding))))
+
+    @property
+    def months_vested(self):
+        """Whole months from the vesting start to the stop (or today).
+
+        Matches ``relativedelta(vesting_stop, vesting_start)``: the
+        difference in calendar months, less one if the day of the month
+        has not yet been reached, with the day clamped to the end of
+        shorter months.
+        """
+        def calculate():
+            stop = numpy.where(
+                numpy.isnat(self.vesting_stop), self.today, self.vesting_stop)
+            start = self.vesting_start
+            start_month = start.astype('datetime64[M]')
+            stop_month = stop.astype('datetime64[M]')
+            months = (stop_month - start_month).astype(float)
+            start_day = (start - start_month).astype(float) + 1
+            stop_day = (stop - stop_month).astype(float) + 1
+            month_days = ((stop_month + 1).astype('datetime64[D]')
+                          - stop_month.astype('datetime64[D]')).astype(float)
+            anniversary = numpy.minimum(start_day, month_days)
+            months -= (stop >= start) & (stop_day < anniversary)
+            months += (stop < start) & (stop_day > anniversary)
+            return numpy.where(numpy.isnat(start), numpy.nan, months)
+        return self._cached('months_vested', calculate)
+
+    @property
+    def vested(self):
+        def calculate():
+            stake = self.outstanding
+            immediate = stake * self.vesting_immediate
+            residual = stake - immediate
+            months = self.months_vested
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                # A missing term always compares as fully vested, and a
+                # missing cliff never holds anything back.
+                full = numpy.isnan(self.vesting_term) | (months > self.vesting_term)
+                cliff = ~full & (months < self.vesting_cliff)
+                partial = residual / self.vesting_term * months
+            residual_vested = numpy.where(
+                full, residual, numpy.where(cliff, 0.0, partial))
+            standard = immediate + residual_vested
+
+            is_direct = ~numpy.isnan(self.vested_direct) & (self.vested_direct != 0)
+            return numpy.where(
+                self.is_preferred, self.outstanding,
+                numpy.where(
+                    self.is_convertible, self.exchanged(),
+                    numpy.where(
+                        is_direct, self.vested_direct,
+                        numpy.where(
+                            self.trigger == TRIGGER_SINGLE, self.outstanding,
+                            standard))))
+        return self._cached('vested', calculate)
+
+    @property
+    def liquidated(self):
+        return self._cached('liquidated', lambda: numpy.where(
+            self.is_preferred,
+            self.shares * self.conversion_ratio,
+            numpy.where(
+                self.is_convertible,
+                self.exchanged(),
+                numpy.where(self.is_warrant, self.granted, self.vested))))
+
+    @property
+    def preference(self):
+        return self._cached('preference', lambda: numpy.where(
+            self.is_preferred,
+            self.outstanding * self.price_per_share * self.liquidation_preference,
+            numpy.where(self.is_convertible, self.accrued, 0.0)))
+
+    def total(self, metric, by=None):
+        """Total a metric over all certificates.
+
+        With ``by`` set to ``'security'`` or ``'investor'`` a dictionary
+        of totals keyed by the primary key of each is returned instead.
+        """
+        values = numpy.nan_to_num(getattr(self, metric))
+        if by is None:
+            return float(values.sum())
+        keys = getattr(self, by)
+        if not len(keys):
+            return {}
+        unique, index = numpy.unique(keys, return_inverse=True)
+        sums = numpy.bincount(index, weights=values)
+        return dict(zip(unique.tolist(), sums.tolist()))
+
+    def tranche(self, seniority):
+        """Return the ``Tranche`` of certificates at a seniority."""
+        mask = self.seniority == seniority
+        participating = mask & self.is_participating
+        participation_cap = None
+        if participating.any():
+            participation_cap = self.participation_cap[participating][0]
+            if numpy.isnan(participation_cap):
+                participation_cap = None
+        return Tranche(
+            float(numpy.nan_to_num(self.liquidated[mask]).sum()),
+            float(numpy.nan_to_num(self.preference[mask]).sum()),
+            bool(participating.any()),
+            participation_cap)
+
+    def waterfall_solver(self):
+        """Return a ``WaterfallSolver`` for the tranches of the certificates."""
+        from .solver import WaterfallSolver
+        seniority = int(self.seniority.max()) if len(self) else None
+        return WaterfallSolver(
+            self.total('liquidated'), seniority, self.tranche)
+
+    def summary(self, by=None):
+        """Total every metric; see ``total``."""
+        return dict((metric, self.total(metric, by)) for metric in METRICS)
+
+
+def _round(values, digits):
+    # Python 2 rounds halves away from zero, where NumPy rounds them
+    # to even, so round the same way as the scalar ``accrued``.
+    scale = 10 ** digits
+    return numpy.where(
+        values >= 0,
+        numpy.floor(values * scale + 0.5),
+        numpy.ceil(values * scale - 0.5)) / scale
@@ -0,0 +1,137 @@
+from __future__ import division
+
+import datetime
+from bisect import bisect_right
+
+from dateutil.relativedelta import relativedelta
+
+from .constants import *
+
+
+def months_between(start, stop):
+    """Whole months from one date to another, as ``vested`` counts them."""
+    rd = relativedelta(stop, start)
+    return rd.years * 12 + rd.months
+
+
+def anniversary(start, months):
+    """Return the first date a whole number of months after a date."""
+    date = start + relativedelta(months=months)
+    # Adding months clamps to the end of shorter months, which can fall
+    # short of a full month since the start.
+    while months_between(start, date) < months:
+        date += datetime.timedelta(1)
+    return date
+
+
+class Schedule(object):
+    """The vesting of a certificate, as a step function of the date.
+
+    ``base`` shares are vested at every date, and ``steps`` is the list of
+    ``(date, vested)`` at which the vested shares change, in order of
+    date.  A standard grant vests its ``immediate`` portion up front,
+    nothing until its cliff, the months of the cliff at once and then a
+    step every month until the end of its term, or until vesting stops.
+    Everything else -- preferred stock, convertibles, single triggers and
+    ad-hoc vesting -- is vested in full at every date.
+    """
+
+    def __init__(self, base, steps=None):
+        self.base = base
+        self.steps = steps or []
+        self._dates = [date for date, vested in self.steps]
+
+    @classmethod
+    def for_certificate(cls, certificate):
+        """Build the schedule of anything shaped like a certificate."""
+        c = certificate
+        security_type = c.security.security_type
+        if security_type in [SECURITY_TYPE_PREFERRED, SECURITY_TYPE_CONVERTIBLE]:
+            return cls(c.vested)
+        if c.vested_direct or c.vesting_trigger == TRIGGER_SINGLE:
+            return cls(c.vested)
+
+        stake = c.outstanding
+        immediate = stake * c.vesting_immediate
+        residual = stake - immediate
+        term = c.vesting_term
+        # Without a term or a start there's nothing to vest over time.
+        if not term or not c.vesting_start:
+            return cls(stake)
+
+        cliff = c.vesting_cliff
+        steps = []
+        vested = immediate
+        months = 0
+        while True:
+            if months > term:
+                value = immediate + residual
+            elif cliff is not None and months < cliff:
+                value = immediate
+            else:
+                value = immediate + residual / term * months
+            date = anniversary(c.vesting_start, months)
+            if c.vesting_stop and date > c.vesting_stop:
+                break
+            if value != vested:
+                steps.append((date, value))
+                vested = value
+            if months > term:
+                break
+            months += 1
+        return cls(immediate, steps)
+
+    def vested(self, date):
+        """Return the vested shares as of a date."""
+        n = bisect_right(self._dates, date)
+        if not n:
+            return self.base
+        return self.steps[n - 1][1]
+
+
+class VestingTimeline(object):
+    """The cumulative vesting of many certificates.
+
+    The schedules of every certificate are merged into one sorted array
+    of dates and the running total of the shares vested, so the vested
+    shares as of any date are a binary search away, however many grants
+    there are.
+    """
+
+    def __init__(self, certificates):
+        self.base = 0
+        changes = {}
+        for c in certificates:
+            schedule = c.vesting_schedule
+            self.base += schedule.base or 0
+            previous = schedule.base or 0
+            for date, vested in schedule.steps:
+                changes[date] = changes.get(date, 0) + vested - previous
+                previous = vested
+
+        self.dates = sorted(changes)
+        self.totals = []
+        total = self.base
+        for date in self.dates:
+            total += changes[date]
+            self.totals.append(total)
+
+    def vested(self, date=None):
+        """Return the total shares vested as of a date, by default today."""
+        if date is None:
+            date = datetime.date.today()
+        n = bisect_right(self.dates, date)
+        if not n:
+            return self.base
+        return self.totals[n - 1]
+
+    def series(self, start, stop, months=1):
+        """Return ``(date, vested)`` every few months across a range."""
+        series = []
+        date = start
+        n = 0
+        while date <= stop:
+            series.append((date, self.vested(date)))
+            n += months
+            date = start + relativedelta(months=n)
+        return series
@@ -1,11 +1,18 @@
 from __future__ import division
 
+import json
+from functools import wraps
+
 from django.shortcuts import (
     render,
     get_object_or_404,
     get_list_or_404)
 
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.utils.dateparse import parse_date
 
 from django.db.models import (
     Sum,
@@ -14,12 +21,25 @@ from django.db.models import (
 from .models import (
     Shareholder,
     Security,
+    SecurityRollup,
     Investor,
     Certificate)
 
-from .managers import (
-    share_price,
-    proforma as proforma2
+from .rollups import calculate, TOTALS
+
+from .snapshot import CapTableSnapshot
+
+from .cache import versioned
+
+from .history import ownership_history
+
+from .exports import (
+    stream_csv,
+    ledger,
+    SUMMARY_COLUMNS,
+    FINANCING_COLUMNS,
+    LIQUIDATION_COLUMNS,
+    LEDGER_COLUMNS,
 )
 
 from .constants import *
@@ -28,7 +48,7 @@ from .constants import *
 # @login_required
 def investor_list(request):
     """Renders the investor table"""
-    investors = get_list_or_404(Investor.objects.order_by('name'))
+    investors = get_list_or_404(Investor.objects.with_totals().order_by('name'))
     return render(request, "investor_list.html", {'investors': investors})
 
 
@@ -40,10 +60,17 @@ def security_list(request):
 
 # @login_required
 def certificate_list(request):
-    certificates = get_list_or_404(Certificate.objects.order_by('name'))
+    certificates = get_list_or_404(Certificate.objects.select_related(
+        'security', 'shareholder__investor').order_by('name'))
     return render(request, "certificate_list.html", {'certificates': certificates})
 
 
+# @login_required
+def certificate_export(request):
+    """Streams the certificate ledger as CSV."""
+    return stream_csv('certificates.csv', LEDGER_COLUMNS, ledger())
+
+
 # @login_required
 def security_detail(request, security):
     security = get_object_or_404(Security, slug__iexact=security)
@@ -61,17 +88,164 @@ def certificate_detail(request, certificate):
     certificate = get_object_or_404(Certificate, slug__iexact=certificate)
     return render(request, "certificate_detail.html", {'certificate': certificate})
 
-def summary(request):
+def dated(view):
+    """Pass the date of an ``as_of`` query to a view, or None if there isn't one.
+
+    A view given a date shows the cap table as it stood on that date; see
+    ``CapTableSnapshot``.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        as_of = request.GET.get('as_of')
+        if as_of:
+            try:
+                as_of = parse_date(as_of)
+            except ValueError:
+                as_of = None
+            if as_of is None:
+                return HttpResponseBadRequest(
+                    "The as_of date must be given as YYYY-MM-DD.")
+        kwargs['as_of'] = as_of or None
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def unissued(as_of):
+    """Return a bad request if nothing had been issued as of a date.
+
+    A financing prices the shares already issued, so there is nothing to
+    price before the first certificate.
+    """
+    if as_of is not None and not Certificate.objects.filter(
+            date__lte=as_of).exists():
+        return HttpResponseBadRequest(
+            "Nothing had been issued as of {0}.".format(as_of.isoformat()))
+
+
+def dated_key(key, as_of):
+    if as_of is None:
+        return key
+    return '{0}:{1}'.format(key, as_of.isoformat())
+
+
+@dated
+def summary(request, as_of=None):
     """Renders the summary cap table."""
-    securities = Security.objects.select_related().order_by('security_type', 'date')
-    options_available = securities.filter(security_type=SECURITY_TYPE_OPTION).available
-    options_available_rata = options_available / securities.diluted
+    context = versioned(
+        dated_key('captable:summary', as_of), lambda: summary_context(as_of))
+    return render(request, 'summary.html', context)
+
+
+@dated
+def summary_export(request, as_of=None):
+    """Streams the summary cap table as CSV."""
+    context = versioned(
+        dated_key('captable:summary', as_of), lambda: summary_context(as_of))
+    total = dict(context['total'], name='Total')
+    options = {
+        'name': 'Options Available',
+        'diluted': context['options']['available'],
+        'diluted_rata': context['options']['available_rata'],
+    }
+    return stream_csv(
+        'summary.csv', SUMMARY_COLUMNS,
+        context['securities'] + [options, total])
+
+
+def summary_context(as_of=None):
+    if as_of is not None:
+        return dated_summary_context(CapTableSnapshot(as_of))
+
+    # The share totals of each security are read from its rollup, except
+    # for convertibles, which accrue, and are calculated as needed.
+    accrued = {}
+    for c in Certificate.objects.select_related('security').filter(
+            security__security_type=SECURITY_TYPE_CONVERTIBLE):
+        accrued[c.security_id] = sum(filter(
+            None, [accrued.get(c.security_id), c.converted]))
+
+    securities = []
+    for security in Security.objects.select_related('rollup').order_by(
+            'security_type', 'date'):
+        try:
+            rollup = dict((t, getattr(security.rollup, t)) for t in TOTALS)
+        except SecurityRollup.DoesNotExist:
+            # Rollups are only written as the cap table is; one that is
+            # missing is calculated, and left to ``rebuild_rollups``.
+            rollup = calculate(security)
+        converted = rollup['converted']
+        diluted = rollup['diluted']
+        if security.security_type == SECURITY_TYPE_CONVERTIBLE:
+            converted = diluted = accrued.get(security.pk, 0)
+        securities.append({
+            'name': security.name,
+            'slug': security.slug,
+            'security_type': security.security_type,
+            'conversion_ratio': security.conversion_ratio,
+            'authorized': rollup['authorized'],
+            'outstanding': rollup['outstanding'],
+            'converted': converted,
+            'diluted': diluted,
+        })
+    return summary_totals(securities)
+
+
+def dated_summary_context(snapshot):
+    """Calculate the summary cap table from a snapshot, as of its date."""
+    securities = []
+    for security in sorted(
+            snapshot.securities, key=lambda s: (s.security_type, s.date)):
+        securities.append({
+            'name': security.name,
+            'slug': security.slug,
+            'security_type': security.security_type,
+            'conversion_ratio': security.conversion_ratio,
+            'authorized': snapshot.authorized(security),
+            'outstanding': snapshot.outstanding(security),
+            'converted': snapshot.converted(security),
+            'diluted': snapshot.diluted(security),
+        })
+    return summary_totals(securities)
+
+
+def summary_totals(securities):
+    """Total the rows of the summary cap table and calculate their rata."""
+    types = dict(
+        choice for group in Security.SECURITY_TYPE for choice in group[1])
+    for s in securities:
+        s['security_type_display'] = types.get(s['security_type'])
+
+    total = {
+        'outstanding': sum(filter(None, [s['outstanding'] for s in securities])),
+        'converted': sum(filter(None, [s['converted'] for s in securities])),
+        'diluted': sum(filter(None, [s['diluted'] for s in securities])),
+    }
+
+    # The diluted rata counts the options granted as well as those
+    # authorized, as ``Security.diluted_rata`` does.
+    options = [
+        s for s in securities if s['security_type'] == SECURITY_TYPE_OPTION]
+    diluted_rata_total = total['diluted'] + sum(
+        filter(None, [s['outstanding'] for s in options]))
+    # Before anything is issued the totals are nothing, and so is the
+    # rata of every security.
+    def rata(shares, total):
+        return (shares or 0) / total if total else 0
+
+    for s in securities:
+        s['outstanding_rata'] = rata(s['outstanding'], total['outstanding'])
+        s['converted_rata'] = rata(s['converted'], total['converted'])
+        s['diluted_rata'] = rata(s['diluted'], diluted_rata_total)
+
+    # Plans without additions as of the date have nothing authorized.
+    options_available = sum(
+        (s['authorized'] or 0) - (s['outstanding'] or 0) for s in options)
+    options_available_rata = rata(options_available, total['diluted'])
     options = {
         'available': options_available,
         'available_rata': options_available_rata,
     }
-    return render(
-        request, 'summary.html', {'securities': securities, 'options': options})
+    return {'securities': securities, 'total': total, 'options': options}
 
 def financing_instructions(request):
     return render(request, 'financing_instructions.html')
@@ -81,7 +255,8 @@ def liquidation_instructions(request):
     return render(request, 'liquidation_instructions.html')
 
 
-def financing_summary(request, new_money, pre_valuation, pool_rata):
+@dated
+def financing_summary(request, new_money, pre_valuation, pool_rata, as_of=None):
     """Renders the financing table"""
 
     # capture the parameters from the URL
@@ -89,11 +264,44 @@ def financing_summary(request, new_money, pre_valuation, pool_rata):
     pre_valuation = float(pre_valuation)
     pool_rata = float(pool_rata)/100
 
-    # calculate the proforma from those inputs
-    proforma = proforma2(new_money, pre_valuation, pool_rata)
+    error = unissued(as_of)
+    if error is not None:
+        return error
+
+    context = versioned(
+        dated_key('captable:financing:{0!r}:{1!r}:{2!r}'.format(
+            new_money, pre_valuation, pool_rata), as_of),
+        lambda: financing_context(
+            new_money, pre_valuation, pool_rata, CapTableSnapshot(as_of)))
+    return render(request, 'financing_summary.html', context)
+
+
+@dated
+def financing_export(request, new_money, pre_valuation, pool_rata, as_of=None):
+    """Streams the financing table as CSV."""
+    new_money = float(new_money)
+    pre_valuation = float(pre_valuation)
+    pool_rata = float(pool_rata)/100
+
+    error = unissued(as_of)
+    if error is not None:
+        return error
+
+    context = versioned(
+        dated_key('captable:financing:{0!r}:{1!r}:{2!r}'.format(
+            new_money, pre_valuation, pool_rata), as_of),
+        lambda: financing_context(
+            new_money, pre_valuation, pool_rata, CapTableSnapshot(as_of)))
+    return stream_csv(
+        'financing.csv', FINANCING_COLUMNS,
+        context['financing'] + [context['total']])
+
 
-    # get all certificates
-    certificates = Certificate.objects.select_related()
+def financing_context(new_money, pre_valuation, pool_rata, snapshot=None):
+    # load the cap table once, and calculate the proforma from those inputs
+    if snapshot is None:
+        snapshot = CapTableSnapshot()
+    proforma = snapshot.proforma(new_money, pre_valuation, pool_rata)
 
     # populate individual variables for ease of use
     price = proforma['price']
@@ -106,8 +314,8 @@ def financing_summary(request, new_money, pre_valuation, pool_rata):
     new_converted_shares = proforma['new_converted_shares']
     available = proforma['available']
 
-    pre_shares = certificates.outstanding + available
-    pre_cash = certificates.paid
+    pre_shares = snapshot.outstanding() + available
+    pre_cash = snapshot.paid()
     new_shares = new_investor_shares + new_prorata_shares + new_converted_shares + new_pool_shares
     new_cash = new_investor_cash + new_prorata_cash
     post_shares = pre_shares + new_shares
@@ -125,11 +333,6 @@ def financing_summary(request, new_money, pre_valuation, pool_rata):
         'post_cash': post_cash,
     }
 
-    # get the objects needed for the detail
-    certificates = Certificate.objects.select_related()
-    securities = Security.objects.select_related()
-
-
     # Instantiate the context
     financing = []
 
@@ -152,19 +355,22 @@ def financing_summary(request, new_money, pre_valuation, pool_rata):
         'post_rata': new_investor_rata,
     })
 
-    # Get the current investor objects
-    investors = Investor.objects.order_by('shareholder')
+    # Get the current investors, ordered by shareholder
+    investors = [s.investor for s in sorted(
+        snapshot.shareholders, key=lambda s: s.name)]
+    holders = set(investors)
+    investors += [i for i in snapshot.investors if i not in holders]
 
     for i in investors:
         name = i.name
         slug = i.slug
-        pre_shares = i.outstanding
-        pre_cash = i.paid
+        pre_shares = snapshot.outstanding(i)
+        pre_cash = snapshot.paid(i)
         pre_rata = pre_shares / total['pre_shares']
 
-        prorata_shares = i.prorata(new_money_shares)
+        prorata_shares = snapshot.prorata(new_money_shares, i)
         prorata_cash = prorata_shares * price
-        converted_shares = i.exchanged(pre_valuation, price)
+        converted_shares = snapshot.exchanged(i, pre_valuation, price)
         converted_cash = 0
 
         new_shares = prorata_shares + converted_shares
@@ -194,8 +400,7 @@ def financing_summary(request, new_money, pre_valuation, pool_rata):
         })
 
     # Create and append the available option list
-    available_pre_shares = securities.filter(
-        security_type=SECURITY_TYPE_OPTION).available
+    available_pre_shares = snapshot.options_available
     available_pre_rata = available_pre_shares / total['pre_shares']
     available_post_shares = available_pre_shares + new_pool_shares
     available_post_rata = available_post_shares / total['post_shares']
@@ -213,35 +418,194 @@ def financing_summary(request, new_money, pre_valuation, pool_rata):
         'post_rata': available_post_rata
     })
 
-    return render(request, 'financing_summary.html', {'financing': financing, 'total': total})
+    return {'financing': financing, 'total': total, 'proforma': proforma}
 
 
 # @login_required
-def liquidation_summary(request, purchase_price):
+@dated
+def liquidation_summary(request, purchase_price, as_of=None):
     """Renders the liquidation analysis."""
     purchase_cash = float(purchase_price)
-    # round_price = share_price(purchase_cash)
     # order_by = request.GET.get('order_by', 'shareholder__investor')
 
-    investors = Investor.objects.select_related().order_by('name')
-    certificates = Certificate.objects.select_related()
+    context = versioned(
+        dated_key('captable:liquidation:{0!r}'.format(purchase_cash), as_of),
+        lambda: liquidation_context(purchase_cash, CapTableSnapshot(as_of)))
+    return render(request, 'liquidation_summary.html', context)
+
+
+@dated
+def liquidation_export(request, purchase_price, as_of=None):
+    """Streams the liquidation analysis as CSV."""
+    purchase_cash = float(purchase_price)
+    context = versioned(
+        dated_key('captable:liquidation:{0!r}'.format(purchase_cash), as_of),
+        lambda: liquidation_context(purchase_cash, CapTableSnapshot(as_of)))
+    total = dict(context['total'], name='Total', proceeds_rata=1)
+    return stream_csv(
+        'liquidation.csv', LIQUIDATION_COLUMNS,
+        context['liquidation'] + [total])
+
+
+def liquidation_context(purchase_cash, snapshot=None):
+    # The waterfall is the same for every certificate in the table,
+    # so load the table and calculate it once up front and share it.
+    if snapshot is None:
+        snapshot = CapTableSnapshot()
+    price = snapshot.share_price(purchase_cash)
 
     total = {
-        'proceeds': certificates.proceeds(purchase_cash),
-        'preference': certificates.preference,
-        'liquidated': certificates.liquidated,
+        'proceeds': snapshot.proceeds(purchase_cash, None, price),
+        'preference': snapshot.preference(),
+        'liquidated': snapshot.liquidated(),
     }
 
     liquidation = []
-    for investor in investors:
+    for investor in snapshot.investors:
+        proceeds = snapshot.proceeds(purchase_cash, investor, price)
         liquidation.append({
             'name': investor.name,
             'slug': investor.slug,
-            'preference': investor.preference,
-            'liquidated': investor.liquidated,
-            'proceeds': investor.proceeds(purchase_cash),
-            'proceeds_rata': investor.proceeds(purchase_cash) / total['proceeds']
+            'preference': snapshot.preference(investor),
+            'liquidated': snapshot.liquidated(investor),
+            'proceeds': proceeds,
+            'proceeds_rata': (
+                proceeds / total['proceeds'] if total['proceeds'] else 0),
         })
 
-    return render(
-            request, 'liquidation_summary.html', {'liquidation': liquidation, 'total': total})
+    return {'liquidation': liquidation, 'total': total}
+
+
+def ownership(request):
+    """Returns the fully diluted ownership history as JSON, for charts."""
+    history = dict(ownership_history())
+    history['dates'] = [d.isoformat() for d in history['dates']]
+    return HttpResponse(json.dumps(history), content_type='application/json')
+
+
+SCENARIO_INPUTS = {
+    'financing': ['new_money', 'pre_valuation', 'pool_rata'],
+    'liquidation': ['purchase_price'],
+}
+
+
+def scenario_input(n, name, value):
+    """Read an input of a scenario.
+
+    Amounts of money have to be positive and finite, and the
+    ``pool_rata`` a fraction from zero up to one.
+    """
+    value = float(value)
+    if name == 'pool_rata':
+        valid = 0 <= value < 1
+    else:
+        valid = 0 < value < float('inf')
+    if not valid:
+        raise ValueError("Scenario {0} has an invalid {1} {2!r}".format(
+            n, name, value))
+    return value
+
+
+@csrf_exempt
+@require_POST
+def scenarios(request):
+    """Evaluates a batch of financing and liquidation scenarios.
+
+    Takes a JSON object with a list of ``scenarios``, each with a
+    ``type`` of ``financing`` (with ``new_money``, ``pre_valuation`` and
+    ``pool_rata`` as a fraction) or ``liquidation`` (with a
+    ``purchase_price``.)  All of them are evaluated against the same
+    snapshot of the cap table, as of the date ``as_of`` if one is given,
+    and the results returned in order, each broken down by investor and
+    by security.
+    """
+    try:
+        data = json.loads(request.body)
+        scenarios = data['scenarios']
+        as_of = data.get('as_of')
+        if as_of:
+            as_of = parse_date(as_of)
+            if as_of is None:
+                raise ValueError("The as_of date must be given as YYYY-MM-DD")
+        inputs = []
+        for n, scenario in enumerate(scenarios):
+            kind = scenario.get('type')
+            if kind not in SCENARIO_INPUTS:
+                raise ValueError(
+                    "Scenario {0} has an unknown type {1!r}".format(n, kind))
+            inputs.append(dict(
+                [('type', kind)] +
+                [(k, scenario_input(n, k, scenario[k]))
+                 for k in SCENARIO_INPUTS[kind]]))
+        snapshot = CapTableSnapshot(as_of or None)
+        # A financing prices the shares already issued; see ``unissued``.
+        if not snapshot.certificates and any(
+                i['type'] == 'financing' for i in inputs):
+            raise ValueError("Nothing had been issued as of {0}".format(
+                as_of.isoformat()))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return HttpResponseBadRequest(
+            json.dumps({'error': unicode(e)}), content_type='application/json')
+
+    results = [evaluate_scenario(scenario, snapshot) for scenario in inputs]
+    return HttpResponse(
+        json.dumps({'results': results}), content_type='application/json')
+
+
+def evaluate_scenario(scenario, snapshot):
+    """Evaluate a single scenario against a snapshot of the cap table."""
+    result = dict(scenario)
+    if scenario['type'] == 'financing':
+        new_money = scenario['new_money']
+        pre_valuation = scenario['pre_valuation']
+        pool_rata = scenario['pool_rata']
+        context = financing_context(
+            new_money, pre_valuation, pool_rata, snapshot)
+        proforma = context['proforma']
+        price = proforma['price']
+
+        securities = []
+        for s in snapshot.securities:
+            pre_shares = snapshot.outstanding(s)
+            new_shares = snapshot.exchanged(s, pre_valuation, price)
+            securities.append({
+                'name': s.name,
+                'slug': s.slug,
+                'pre_shares': pre_shares,
+                'new_shares': new_shares,
+                'post_shares': pre_shares + new_shares,
+            })
+        securities.append({
+            'name': 'New Money',
+            'pre_shares': 0,
+            'new_shares': proforma['new_money_shares'],
+            'post_shares': proforma['new_money_shares'],
+        })
+        result.update({
+            'price': price,
+            'investors': context['financing'],
+            'securities': securities,
+            'total': context['total'],
+        })
+
+    else:
+        purchase_price = scenario['purchase_price']
+        context = liquidation_context(purchase_price, snapshot)
+        price = snapshot.share_price(purchase_price)
+        securities = []
+        for s in snapshot.securities:
+            securities.append({
+                'name': s.name,
+                'slug': s.slug,
+                'seniority': s.seniority,
+                'price': price[s.seniority],
+                'preference': snapshot.preference(s),
+                'liquidated': snapshot.liquidated(s),
+                'proceeds': snapshot.proceeds(purchase_price, s, price),
+            })
+        result.update({
+            'investors': context['liquidation'],
+            'securities': securities,
+            'total': context['total'],
+        })
+    return result
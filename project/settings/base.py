@@ -19,6 +19,17 @@ DATABASE_URL = get_env_variable("DATABASE_URL")
 
 DATABASES = {'default': dj_database_url.config(default=DATABASE_URL)}
 
+# Cap table results are cached under its version, which every web
+# process has to share; without memcached they aren't kept across
+# requests (see VERSIONED_CACHE.)
+if os.environ.get('MEMCACHE_SERVERS'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHE_SERVERS'].split(','),
+        }
+    }
+
 PROJECT_ROOT = Path(__file__).ancestor(2)
 
 PROJECT_NAME = str(PROJECT_ROOT.ancestor(1).name)
@@ -61,6 +72,8 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'apps.captable.middleware.QueryBudgetMiddleware',
+    'apps.captable.middleware.CacheScopeMiddleware',
 )
 
 ROOT_URLCONF = 'urls'
@@ -92,7 +105,11 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
-        }
+        },
+        'console': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django.request': {
@@ -100,9 +117,38 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'apps.captable.middleware': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': True,
+        },
     }
 }
 
+# Count the queries of every view against its budget, which is only
+# worth the overhead in development and tests; see
+# apps.captable.middleware.
+QUERY_BUDGET_ENABLED = False
+# The most queries each view may run, by the name of its URL, whatever
+# the size of the cap table.
+QUERY_BUDGETS = {
+    'summary': 5,
+    'investor_list': 5,
+    'security_list': 2,
+    'certificate_list': 2,
+    'security_detail': 2,
+    'investor_detail': 2,
+    'certificate_detail': 5,
+    'liquidation_summary': 6,
+    'financing_summary': 6,
+    'ownership': 6,
+    'scenarios': 6,
+}
+QUERY_BUDGET_DEFAULT = None
+# Identical SQL run this many times by a view is taken for an N+1.
+QUERY_REPEATED = 3
+QUERY_BUDGET_STRICT = False
+
 INSTALLED_APPS = (
     'django.contrib.auth',
     'django.contrib.contenttypes',
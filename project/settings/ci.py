@@ -9,6 +9,13 @@ INSTALLED_APPS += (
 
 TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
 
+# A single process can keep the versions of the cap table in memory.
+VERSIONED_CACHE = True
+
+# Fail the tests of views over their query budget or repeating queries.
+QUERY_BUDGET_ENABLED = True
+QUERY_BUDGET_STRICT = True
+
 INTERNAL_IPS = ('127.0.0.1',)
 
 
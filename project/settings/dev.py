@@ -16,6 +16,12 @@ MIDDLEWARE_CLASSES += (
 
 TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
 
+# A single process can keep the versions of the cap table in memory.
+VERSIONED_CACHE = True
+
+# Log the views over their query budget or repeating queries.
+QUERY_BUDGET_ENABLED = True
+
 INTERNAL_IPS = ('127.0.0.1',)
 
 DEBUG_TOOLBAR_CONFIG = {